@@ -1,58 +1,65 @@
 # ------------------- CONFIGURACIÓN E IMPORTS -------------------
-from flask import Flask, request, jsonify
-import psycopg2
+from flask import Flask, Response, request, jsonify
+import atexit
+import logging
 import os
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_cors import CORS
-# Importación de Blueprints: cada blueprint agrupa las rutas (endpoints) de un módulo funcional de la API.
-# Esto permite organizar el código y separar la lógica de usuarios, tienda, pagos, emails, etc.
-from users.user import users_bp 
-from users_unlocks.user_unlocks import users_unlocks_bp
-from shop.shop import shop_bp
-from paypal.paypal import paypal_bp
-from emailSend.email import email_bp
-from user_shop.user_shop import userShop_bp
-from current_shop.current_shop import current_shop_bp
-from user_competitive.user_competitive import user_competitive_bp
-from multiplayer.multiplayer import multiplayer_bp
-
-# ------------------- UTILIDADES -------------------
-# Función para obtener una conexión a la base de datos PostgreSQL usando variables de entorno.
-# Centraliza la configuración de conexión y facilita el acceso seguro a la base de datos desde cualquier parte del proyecto.
-def get_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        sslmode=os.getenv("DB_SSLMODE")
-    )
+# Registro de Blueprints (con LAZY_BLUEPRINTS=1 sus módulos se importan en la
+# primera petición que los necesita, ver blueprints.py)
+from blueprints import register_blueprints
+# Conexiones a la base de datos: pool por worker (ver db_pool.py)
+from utils import get_connection, release_request_connections
+from db_pool import pool_stats, close_pool
+# Sentencias preparadas por conexión para las consultas más frecuentes (ver prepared.py)
+import prepared
+# Logs estructurados en JSON con escritura asíncrona (ver app_logging.py)
+import app_logging
+# Métricas por endpoint en formato Prometheus (ver metrics.py)
+import metrics
+# Almacenamiento compartido y costes por ruta del rate limiting (ver rate_limits.py)
+import rate_limits
+
+logger = logging.getLogger(__name__)
 
 # ------------------- INICIALIZACIÓN FLASK -------------------
 # Se crea la instancia principal de la aplicación Flask.
 app = Flask(__name__)
+# Log de acceso y métricas (antes que el resto de middlewares, para medir
+# también las peticiones que estos rechazan)
+app_logging.init_app(app)
+metrics.init_app(app)
 # Configurar CORS para permitir todos los orígenes (puedes restringir si lo deseas)
 CORS(app)
-# Configurar rate limiting global (100 requests por minuto por IP)
-limiter = Limiter(get_remote_address, app=app, default_limits=["100 per minute"])
+# Configurar rate limiting global (100 requests por minuto por IP y ruta, más
+# un presupuesto por IP para toda la API del que cada ruta descuenta su coste).
+# Los contadores se comparten entre todos los workers (ver rate_limits.py).
+# RATELIMIT_ENABLED=0 lo desactiva (p. ej. al ejecutar los benchmarks de bench/)
+app.config["RATELIMIT_ENABLED"] = os.getenv("RATELIMIT_ENABLED", "1") == "1"
+limiter = Limiter(
+    get_remote_address,
+    app=app,
+    default_limits=["100 per minute"],
+    application_limits=[rate_limits.RATELIMIT_APP_LIMIT],
+    application_limits_cost=rate_limits.route_cost,
+    storage_uri=os.getenv("RATELIMIT_STORAGE_URI") or rate_limits.default_storage_uri()
+)
 # Se registran todos los Blueprints en la app principal.
 # Cada blueprint añade sus rutas/endpoints al servidor Flask, permitiendo modularidad y separación de lógica.
-app.register_blueprint(users_bp)                # Rutas de gestión de usuarios
-app.register_blueprint(users_unlocks_bp)        # Rutas de desbloqueos de usuario
-app.register_blueprint(shop_bp)                 # Rutas de la tienda
-app.register_blueprint(paypal_bp)               # Rutas de pagos y PayPal
-app.register_blueprint(email_bp)                # Rutas de envío de emails
-app.register_blueprint(userShop_bp)             # Rutas de relación usuario-tienda
-app.register_blueprint(current_shop_bp)         # Rutas de la tienda actual
-app.register_blueprint(user_competitive_bp)     # Rutas de modo competitivo
-app.register_blueprint(multiplayer_bp)          # Rutas de modo multijugador
+register_blueprints(app)
+# Los webhooks de PayPal llegan desde unas pocas IPs de PayPal: no se limitan
+limiter.exempt(app.view_functions["paypal.paypal_webhook"])
+
+# Al terminar cada petición se devuelven al pool las conexiones que hayan quedado prestadas.
+app.teardown_appcontext(release_request_connections)
+# Al apagar el worker se cierran las conexiones ociosas del pool.
+atexit.register(close_pool)
 
 # ------------------- MIDDLEWARE DE SEGURIDAD -------------------
 @app.before_request
 def security_middleware():
-    # Log detallado de la petición
-    print(f"[SECURITY] {request.method} {request.path} from {request.remote_addr} | User-Agent: {request.headers.get('User-Agent')}")
+    # El log detallado de la petición (IP, User-Agent...) lo escribe app_logging
     # Ejemplo de protección extra: rechazar peticiones con User-Agent vacío (bots)
     if not request.headers.get('User-Agent'):
         return jsonify({"error": "User-Agent requerido"}), 400
@@ -67,7 +74,42 @@ def security_middleware():
 @app.route('/')
 def home():
     return "AstroLeapApi conectada a NeonDB 🚀"
+
+# -----------------------------------------------------------------------------
+# GET /db-pool-stats
+# Devuelve las estadísticas del pool de conexiones del worker que atiende la petición.
+# Respuesta:
+#     200: { "pid", "max_size", "size", "in_use", "idle", "waiting", "checkouts",
+#            "created", "recycled", "healthcheck_failures", "timeouts",
+#            "wait_time_total_ms", "wait_time_avg_ms", "wait_time_max_ms" }
+# -----------------------------------------------------------------------------
+@app.route('/db-pool-stats', methods=['GET'])
+def db_pool_stats():
+    return jsonify(pool_stats() or {"message": "Pool sin inicializar en este worker"})
+
+# -----------------------------------------------------------------------------
+# GET /prepared-statements-stats
+# Devuelve los contadores de sentencias preparadas del worker que atiende la
+# petición (ver prepared.py).
+# Respuesta:
+#     200: { "pid", "enabled", "statements", "prepares", "executions",
+#            "text_executions", "fallbacks" }
+# -----------------------------------------------------------------------------
+@app.route('/prepared-statements-stats', methods=['GET'])
+def prepared_statements_stats():
+    return jsonify(prepared.statements.stats())
  
+# -----------------------------------------------------------------------------
+# GET /metrics
+# Métricas de todos los workers (peticiones por estado, latencia, tamaño de la
+# respuesta y peticiones en curso, por ruta) en formato de texto de Prometheus.
+# Respuesta:
+#     200: text/plain; version=0.0.4
+# -----------------------------------------------------------------------------
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # -----------------------------------------------------------------------------
 # GET /check-user-email/<email>
 # Comprueba si existe un usuario con el email proporcionado.
@@ -78,16 +120,14 @@ def home():
 @app.route('/check-user-email/<email>', methods=['GET'])
 def check_user_email(email):
     try:
-        conn = get_connection()
-        cur = conn.cursor() 
-        cur.execute('SELECT EXISTS (SELECT 1 FROM "user" WHERE email = %s)', (email,))
-        exists = cur.fetchone()[0]
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            prepared.execute_prepared(cur, 'user_email_exists', (email,))
+            exists = cur.fetchone()[0]
+            cur.close()
         return jsonify({"exists": exists})
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
     
 # -----------------------------------------------------------------------------
@@ -110,31 +150,27 @@ def update_password():
         if not email or not new_password:
             return jsonify({"error": "Email y nueva contraseña son requeridos"}), 400
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT password FROM "user" WHERE email = %s', (email,))
-        row = cur.fetchone()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            prepared.execute_prepared(cur, 'user_password_by_email', (email,))
+            row = cur.fetchone()
 
-        if row and row[0] == 'NONE':
-            cur.close()
-            conn.close()
-            return jsonify({"error": "No se puede cambiar la contraseña porque es 'NONE'"}), 400
-
-        # Guardar la nueva contraseña tal cual, sin hashear
-        cur.execute('UPDATE "user" SET password = %s WHERE email = %s', (new_password, email))
-        conn.commit()
-        updated = cur.rowcount
+            if row and row[0] == 'NONE':
+                cur.close()
+                return jsonify({"error": "No se puede cambiar la contraseña porque es 'NONE'"}), 400
 
-        cur.close()
-        conn.close()
+            # Guardar la nueva contraseña tal cual, sin hashear
+            cur.execute('UPDATE "user" SET password = %s WHERE email = %s', (new_password, email))
+            conn.commit()
+            updated = cur.rowcount
+            cur.close()
 
         if updated:
             return jsonify({"message": "Contraseña actualizada correctamente"}), 200
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        print("[SECURITY] Error interno ocultado")
+        logger.exception("[SECURITY] Error interno ocultado")
         return jsonify({"error": "Error interno del servidor"}), 500
 
 # -----------------------------------------------------------------------------
@@ -156,12 +192,11 @@ def verify_password():
         if not email or not password:
             return jsonify({"error": "Email y contraseña son requeridos"}), 400
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT password FROM "user" WHERE email = %s', (email,))
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            prepared.execute_prepared(cur, 'user_password_by_email', (email,))
+            row = cur.fetchone()
+            cur.close()
 
         if row:
             stored_password = row[0]
@@ -176,8 +211,7 @@ def verify_password():
         else:
             return jsonify({"authenticated": False})
     except Exception as e:
-        import traceback
-        print("[SECURITY] Error interno ocultado")
+        logger.exception("[SECURITY] Error interno ocultado")
         return jsonify({"error": "Error interno del servidor"}), 500
 
 if __name__ == '__main__':
@@ -0,0 +1,185 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+# -----------------------------------------------------------------------------
+# LOGS ESTRUCTURADOS
+# Todos los módulos escriben con logging.getLogger(__name__). Los registros se
+# encolan en memoria y un hilo de cada worker los escribe en stdout como una
+# línea JSON compacta, así la petición nunca espera a la E/S de la consola.
+#   - Si la cola (LOG_QUEUE_MAX) está llena, el registro se descarta y se cuenta.
+#   - LOG_LEVEL fija el nivel general (INFO por defecto).
+#   - LOG_SAMPLE_RATE (de 0 a 1) es la fracción de peticiones cuyo log de acceso
+#     y registros DEBUG/INFO se escriben. Los WARNING y ERROR se escriben siempre.
+#   - LOG_ROUTE_SAMPLING y LOG_ROUTE_LEVELS ajustan lo anterior por ruta, con la
+#     regla de Flask tal y como está declarada:
+#         LOG_ROUTE_SAMPLING="/get-shop=0.01,/user_competitive/top/<metric>=0.1"
+#         LOG_ROUTE_LEVELS="/rooms/join=DEBUG"
+# Para añadir campos a un registro:
+#     logger.info("Sala creada", extra={"fields": {"room_code": room_code}})
+# -----------------------------------------------------------------------------
+LOG_LEVEL = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper())
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_routes(value, convert):
+    routes = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        rule, _, setting = item.rpartition("=")
+        routes[rule.strip()] = convert(setting.strip())
+    return routes
+
+
+ROUTE_SAMPLING = _parse_routes(os.getenv("LOG_ROUTE_SAMPLING", ""), float)
+ROUTE_LEVELS = _parse_routes(os.getenv("LOG_ROUTE_LEVELS", ""), lambda level: logging.getLevelName(level.upper()))
+
+
+# -----------------------------------------------------------------------------
+# Formato de línea JSON: {"ts", "level", "logger", "msg", ...campos extra}.
+# -----------------------------------------------------------------------------
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+# -----------------------------------------------------------------------------
+# Filtro que aplica el muestreo y el nivel de la ruta en curso, y añade a cada
+# registro el método y la ruta de la petición.
+# -----------------------------------------------------------------------------
+class RequestFilter(logging.Filter):
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        rule = request.url_rule.rule if request.url_rule else request.path
+        if record.levelno < ROUTE_LEVELS.get(rule, LOG_LEVEL):
+            return False
+        if record.levelno < logging.WARNING and not g.get("_log_sampled", True):
+            return False
+        fields = {"method": request.method, "route": rule}
+        fields.update(getattr(record, "fields", None) or {})
+        record.fields = fields
+        return True
+
+
+# -----------------------------------------------------------------------------
+# Handler que encola los registros sin bloquear. El hilo que los escribe se
+# arranca en el primer registro de cada proceso (también tras un fork).
+# -----------------------------------------------------------------------------
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, target, queue_max=LOG_QUEUE_MAX):
+        super().__init__(queue.Queue(maxsize=queue_max))
+        self.target = target
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    # El mensaje se resuelve aquí (los argumentos pueden cambiar después), pero
+    # el formateo a JSON lo hace el hilo de escritura.
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        listener = self._listener
+        if listener is not None and self._pid == os.getpid():
+            listener.stop()
+            self._listener = None
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._listener is not None and self._pid == pid:
+            return
+        with self._start_lock:
+            if self._listener is not None and self._pid == pid:
+                return
+            if self._pid != pid:
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            listener = logging.handlers.QueueListener(self.queue, self.target)
+            listener.start()
+            self._listener, self._pid = listener, pid
+
+
+_handler = None
+
+
+def configure_logging():
+    global _handler
+    if _handler is not None:
+        return _handler
+    target = logging.StreamHandler(sys.stdout)
+    target.setFormatter(JsonFormatter())
+    _handler = AsyncQueueHandler(target)
+    _handler.addFilter(RequestFilter())
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    # El nivel real lo decide el filtro por ruta; aquí se deja pasar el más bajo
+    # que pueda pedir alguna ruta.
+    root.setLevel(min([LOG_LEVEL, *ROUTE_LEVELS.values()]))
+    atexit.register(_handler.stop)
+    return _handler
+
+
+# -----------------------------------------------------------------------------
+# Registra en la app el log de acceso: una línea por petición muestreada con
+# método, ruta, estado, duración, tamaño de la respuesta, IP y User-Agent.
+# -----------------------------------------------------------------------------
+def init_app(app):
+    configure_logging()
+
+    @app.before_request
+    def start_request_log():
+        g._log_start = time.perf_counter()
+        rule = request.url_rule.rule if request.url_rule else request.path
+        g._log_sampled = random.random() < ROUTE_SAMPLING.get(rule, LOG_SAMPLE_RATE)
+
+    @app.after_request
+    def write_request_log(response):
+        if g.get("_log_sampled") and logger.isEnabledFor(logging.INFO):
+            logger.info("request", extra={"fields": {
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": round((time.perf_counter() - g._log_start) * 1000, 3) if "_log_start" in g else None,
+                # Content-Length; None en las respuestas por trozos (leer su
+                # tamaño obligaría a generarlas enteras aquí)
+                "bytes": response.content_length,
+                "ip": request.remote_addr,
+                "user_agent": request.headers.get("User-Agent"),
+            }})
+        return response
+
+    return app
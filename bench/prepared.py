@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+from bench.run import setup_database
+from db_pool import connect
+from prepared import HOT_STATEMENTS, PreparedStatements
+
+# -----------------------------------------------------------------------------
+# SENTENCIAS PREPARADAS
+# Compara, para cada sentencia de prepared.HOT_STATEMENTS, la consulta enviada
+# como texto (como antes de prepared.py) con la misma consulta preparada y
+# ejecutada por nombre, sobre una única conexión y sin pasar por la API:
+#   - µs por ejecución vistos desde el cliente (mediana de --rounds rondas de
+#     --requests ejecuciones, alternando texto y preparada),
+#   - tiempo de planificación en el servidor según EXPLAIN ANALYZE
+#     ("Planning Time", media de --explain ejecuciones).
+# Usa el mismo esquema sembrado que bench/run.py (se recrea salvo --no-setup).
+#
+# Uso (desde la raíz del repositorio):
+#     python -m bench.prepared
+#     python -m bench.prepared --requests 5000 --no-setup
+# -----------------------------------------------------------------------------
+
+# Valores de ejemplo de los parámetros de cada sentencia
+SAMPLE_PARAMS = {
+    "user_by_email": lambda rng, n: (f"u{rng.randint(1, n)}@bench.local",),
+    "user_by_id": lambda rng, n: (f"u{rng.randint(1, n)}",),
+    "user_password_by_email": lambda rng, n: (f"u{rng.randint(1, n)}@bench.local",),
+    "user_email_exists": lambda rng, n: (f"u{rng.randint(1, n)}@bench.local",),
+    "user_unlocks_by_user": lambda rng, n: (f"u{rng.randint(1, n)}",),
+    "user_shop_by_user": lambda rng, n: (f"u{rng.randint(1, n)}",),
+    "user_competitive_by_user": lambda rng, n: (f"u{rng.randint(1, n)}",),
+    "rooms_first_available": lambda rng, n: (),
+    "room_by_code": lambda rng, n: (f"SEED{rng.randint(1, 200)}",),
+}
+
+
+def run_batch(conn, execute, make_params, count, rng, users):
+    cur = conn.cursor()
+    start = time.perf_counter()
+    for _ in range(count):
+        execute(cur, make_params(rng, users))
+        cur.fetchall()
+        conn.rollback()
+    elapsed = time.perf_counter() - start
+    cur.close()
+    return elapsed / count * 1e6
+
+
+def planning_ms(conn, sql, params):
+    cur = conn.cursor()
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    conn.rollback()
+    cur.close()
+    return plan[0]["Planning Time"]
+
+
+def measure(conn, name, sql, registry, args):
+    rng = random.Random(args.seed)
+    make_params = SAMPLE_PARAMS[name]
+    text = lambda cur, params: cur.execute(sql, params)
+    by_name = lambda cur, params: registry.execute(cur, name, params)
+
+    text_us, prepared_us = [], []
+    for _ in range(args.rounds):
+        text_us.append(run_batch(conn, text, make_params, args.requests, rng, args.users))
+        prepared_us.append(run_batch(conn, by_name, make_params, args.requests, rng, args.users))
+
+    # EXPLAIN ANALYZE EXECUTE: la sentencia ya está preparada en la conexión
+    statement = f"astroleap_{name}"
+    text_plan, prepared_plan = [], []
+    for _ in range(args.explain):
+        params = make_params(rng, args.users)
+        text_plan.append(planning_ms(conn, sql, params))
+        execute_sql = f"EXECUTE {statement}" + (f" ({', '.join(['%s'] * len(params))})" if params else "")
+        prepared_plan.append(planning_ms(conn, execute_sql, params))
+
+    return {
+        "name": name,
+        "text_us": round(statistics.median(text_us), 1),
+        "prepared_us": round(statistics.median(prepared_us), 1),
+        "text_planning_ms": round(statistics.mean(text_plan), 4),
+        "prepared_planning_ms": round(statistics.mean(prepared_plan), 4),
+    }
+
+
+def print_table(results):
+    header = f"{'sentencia':28}{'texto µs':>12}{'prep. µs':>12}{'ahorro':>9}{'plan texto ms':>16}{'plan prep. ms':>16}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        saving = (1 - r["prepared_us"] / r["text_us"]) * 100 if r["text_us"] else 0.0
+        print(f"{r['name']:28}{r['text_us']:>12}{r['prepared_us']:>12}{f'{saving:.0f}%':>9}"
+              f"{r['text_planning_ms']:>16}{r['prepared_planning_ms']:>16}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.prepared", description="Texto frente a sentencias preparadas")
+    parser.add_argument("-k", dest="filters", action="append", default=[], help="solo las sentencias cuyo nombre contenga este texto (repetible)")
+    parser.add_argument("-n", "--requests", type=int, default=2000, help="ejecuciones por ronda y modo (2000)")
+    parser.add_argument("--rounds", type=int, default=5, help="rondas alternando texto y preparada (5)")
+    parser.add_argument("--explain", type=int, default=50, help="EXPLAIN ANALYZE por sentencia y modo (50)")
+    parser.add_argument("--users", type=int, default=10000, help="usuarios sembrados (10000)")
+    parser.add_argument("--seed", type=int, default=1, help="semilla de los generadores aleatorios")
+    parser.add_argument("--schema", default="astroleap_bench", help="esquema de PostgreSQL para las tablas del benchmark")
+    parser.add_argument("--no-setup", action="store_true", help="no recrear ni sembrar el esquema")
+    parser.add_argument("--json", dest="json_path", help="guardar los resultados en este fichero JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = [name for name in HOT_STATEMENTS if not args.filters or any(f in name for f in args.filters)]
+    if not names:
+        raise SystemExit("Ninguna sentencia coincide con los filtros")
+    if not args.no_setup:
+        setup_database(args.schema, args.users)
+
+    os.environ["PGOPTIONS"] = f"-c search_path={args.schema}"
+    conn = connect()
+    registry = PreparedStatements(HOT_STATEMENTS, enabled=True)
+    try:
+        results = [measure(conn, name, HOT_STATEMENTS[name], registry, args) for name in names]
+    finally:
+        conn.close()
+
+    print()
+    print(f"ejecuciones={args.requests} rondas={args.rounds} explain={args.explain} (una conexión, sin la API)")
+    print_table(results)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import psycopg2
+import requests
+
+from bench.stubs import PayPalStub, SmtpStub
+from migrations.migrate import upgrade
+
+# -----------------------------------------------------------------------------
+# BENCHMARKS
+# Arranca la API contra un PostgreSQL local, con PayPal y SMTP sustituidos por
+# los servidores de bench/stubs.py, y mide cada endpoint por separado:
+# peticiones por segundo y latencias p50/p95/p99.
+#
+# Las tablas se crean (con las migraciones de migrations/) y se rellenan en un
+# esquema propio (--schema, astroleap_bench por defecto) que se borra al
+# empezar; la API lo usa gracias a
+# PGOPTIONS=-c search_path=<esquema>, así que nunca toca el esquema public.
+# La conexión se toma de las mismas variables que la API (DB_HOST, DB_NAME,
+# DB_USER, DB_PASSWORD, DB_SSLMODE).
+#
+# Uso (desde la raíz del repositorio):
+#     python -m bench.run                               # todos los endpoints
+#     python -m bench.run -k leaderboard -k rooms       # solo los que coinciden
+#     python -m bench.run --concurrency 32 --requests 2000 --workers 4
+#     python -m bench.run --server werkzeug             # sin gunicorn
+#     python -m bench.run -k paypal -k email --paypal-latency 0.3 --smtp-latency 0.05 \
+#         --worker-class gevent -c 200                   # workers gevent con PayPal/SMTP lentos
+#     python -m bench.run --url http://127.0.0.1:8000   # API ya arrancada
+#     python -m bench.run --json resultados.json
+# -----------------------------------------------------------------------------
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# -----------------------------------------------------------------------------
+# Escenarios: nombre -> función que devuelve (método, ruta, json) para una
+# petición. Reciben un random.Random propio de cada hilo y el número de
+# usuarios sembrados.
+# -----------------------------------------------------------------------------
+_ids = itertools.count()
+
+
+def _user(rng, users):
+    return f"u{rng.randint(1, users)}"
+
+
+def _unique():
+    return f"{next(_ids)}-{uuid.uuid4().hex[:8]}"
+
+
+SCENARIOS = {
+    # users
+    "users.get_users": lambda rng, n: ("GET", "/get-users", None),
+    "users.get_user_by_email": lambda rng, n: ("GET", f"/get-user-by-email/{_user(rng, n)}@bench.local", None),
+    "users.get_user_by_id": lambda rng, n: ("GET", f"/get-user/{_user(rng, n)}", None),
+    "users.bootstrap": lambda rng, n: ("GET", f"/users/{_user(rng, n)}/bootstrap", None),
+    "users.get_aurum_by_id": lambda rng, n: ("GET", f"/get-aurum-by-id/{_user(rng, n)}", None),
+    "users.update_aurum_money": lambda rng, n: ("POST", "/update-aurum-money", {"id": _user(rng, n), "num_aurum_money": rng.randint(0, 5000)}),
+    "users.adjust_balance": lambda rng, n: ("POST", f"/users/{_user(rng, n)}/balance", {"aurum_delta": rng.randint(1, 50), "voren_delta": rng.randint(-5, 5)}),
+    "users.update_skin_selected": lambda rng, n: ("POST", "/update-skin-selected-by-id", {"id": _user(rng, n), "skin_selected": "s1"}),
+    "users.update_selection": lambda rng, n: ("PATCH", f"/users/{_user(rng, n)}/selection", {"icon_selected": "i1", "skin_selected": "s1", "anim_victory": "v1"}),
+    "users.add_user": lambda rng, n: ("POST", "/add-user", {"id": f"new-{(uid := _unique())}", "name": "bench", "email": f"new-{uid}@bench.local", "password": "pw"}),
+    "users.check_user_email": lambda rng, n: ("GET", f"/check-user-email/{_user(rng, n)}@bench.local", None),
+    "users.verify_password": lambda rng, n: ("POST", "/verify-password", {"email": f"{(u := _user(rng, n))}@bench.local", "password": f"pw{u[1:]}"}),
+    # users_unlocks
+    "unlocks.get_user_unlocks": lambda rng, n: ("GET", f"/get-user-unlocks/{_user(rng, n)}", None),
+    "unlocks.add_skin_unlock": lambda rng, n: ("POST", "/add-skin-unlock", {"user_id": _user(rng, n), "skin_unlock": f"s{rng.randint(1, 40)}"}),
+    "unlocks.add_unlocks": lambda rng, n: ("POST", "/add-unlocks", {"user_id": _user(rng, n), "icon_profile": [f"ic{rng.randint(1, 20)}"], "skins_unlock": [f"s{rng.randint(1, 40)}"]}),
+    # shop / current_shop / user_shop
+    "shop.get_shop": lambda rng, n: ("GET", "/get-shop", None),
+    "shop.get_shop_item": lambda rng, n: ("GET", f"/get-shop-item/{rng.randint(1, 40)}", None),
+    "current_shop.get": lambda rng, n: ("GET", "/current_shop", None),
+    "user_shop.get_user_shops": lambda rng, n: ("GET", f"/user_shop/{_user(rng, n)}", None),
+    # user_competitive
+    "competitive.get": lambda rng, n: ("GET", f"/user_competitive/{_user(rng, n)}", None),
+    "competitive.top10_trophies": lambda rng, n: ("GET", "/user_competitive/top10-trophies", None),
+    "competitive.leaderboard_page": lambda rng, n: ("GET", "/user_competitive/leaderboard/trophies?limit=50", None),
+    "competitive.rank": lambda rng, n: ("GET", f"/user_competitive/{_user(rng, n)}/rank", None),
+    "competitive.set_trophies": lambda rng, n: ("PUT", f"/user_competitive/set-trophies/{_user(rng, n)}", {"trophies": rng.randint(0, 5000)}),
+    "competitive.set_meters": lambda rng, n: ("PUT", f"/user_competitive/set-meters/{_user(rng, n)}", {"max_meters_traveled": rng.randint(0, 100000)}),
+    # multiplayer
+    "rooms.join": lambda rng, n: ("POST", "/rooms/join", {"player_id": f"p{(uid := _unique())}", "room_code": f"R{uid}"}),
+    "rooms.first_available": lambda rng, n: ("GET", "/rooms/first-available", None),
+    "rooms.create": lambda rng, n: ("POST", "/rooms", {"room_code": f"C{(uid := _unique())}", "player1_id": f"p{uid}"}),
+    # paypal (PayPal sustituido por bench/stubs.py)
+    "paypal.create_order": lambda rng, n: ("POST", "/create-paypal-order", {"amount": 4.99, "amountAurum": 500, "email": f"{_user(rng, n)}@bench.local"}),
+    "paypal.check_order_status": lambda rng, n: ("GET", f"/check-paypal-order-status/ORDER{rng.randint(1, 1000)}", None),
+    "paypal.order_status_local": lambda rng, n: ("GET", f"/orders/ORDER{rng.randint(1, 1000)}/status", None),
+    "paypal.get_orders_by_email": lambda rng, n: ("GET", f"/get-orders-by-email/{_user(rng, n)}@bench.local", None),
+    # emailSend (SMTP sustituido por bench/stubs.py)
+    "email.send_verification": lambda rng, n: ("POST", "/send-verification-email", {"email": f"{_user(rng, n)}@bench.local", "username": "bench", "code": "123456"}),
+}
+
+
+# -----------------------------------------------------------------------------
+# Preparación de la base de datos
+# -----------------------------------------------------------------------------
+def db_connect(schema=None):
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        sslmode=os.getenv("DB_SSLMODE"),
+        options=f"-c search_path={schema}" if schema else None
+    )
+    return conn
+
+
+def setup_database(schema, users):
+    conn = db_connect()
+    cur = conn.cursor()
+    cur.execute(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+    cur.execute(f'CREATE SCHEMA "{schema}"')
+    cur.execute(f'SET search_path TO "{schema}"')
+    conn.commit()
+    upgrade(conn, log=lambda message: None)
+    cur.execute("""
+        INSERT INTO "user" (id, name, num_voren_money, num_aurum_money, icon_selected, banner_selected,
+                            email, skin_selected, password, anim_victory, anim_lose)
+        SELECT 'u' || i, 'player' || i, 1000, 1000, 'NONE', 'NONE', 'u' || i || '@bench.local', 'NONE', 'pw' || i, 'NONE', 'NONE'
+        FROM generate_series(1, %(users)s) i""", {"users": users})
+    cur.execute("""
+        INSERT INTO user_unlocks (user_id, icon_profile, banner_profile, skins_unlock, anim_victory, anim_lose)
+        SELECT 'u' || i, ARRAY['ic1'], ARRAY['b1'], ARRAY['s1'], ARRAY['v1'], ARRAY['l1']
+        FROM generate_series(1, %(users)s) i""", {"users": users})
+    cur.execute("""
+        INSERT INTO user_competitive (id_user, trophies, max_meters_traveled)
+        SELECT 'u' || i, (random() * 5000)::int, (random() * 100000)::int
+        FROM generate_series(1, %(users)s) i""", {"users": users})
+    cur.execute("""
+        INSERT INTO shop (type_offer, elements_offer)
+        SELECT (ARRAY['skin', 'banner', 'icon', 'anim'])[1 + i % 4], ARRAY['item' || i]
+        FROM generate_series(1, 40) i""")
+    cur.execute("INSERT INTO current_shop (id_shop) VALUES (1), (2), (3), (4)")
+    cur.execute("""
+        INSERT INTO orders (order_id, email_client, time_click_to_buy, ammount, state)
+        SELECT 'ORDER' || i, 'u' || (1 + i %% %(users)s) || '@bench.local', NOW() - i * INTERVAL '1 minute', 500,
+               CASE WHEN i %% 3 = 0 THEN 'done' ELSE 'pending' END
+        FROM generate_series(1, 1000) i""", {"users": users})
+    cur.execute("""
+        INSERT INTO multiplayer_rooms (room_code, player1_id, player2_id)
+        SELECT 'SEED' || i, 'host' || i, NULL FROM generate_series(1, 200) i""")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+# -----------------------------------------------------------------------------
+# Servidor de la API
+# -----------------------------------------------------------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, env):
+    port = free_port()
+    if args.server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "-k", args.worker_class,
+               "-b", f"127.0.0.1:{port}", "app:app"]
+        cmd += args.server_arg
+    else:
+        cmd = [sys.executable, "-m", "bench.server", "--port", str(port)]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL if args.quiet_server else None)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"El servidor terminó al arrancar (código {proc.returncode})")
+        try:
+            requests.get(url + "/", headers={"User-Agent": "astroleap-bench"}, timeout=1)
+            return proc, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("El servidor no respondió en 30 segundos")
+
+
+# -----------------------------------------------------------------------------
+# Ejecución y resultados
+# -----------------------------------------------------------------------------
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+# Lanza `count` peticiones del escenario repartidas entre los clientes
+# concurrentes. Devuelve las latencias, los errores por código y el tiempo total.
+def run_phase(url, make_request, count, args, seed):
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    tickets = itertools.count()
+
+    def worker(rng):
+        session = requests.Session()
+        session.headers["User-Agent"] = "astroleap-bench"
+        local, local_errors = [], {}
+        while next(tickets) < count:
+            method, path, body = make_request(rng, args.users)
+            start = time.perf_counter()
+            try:
+                resp = session.request(method, url + path, json=body, timeout=args.timeout)
+                resp.content
+                status = resp.status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            local.append(time.perf_counter() - start)
+            if not isinstance(status, int) or status >= 400:
+                local_errors[status] = local_errors.get(status, 0) + 1
+        with lock:
+            latencies.extend(local)
+            for status, n in local_errors.items():
+                errors[status] = errors.get(status, 0) + n
+
+    threads = [threading.Thread(target=worker, args=(random.Random(seed + i),)) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_scenario(url, name, make_request, args):
+    if args.warmup:
+        run_phase(url, make_request, args.warmup, args, args.seed + 10000)
+    latencies, errors, wall = run_phase(url, make_request, args.requests, args, args.seed)
+    latencies.sort()
+    return {
+        "endpoint": name,
+        "requests": len(latencies),
+        "errors": {str(k): v for k, v in errors.items()},
+        "rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round((latencies[-1] if latencies else 0) * 1000, 2),
+    }
+
+
+def print_table(results):
+    header = f"{'endpoint':<32} {'reqs':>7} {'err':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        errors = sum(r["errors"].values())
+        print(f"{r['endpoint']:<32} {r['requests']:>7} {errors:>6} {r['rps']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.run", description="Benchmarks de los endpoints de la API")
+    parser.add_argument("-k", dest="filters", action="append", default=[], help="ejecutar solo los escenarios cuyo nombre contenga este texto (repetible)")
+    parser.add_argument("--list", action="store_true", help="listar los escenarios y salir")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="clientes concurrentes (8)")
+    parser.add_argument("-n", "--requests", type=int, default=500, help="peticiones medidas por escenario (500)")
+    parser.add_argument("--warmup", type=int, default=50, help="peticiones de calentamiento por escenario (50)")
+    parser.add_argument("--users", type=int, default=10000, help="usuarios sembrados (10000)")
+    parser.add_argument("--seed", type=int, default=1, help="semilla de los generadores aleatorios")
+    parser.add_argument("--timeout", type=float, default=30, help="timeout por petición en segundos")
+    parser.add_argument("--schema", default="astroleap_bench", help="esquema de PostgreSQL para las tablas del benchmark")
+    parser.add_argument("--no-setup", action="store_true", help="no recrear ni sembrar el esquema")
+    parser.add_argument("--server", choices=("gunicorn", "werkzeug"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="workers de gunicorn (2)")
+    parser.add_argument("--worker-class", choices=("sync", "gevent"), default="sync", help="tipo de worker de gunicorn (sync)")
+    parser.add_argument("--server-arg", action="append", default=[], help="argumento extra para gunicorn (repetible)")
+    parser.add_argument("--url", help="usar una API ya arrancada en esta URL en lugar de lanzar una")
+    parser.add_argument("--paypal-latency", type=float, default=0.0, help="retardo del PayPal simulado en segundos")
+    parser.add_argument("--smtp-latency", type=float, default=0.0, help="retardo por comando del SMTP simulado en segundos")
+    parser.add_argument("--json", dest="json_path", help="guardar los resultados en este fichero JSON")
+    parser.add_argument("--quiet-server", action="store_true", help="descartar la salida estándar del servidor (logs)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = {name: fn for name, fn in SCENARIOS.items() if not args.filters or any(f in name for f in args.filters)}
+    if args.list:
+        print("\n".join(scenarios))
+        return
+    if not scenarios:
+        raise SystemExit("Ningún escenario coincide con los filtros")
+
+    paypal = PayPalStub(args.paypal_latency).start()
+    smtp = SmtpStub(args.smtp_latency).start()
+    if not args.no_setup:
+        setup_database(args.schema, args.users)
+
+    proc = None
+    url = args.url
+    if url is None:
+        env = dict(
+            os.environ,
+            PGOPTIONS=f"-c search_path={args.schema}",
+            PAYPAL_API_BASE=paypal.url,
+            PAYPAL_CLIENT_ID="bench",
+            PAYPAL_CLIENT_SECRET="bench",
+            PAYPAL_WEBHOOK_ID=paypal.webhook_id,
+            EMAIL_SMTP_HOST="127.0.0.1",
+            EMAIL_SMTP_PORT=str(smtp.port),
+            EMAIL_SMTP_SSL="0",
+            EMAIL_FROM="bench@astroleap.local",
+            EMAIL_PASSWORD="",
+            RATELIMIT_ENABLED="0",
+        )
+        proc, url = start_server(args, env)
+    paypal.webhook_url = f"{url}/paypal-webhook"
+
+    results = []
+    try:
+        for name, make_request in scenarios.items():
+            result = run_scenario(url, name, make_request, args)
+            results.append(result)
+            print(f"  {name}: {result['rps']} req/s, p99 {result['p99_ms']} ms", file=sys.stderr)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(10)
+        paypal.stop()
+        smtp.stop()
+
+    print()
+    print(f"concurrencia={args.concurrency} peticiones={args.requests} servidor={args.url or args.server}"
+          f"{'' if args.url or args.server != 'gunicorn' else f' workers={args.workers} ({args.worker_class})'}")
+    print_table(results)
+    print(f"PayPal simulado: {paypal.calls} llamadas ({paypal.token_requests} de token); "
+          f"SMTP simulado: {smtp.messages} emails en {smtp.sessions} sesiones")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import argparse
+
+from werkzeug.serving import make_server
+
+# -----------------------------------------------------------------------------
+# Sirve la API con el servidor multihilo de werkzeug (un solo proceso). Lo usa
+# bench/run.py con --server werkzeug para medir sin gunicorn.
+# -----------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    from app import app
+    make_server(args.host, args.port, app, threaded=True).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
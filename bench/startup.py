@@ -0,0 +1,190 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+from bench.run import ROOT, free_port
+
+# -----------------------------------------------------------------------------
+# ARRANQUE EN FRÍO
+# Mide lo que tarda la API en arrancar, con los blueprints importados al
+# arrancar (eager) y con LAZY_BLUEPRINTS=1 (lazy, ver blueprints.py):
+#   - tiempo de importación de app.py (python -X importtime), en total y por
+#     cada módulo que importa directamente (incluye lo que importan ellos),
+#   - tiempo desde que se lanza el servidor hasta su primera respuesta,
+#   - duración de la primera y la segunda petición a cada --path (en modo lazy
+#     la primera paga la importación del módulo del blueprint).
+# Cada medida se repite --runs veces en procesos nuevos y se da la mediana.
+# El servidor usa las mismas variables DB_* que la API; las rutas que consultan
+# tablas inexistentes responden 500, pero su tiempo sigue contando. Las
+# primeras peticiones pueden coincidir con la precarga de la clasificación que
+# lanza post_worker_init (gunicorn.conf.py).
+#
+# Uso (desde la raíz del repositorio):
+#     python -m bench.startup
+#     python -m bench.startup --mode lazy --runs 10 --top 20
+#     python -m bench.startup --path / --path /get-user/u1 --schema astroleap_bench
+# -----------------------------------------------------------------------------
+DEFAULT_PATHS = ("/", "/get-shop", "/paypal-status-cache-stats")
+HEADERS = {"User-Agent": "astroleap-bench"}
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+# -----------------------------------------------------------------------------
+# Importa app.py en un proceso nuevo con -X importtime. Devuelve el tiempo total
+# (µs), el propio de app.py (su código, sin los imports) y el acumulado de cada
+# módulo que importa directamente.
+# -----------------------------------------------------------------------------
+def import_times(env):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"No se pudo importar app.py:\n{proc.stderr[-2000:]}")
+    # Cada módulo aparece después de los que importa, con un nivel más de sangría
+    children = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), len(match[3]), match[4]
+        if name == "app" and indent == 0:
+            top_level = [(child, us) for child, us, level in children if level == 2]
+            return cumulative_us, self_us, top_level
+        children.append((name, cumulative_us, indent))
+    raise SystemExit("La salida de -X importtime no incluye app")
+
+
+# -----------------------------------------------------------------------------
+# Lanza el servidor y mide el arranque hasta la primera respuesta y la primera
+# y segunda petición a cada ruta (en ms).
+# -----------------------------------------------------------------------------
+def first_responses(args, env, paths):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    if args.server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-w", "1", "-k", args.worker_class,
+               "-b", f"127.0.0.1:{port}", "app:app"]
+    else:
+        cmd = [sys.executable, "-m", "bench.server", "--port", str(port)]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if proc.poll() is not None:
+                raise SystemExit(f"El servidor terminó al arrancar (código {proc.returncode})")
+            if time.monotonic() > deadline:
+                raise SystemExit("El servidor no respondió en 30 segundos")
+            try:
+                requests.get(url + "/", headers=HEADERS, timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.005)
+        ready_ms = (time.perf_counter() - start) * 1000
+
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        timings = {}
+        for path in paths:
+            for attempt in ("first", "second"):
+                t = time.perf_counter()
+                status = session.get(url + path, timeout=30).status_code
+                timings[(path, attempt)] = ((time.perf_counter() - t) * 1000, status)
+        return ready_ms, timings
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def measure(mode, args):
+    env = dict(os.environ, LAZY_BLUEPRINTS="1" if mode == "lazy" else "0", RATELIMIT_ENABLED="0")
+    if args.schema:
+        env["PGOPTIONS"] = f"-c search_path={args.schema}"
+
+    totals, own, modules = [], [], {}
+    for _ in range(args.runs):
+        total_us, self_us, top_level = import_times(env)
+        totals.append(total_us / 1000)
+        own.append(self_us / 1000)
+        for name, us in top_level:
+            modules.setdefault(name, []).append(us / 1000)
+
+    ready, requests_ms, statuses = [], {}, {}
+    for _ in range(args.runs):
+        ready_ms, timings = first_responses(args, env, args.paths)
+        ready.append(ready_ms)
+        for key, (ms, status) in timings.items():
+            requests_ms.setdefault(key, []).append(ms)
+            statuses[key] = status
+
+    return {
+        "import_ms": statistics.median(totals),
+        "app_self_ms": statistics.median(own),
+        "modules": {name: statistics.median(v) for name, v in modules.items()},
+        "ready_ms": statistics.median(ready),
+        "requests": {key: (statistics.median(v), statuses[key]) for key, v in requests_ms.items()},
+    }
+
+
+def print_report(results, args):
+    modes = list(results)
+    print(f"runs={args.runs} servidor={args.server}"
+          f"{f' ({args.worker_class}, 1 worker)' if args.server == 'gunicorn' else ''}")
+    print()
+    print(f"{'':42}" + "".join(f"{mode:>12}" for mode in modes))
+    print("-" * (42 + 12 * len(modes)))
+    print(f"{'import app (ms)':42}" + "".join(f"{results[m]['import_ms']:>12.1f}" for m in modes))
+    print(f"{'  código de app.py (ms)':42}" + "".join(f"{results[m]['app_self_ms']:>12.1f}" for m in modes))
+    print(f"{'arranque -> 1ª respuesta (ms)':42}" + "".join(f"{results[m]['ready_ms']:>12.1f}" for m in modes))
+    for path in args.paths:
+        for attempt, label in (("first", "1ª"), ("second", "2ª")):
+            cells = ""
+            for m in modes:
+                ms, status = results[m]["requests"][(path, attempt)]
+                cells += f"{f'{ms:.1f}' + ('' if status < 400 else f' [{status}]'):>12}"
+            print(f"{f'{label} GET {path} (ms)':42}" + cells)
+
+    print()
+    print(f"Módulos importados por app.py (ms acumulados, los {args.top} más lentos):")
+    names = sorted({n for m in modes for n in results[m]["modules"]},
+                   key=lambda n: -max(results[m]["modules"].get(n, 0.0) for m in modes))
+    print(f"{'':42}" + "".join(f"{mode:>12}" for mode in modes))
+    for name in names[:args.top]:
+        print(f"{'  ' + name:42}" + "".join(
+            f"{results[m]['modules'][name]:>12.1f}" if name in results[m]["modules"] else f"{'-':>12}"
+            for m in modes))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.startup", description="Mide el arranque en frío de la API")
+    parser.add_argument("--mode", choices=("eager", "lazy", "both"), default="both",
+                        help="importar los blueprints al arrancar, en la primera petición o comparar ambos (both)")
+    parser.add_argument("--runs", type=int, default=5, help="repeticiones de cada medida (5)")
+    parser.add_argument("--top", type=int, default=15, help="módulos a mostrar en el desglose (15)")
+    parser.add_argument("--path", dest="paths", action="append", help=f"ruta a medir tras el arranque (repetible; por defecto {', '.join(DEFAULT_PATHS)})")
+    parser.add_argument("--server", choices=("gunicorn", "werkzeug"), default="gunicorn")
+    parser.add_argument("--worker-class", choices=("sync", "gevent"), default="sync", help="tipo de worker de gunicorn (sync)")
+    parser.add_argument("--schema", help="esquema de PostgreSQL para las consultas (p. ej. astroleap_bench)")
+    args = parser.parse_args(argv)
+    args.paths = args.paths or list(DEFAULT_PATHS)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    modes = ("eager", "lazy") if args.mode == "both" else (args.mode,)
+    results = {}
+    for mode in modes:
+        print(f"  midiendo {mode}...", file=sys.stderr)
+        results[mode] = measure(mode, args)
+    print_report(results, args)
+
+
+if __name__ == "__main__":
+    main()
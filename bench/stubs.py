@@ -0,0 +1,229 @@
+import base64
+import hashlib
+import hmac
+import json
+import socketserver
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -----------------------------------------------------------------------------
+# Servidores locales que sustituyen a PayPal y al servidor SMTP durante los
+# benchmarks. Ambos aceptan un retardo artificial (latency, en segundos) por
+# petición o comando para simular un servicio externo lento.
+#
+# El PayPal simulado también envía webhooks firmados a webhook_url:
+#   - CHECKOUT.ORDER.APPROVED al llamar a approve(order_id) (el comprador paga),
+#   - PAYMENT.CAPTURE.COMPLETED tras cada captura,
+# y atiende /v1/notifications/verify-webhook-signature comprobando su propia
+# firma. PayPal firma con RSA sobre el cuerpo original; aquí basta con un HMAC
+# sobre el evento en forma canónica, porque la API delega la verificación en
+# ese endpoint.
+# -----------------------------------------------------------------------------
+
+
+class PayPalStub:
+    def __init__(self, latency=0.0, webhook_url=None, webhook_id="BENCH-WEBHOOK"):
+        self.latency = latency
+        self.webhook_url = webhook_url
+        self.webhook_id = webhook_id
+        self.orders = {}
+        self.calls = 0
+        self.captures = 0
+        self.token_requests = 0
+        self.webhooks_sent = 0
+        self.webhooks_failed = 0
+        self._secret = uuid.uuid4().bytes
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, host="127.0.0.1", port=0):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Cabeceras y cuerpo en un solo envío (si no, Nagle + ACK retardado
+            # añaden ~40 ms a cada respuesta con keep-alive)
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _begin(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                stub.calls += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                return body
+
+            def do_POST(self):
+                body = self._begin()
+                if self.path == "/v1/oauth2/token":
+                    stub.token_requests += 1
+                    return self._reply(200, {"access_token": uuid.uuid4().hex, "token_type": "Bearer", "expires_in": 32400})
+                if self.path == "/v2/checkout/orders":
+                    order_id = uuid.uuid4().hex[:17].upper()
+                    stub.orders[order_id] = "CREATED"
+                    return self._reply(201, {"id": order_id, "status": "CREATED", "links": []})
+                if self.path.endswith("/capture"):
+                    order_id = self.path.split("/")[-2]
+                    stub.captures += 1
+                    if stub.orders.get(order_id) == "COMPLETED":
+                        return self._reply(422, {"name": "UNPROCESSABLE_ENTITY", "details": [{"issue": "ORDER_ALREADY_CAPTURED"}]})
+                    stub.orders[order_id] = "COMPLETED"
+                    self._reply(201, {"id": order_id, "status": "COMPLETED"})
+                    # Como PayPal, el webhook de la captura llega por separado
+                    threading.Thread(target=stub.emit, args=("PAYMENT.CAPTURE.COMPLETED", {
+                        "id": uuid.uuid4().hex[:17].upper(),
+                        "status": "COMPLETED",
+                        "supplementary_data": {"related_ids": {"order_id": order_id}}
+                    }), daemon=True).start()
+                    return
+                if self.path == "/v1/notifications/verify-webhook-signature":
+                    data = json.loads(body or b"{}")
+                    valid = data.get("webhook_id") == stub.webhook_id and hmac.compare_digest(
+                        str(data.get("transmission_sig")),
+                        stub.sign(data.get("transmission_id"), data.get("transmission_time"), data.get("webhook_event"))
+                    )
+                    return self._reply(200, {"verification_status": "SUCCESS" if valid else "FAILURE"})
+                self._reply(404, {"name": "RESOURCE_NOT_FOUND"})
+
+            def do_GET(self):
+                self._begin()
+                if self.path.startswith("/v2/checkout/orders/"):
+                    order_id = self.path.rsplit("/", 1)[-1]
+                    return self._reply(200, {"id": order_id, "status": stub.orders.get(order_id, "CREATED")})
+                self._reply(404, {"name": "RESOURCE_NOT_FOUND"})
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="paypal-stub", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def sign(self, transmission_id, transmission_time, event):
+        canonical = json.dumps(event, sort_keys=True, separators=(",", ":")).encode()
+        message = f"{transmission_id}|{transmission_time}|{self.webhook_id}|{zlib.crc32(canonical)}".encode()
+        return base64.b64encode(hmac.new(self._secret, message, hashlib.sha256).digest()).decode()
+
+    # Simula que el comprador aprueba el pago de la orden en PayPal.
+    def approve(self, order_id):
+        self.orders[order_id] = "APPROVED"
+        return self.emit("CHECKOUT.ORDER.APPROVED", {"id": order_id, "status": "APPROVED", "intent": "CAPTURE"})
+
+    # -------------------------------------------------------------------------
+    # Envía un webhook firmado a webhook_url. Devuelve el código HTTP de la
+    # respuesta, o None si no hay webhook_url o no se pudo entregar.
+    # -------------------------------------------------------------------------
+    def emit(self, event_type, resource):
+        if not self.webhook_url:
+            return None
+        event = {
+            "id": f"WH-{uuid.uuid4().hex[:20].upper()}",
+            "event_version": "1.0",
+            "create_time": datetime.now(timezone.utc).isoformat(),
+            "event_type": event_type,
+            "resource": resource,
+        }
+        transmission_id = str(uuid.uuid4())
+        transmission_time = datetime.now(timezone.utc).isoformat()
+        request = urllib.request.Request(self.webhook_url, data=json.dumps(event).encode(), method="POST", headers={
+            "Content-Type": "application/json",
+            "User-Agent": "PayPal/AUHD-214.0-stub",
+            "PAYPAL-TRANSMISSION-ID": transmission_id,
+            "PAYPAL-TRANSMISSION-TIME": transmission_time,
+            "PAYPAL-TRANSMISSION-SIG": self.sign(transmission_id, transmission_time, event),
+            "PAYPAL-CERT-URL": f"{self.url}/v1/notifications/certs/bench",
+            "PAYPAL-AUTH-ALGO": "SHA256withRSA",
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=30) as resp:
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = None
+        if status is not None and 200 <= status < 300:
+            self.webhooks_sent += 1
+        else:
+            self.webhooks_failed += 1
+        return status
+
+
+class SmtpStub:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sessions = 0
+        self.messages = 0
+        self._server = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self, host="127.0.0.1", port=0):
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                stub.sessions += 1
+                self.reply("220 astroleap-bench ESMTP")
+                in_data = False
+                for raw in self.rfile:
+                    line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                    if in_data:
+                        if line == ".":
+                            in_data = False
+                            stub.messages += 1
+                            self.reply("250 OK")
+                        continue
+                    if stub.latency:
+                        time.sleep(stub.latency)
+                    command = line[:4].upper()
+                    if command in ("HELO", "EHLO"):
+                        self.reply("250 astroleap-bench")
+                    elif command == "DATA":
+                        in_data = True
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("250 OK")
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self._server = Server((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="smtp-stub", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
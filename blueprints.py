@@ -0,0 +1,115 @@
+import ast
+import importlib
+import importlib.util
+import os
+import threading
+
+from flask import Blueprint
+
+# -----------------------------------------------------------------------------
+# REGISTRO DE BLUEPRINTS
+# Cada blueprint agrupa las rutas (endpoints) de un módulo funcional de la API.
+# Con LAZY_BLUEPRINTS=1 los módulos de los blueprints no se importan al arrancar:
+#   - las rutas se leen del código fuente (los decoradores @<bp>.route) sin
+#     ejecutarlo, y se registran en un blueprint con el mismo nombre y opciones,
+#   - cada módulo (y lo que importa: requests, smtplib...) se importa en la
+#     primera petición que llega a una de sus rutas.
+# Los endpoints se llaman igual que sin LAZY_BLUEPRINTS ('paypal.paypal_webhook'),
+# así que url_for, las métricas y las exenciones del rate limiting no cambian.
+# A cambio, la primera petición de cada módulo paga su importación; con
+# `python -m bench.startup` se comparan los dos modos.
+# -----------------------------------------------------------------------------
+LAZY_BLUEPRINTS = os.getenv("LAZY_BLUEPRINTS", "0") == "1"
+
+# (módulo, variable del blueprint), en orden de registro
+BLUEPRINTS = (
+    ("users.user", "users_bp"),                                 # Rutas de gestión de usuarios
+    ("users_unlocks.user_unlocks", "users_unlocks_bp"),         # Rutas de desbloqueos de usuario
+    ("shop.shop", "shop_bp"),                                   # Rutas de la tienda
+    ("paypal.paypal", "paypal_bp"),                             # Rutas de pagos y PayPal
+    ("emailSend.email", "email_bp"),                            # Rutas de envío de emails
+    ("user_shop.user_shop", "userShop_bp"),                     # Rutas de relación usuario-tienda
+    ("current_shop.current_shop", "current_shop_bp"),           # Rutas de la tienda actual
+    ("user_competitive.user_competitive", "user_competitive_bp"),  # Rutas de modo competitivo
+    ("multiplayer.multiplayer", "multiplayer_bp"),              # Rutas de modo multijugador
+)
+
+
+# -----------------------------------------------------------------------------
+# Vista que importa su módulo la primera vez que se llama.
+# __module__ y __name__ son los de la función real, que es lo que usa
+# flask-limiter para identificar la ruta.
+# -----------------------------------------------------------------------------
+class LazyView:
+    def __init__(self, module, name):
+        self.__module__ = module
+        self.__name__ = self.__qualname__ = name
+        self._view = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._view is None:
+            with self._lock:
+                if self._view is None:
+                    self._view = getattr(importlib.import_module(self.__module__), self.__name__)
+        return self._view
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+
+def _call(source, module, lineno):
+    try:
+        node = ast.parse(source, mode="eval").body
+        # El primer argumento es el nombre del blueprint o la regla de la ruta; el
+        # segundo de Blueprint() es __name__, que aquí siempre es `module`
+        return ast.literal_eval(node.args[0]), {kw.arg: ast.literal_eval(kw.value) for kw in node.keywords}
+    except (SyntaxError, ValueError, IndexError):
+        raise ValueError(f"{module}:{lineno}: LAZY_BLUEPRINTS solo admite Blueprint() y .route() en una línea y con argumentos literales") from None
+
+
+# -----------------------------------------------------------------------------
+# Lee del código fuente del módulo el Blueprint `attr` y sus rutas, sin
+# ejecutarlo (y sin analizar el fichero entero: solo las líneas
+# `attr = Blueprint(...)`, `@attr.route(...)` y el `def` que las sigue).
+# Devuelve (nombre, opciones del Blueprint, [(regla, función, opciones de la ruta)]).
+# -----------------------------------------------------------------------------
+def read_routes(module, attr):
+    path = importlib.util.find_spec(module).origin
+    blueprint = None
+    routes = []
+    pending = []
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if line.startswith(f"@{attr}.route("):
+                pending.append(_call(line[1:].strip(), module, lineno))
+            elif line.startswith("def ") and pending:
+                name = line[4:line.index("(")].strip()
+                routes.extend((rule, name, options) for rule, options in pending)
+                pending = []
+            elif line.startswith(attr) and line[len(attr):].lstrip().startswith("= Blueprint("):
+                blueprint = _call(line.split("=", 1)[1].strip(), module, lineno)
+    if blueprint is None:
+        raise ValueError(f"{module}: no se encontró '{attr} = Blueprint(...)'")
+    return blueprint[0], blueprint[1], routes
+
+
+def lazy_blueprint(module, attr):
+    name, options, routes = read_routes(module, attr)
+    bp = Blueprint(name, module, **options)
+    views = {}
+    for rule, func, route_options in routes:
+        view = views.setdefault(func, LazyView(module, func))
+        bp.add_url_rule(rule, route_options.pop("endpoint", func), view, **route_options)
+    return bp
+
+
+def register_blueprints(app, lazy=None):
+    lazy = LAZY_BLUEPRINTS if lazy is None else lazy
+    for module, attr in BLUEPRINTS:
+        if lazy:
+            app.register_blueprint(lazy_blueprint(module, attr))
+        else:
+            # __import__ (y no importlib.import_module) para que el módulo salga
+            # en el desglose de python -X importtime
+            app.register_blueprint(getattr(__import__(module, fromlist=[attr]), attr))
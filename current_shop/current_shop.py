@@ -1,8 +1,80 @@
 from flask import Blueprint, jsonify, request
 from utils import get_connection
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
 
 current_shop_bp = Blueprint('current_shop', __name__)
 
+# -----------------------------------------------------------------------------
+# VERSIÓN DE LA TIENDA ACTUAL
+# La rotación de current_shop cambia pocas veces al día, pero cada login necesita
+# saber si las ofertas del usuario (user_shop) están sincronizadas con ella.
+# Cada worker guarda en memoria los id_shop actuales y una versión (hash de los
+# ids) durante CURRENT_SHOP_CACHE_TTL segundos, y recuerda qué usuarios ya
+# sincronizó con esa versión para no repetir la sincronización en cada login.
+# Un POST /current_shop invalida la caché del worker que lo atiende; el resto la
+# recarga al caducar el TTL.
+# La marca de usuario sincronizado también caduca, a los SYNCED_USERS_TTL
+# segundos: POST/DELETE /user_shop la borran solo en el worker que los atiende,
+# y los demás vuelven a sincronizar a ese usuario como mucho ese tiempo después.
+# -----------------------------------------------------------------------------
+CURRENT_SHOP_CACHE_TTL = float(os.getenv("CURRENT_SHOP_CACHE_TTL", "60"))
+SYNCED_USERS_TTL = float(os.getenv("SYNCED_USERS_TTL", "60"))
+SYNCED_USERS_MAX = int(os.getenv("SYNCED_USERS_MAX", "50000"))
+
+_current_lock = threading.Lock()
+_current = None
+# id_user -> (versión sincronizada, instante de la sincronización)
+_synced_users = OrderedDict()
+
+
+def invalidate_current_shop():
+    global _current
+    with _current_lock:
+        _current = None
+        _synced_users.clear()
+
+
+# -----------------------------------------------------------------------------
+# Devuelve la versión de la tienda actual, leyéndola con el cursor recibido si la
+# caché ha caducado.
+# -----------------------------------------------------------------------------
+def get_current_shop_version(cur):
+    global _current
+    current = _current
+    if current and time.monotonic() - current["loaded_at"] < CURRENT_SHOP_CACHE_TTL:
+        return current["version"]
+    cur.execute("SELECT id_shop FROM current_shop ORDER BY id_shop")
+    ids = [row[0] for row in cur.fetchall()]
+    version = hashlib.sha1(",".join(str(i) for i in ids).encode()).hexdigest()
+    with _current_lock:
+        if _current and _current["version"] != version:
+            _synced_users.clear()
+        _current = {"ids": ids, "version": version, "loaded_at": time.monotonic()}
+    return version
+
+
+def is_user_synced(id_user, version):
+    with _current_lock:
+        entry = _synced_users.get(id_user)
+    return entry is not None and entry[0] == version and time.monotonic() - entry[1] < SYNCED_USERS_TTL
+
+
+def mark_user_synced(id_user, version):
+    with _current_lock:
+        _synced_users[id_user] = (version, time.monotonic())
+        _synced_users.move_to_end(id_user)
+        while len(_synced_users) > SYNCED_USERS_MAX:
+            _synced_users.popitem(last=False)
+
+
+def forget_user_sync(id_user):
+    with _current_lock:
+        _synced_users.pop(id_user, None)
+
 # Obtener todos los id_shop actuales
 # -----------------------------------------------------------------------------
 # GET /current_shop
@@ -11,11 +83,10 @@ current_shop_bp = Blueprint('current_shop', __name__)
 # -----------------------------------------------------------------------------
 @current_shop_bp.route('/current_shop', methods=['GET'])
 def get_current_shops():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id_shop FROM current_shop")
-    rows = cursor.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id_shop FROM current_shop")
+        rows = cursor.fetchall()
     return jsonify([row[0] for row in rows])
 
 # -----------------------------------------------------------------------------
@@ -32,9 +103,9 @@ def add_current_shop():
     id_shop = data.get('id_shop')
     if not id_shop:
         return jsonify({"error": "Missing id_shop"}), 400
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO current_shop (id_shop) VALUES (?)", (id_shop,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO current_shop (id_shop) VALUES (%s)", (id_shop,))
+        conn.commit()
+    invalidate_current_shop()
     return jsonify({"message": "Current shop added", "id_shop": id_shop}), 201
\ No newline at end of file
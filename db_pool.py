@@ -0,0 +1,305 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+from green import patch_psycopg
+
+# -----------------------------------------------------------------------------
+# POOL DE CONEXIONES POSTGRESQL
+# Cada worker de gunicorn mantiene su propio pool acotado de conexiones a NeonDB,
+# de modo que el handshake TCP + TLS se paga una vez por conexión física y no en
+# cada petición. El pool:
+#   - limita el número de conexiones abiertas (DB_POOL_MAX_SIZE),
+#   - comprueba la conexión al sacarla si lleva tiempo ociosa (DB_POOL_HEALTHCHECK_IDLE),
+#   - recicla las conexiones que superan su vida máxima (DB_POOL_MAX_LIFETIME),
+#   - espera como mucho DB_POOL_TIMEOUT segundos a que quede una libre,
+#   - expone estadísticas (en uso, ociosas, tiempo de espera...).
+# Con workers gevent los locks del pool son green locks (gunicorn parchea
+# threading) y las consultas ceden el control mientras esperan (ver green.py).
+# -----------------------------------------------------------------------------
+
+
+class PoolTimeout(PoolError):
+    """No ha quedado ninguna conexión libre dentro del tiempo de espera."""
+
+
+# -----------------------------------------------------------------------------
+# Conexión física de psycopg2 con los metadatos que necesita el pool y el
+# registro de sentencias preparadas.
+# -----------------------------------------------------------------------------
+class PgConnection(extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # Sentencias preparadas en esta sesión del servidor (ver prepared.py)
+        self.prepared = set()
+
+
+# -----------------------------------------------------------------------------
+# Préstamo de una conexión del pool.
+# Se usa igual que una conexión de psycopg2 (cursor, commit, rollback...), pero
+# close() la devuelve al pool en lugar de cerrarla. Como context manager hace
+# rollback si el bloque lanza una excepción y siempre devuelve la conexión;
+# no hace commit implícito, cada handler confirma sus cambios con conn.commit().
+# -----------------------------------------------------------------------------
+class PooledConnection:
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    @property
+    def raw(self):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return self._conn
+
+    @property
+    def returned(self):
+        return self._conn is None
+
+    def cursor(self, *args, **kwargs):
+        return self.raw.cursor(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self._conn is not None and not self._conn.closed:
+            try:
+                self._conn.rollback()
+            except psycopg2.Error:
+                pass
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_size=5, timeout=10.0, max_lifetime=1800.0, healthcheck_idle=30.0):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_idle = healthcheck_idle
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._size = 0          # conexiones abiertas o abriéndose
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "healthcheck_failures": 0,
+            "timeouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    # -------------------------------------------------------------------------
+    # Saca una conexión del pool (esperando si está lleno) y la devuelve envuelta
+    # en un PooledConnection.
+    # -------------------------------------------------------------------------
+    def connection(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    conn = None
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"no database connection available after {self.timeout}s")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+            waited = time.monotonic() - start
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+
+        try:
+            if conn is not None and not self._is_usable(conn):
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self._open()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, conn)
+
+    # -------------------------------------------------------------------------
+    # Devuelve una conexión al pool. Si quedó una transacción abierta se deshace;
+    # si está rota o ha superado su vida máxima se cierra y libera el hueco.
+    # -------------------------------------------------------------------------
+    def release(self, conn):
+        keep = not conn.closed and not self._expired(conn)
+        if keep:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                keep = False
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    keep = False
+        if keep:
+            conn.last_used = time.monotonic()
+        else:
+            self._close_quietly(conn)
+        with self._cond:
+            self._in_use -= 1
+            if keep and not self._closed:
+                self._idle.append(conn)
+            else:
+                self._size -= 1
+                if keep:
+                    self._close_quietly(conn)
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            checkouts = self._stats["checkouts"]
+            return {
+                "pid": os.getpid(),
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": checkouts,
+                "created": self._stats["created"],
+                "recycled": self._stats["recycled"],
+                "healthcheck_failures": self._stats["healthcheck_failures"],
+                "timeouts": self._stats["timeouts"],
+                "wait_time_total_ms": round(self._stats["wait_time_total"] * 1000, 3),
+                "wait_time_avg_ms": round(self._stats["wait_time_total"] * 1000 / checkouts, 3) if checkouts else 0.0,
+                "wait_time_max_ms": round(self._stats["wait_time_max"] * 1000, 3),
+            }
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _expired(self, conn):
+        return self.max_lifetime > 0 and time.monotonic() - conn.created_at > self.max_lifetime
+
+    def _is_usable(self, conn):
+        if self._expired(conn):
+            with self._cond:
+                self._stats["recycled"] += 1
+            return False
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self.healthcheck_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self._stats["healthcheck_failures"] += 1
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+# -----------------------------------------------------------------------------
+# Pool del proceso actual.
+# Se crea de forma perezosa en la primera petición y se vuelve a crear si el pid
+# cambia (fork de gunicorn con --preload), para que dos workers nunca compartan
+# el mismo socket.
+# -----------------------------------------------------------------------------
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+# Abre una conexión física nueva, fuera del pool (la usa el pool y los procesos
+# que necesitan una conexión dedicada, como el hilo de LISTEN de la clasificación).
+def connect():
+    patch_psycopg()
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        sslmode=os.getenv("DB_SSLMODE"),
+        connection_factory=PgConnection
+    )
+
+
+def get_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool(
+                    connect,
+                    max_size=int(os.getenv("DB_POOL_MAX_SIZE", "5")),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+                    max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+                    healthcheck_idle=float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))
+                )
+                _pool_pid = pid
+    return _pool
+
+
+def pool_stats():
+    if _pool is None or _pool_pid != os.getpid():
+        return None
+    return _pool.stats()
+
+
+def close_pool():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close_all()
@@ -0,0 +1,242 @@
+import atexit
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+
+# -----------------------------------------------------------------------------
+# COLA DE ENVÍO DE EMAILS
+# Los handlers encolan el mensaje y responden al momento; un hilo en segundo
+# plano de cada worker lo envía. El hilo:
+#   - agrupa los mensajes pendientes en lotes de hasta EMAIL_BATCH_SIZE,
+#   - reutiliza una única sesión SMTP autenticada mientras haya trabajo y la
+#     cierra tras EMAIL_SMTP_IDLE_TIMEOUT segundos sin mensajes,
+#   - reintenta los fallos temporales hasta EMAIL_MAX_RETRIES veces con espera
+#     exponencial (EMAIL_RETRY_BACKOFF, 2x, 4x...),
+#   - al apagar el worker intenta vaciar la cola antes de salir.
+# Con EMAIL_ASYNC=0 los mensajes se envían en la propia petición.
+#
+# Servidor SMTP: EMAIL_SMTP_HOST / EMAIL_SMTP_PORT (smtp.gmail.com:465 con SSL
+# por defecto). Para probar en local basta con un servidor SMTP de pruebas y
+# EMAIL_SMTP_SSL=0; si no hay EMAIL_PASSWORD no se hace login.
+# -----------------------------------------------------------------------------
+
+
+logger = logging.getLogger(__name__)
+
+
+class EmailQueueFull(Exception):
+    """La cola de emails ha alcanzado EMAIL_QUEUE_MAX mensajes pendientes."""
+
+
+_STOP = object()
+
+# Códigos SMTP 5xx: error permanente, no tiene sentido reintentar
+_PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+
+def smtp_connect():
+    host = os.getenv("EMAIL_SMTP_HOST", "smtp.gmail.com")
+    port = int(os.getenv("EMAIL_SMTP_PORT", "465"))
+    timeout = float(os.getenv("EMAIL_SMTP_TIMEOUT", "20"))
+    if os.getenv("EMAIL_SMTP_SSL", "1") == "1":
+        smtp = smtplib.SMTP_SSL(host, port, timeout=timeout)
+    else:
+        smtp = smtplib.SMTP(host, port, timeout=timeout)
+    if os.getenv("EMAIL_PASSWORD"):
+        smtp.login(os.getenv("EMAIL_FROM"), os.getenv("EMAIL_PASSWORD"))
+    return smtp
+
+
+class EmailDispatcher:
+    def __init__(self, connect=smtp_connect, batch_size=20, max_retries=3, retry_backoff=1.0,
+                 idle_timeout=30.0, queue_max=10000):
+        self._connect = connect
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._smtp = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "dropped": 0,
+            "smtp_sessions": 0,
+            "send_time_total": 0.0,
+            "send_time_max": 0.0,
+            "queue_wait_total": 0.0,
+        }
+
+    # -------------------------------------------------------------------------
+    # Encola un EmailMessage. Lanza EmailQueueFull si la cola está llena.
+    # -------------------------------------------------------------------------
+    def enqueue(self, msg):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((msg, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            raise EmailQueueFull("email queue is full")
+        with self._lock:
+            self._stats["enqueued"] += 1
+
+    # Envía un mensaje en el hilo actual, con una sesión SMTP propia.
+    def send_now(self, msg):
+        start = time.monotonic()
+        smtp = self._connect()
+        try:
+            smtp.send_message(msg)
+        finally:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self._stats["sent"] += 1
+            self._stats["smtp_sessions"] += 1
+            self._stats["send_time_total"] += elapsed
+            self._stats["send_time_max"] = max(self._stats["send_time_max"], elapsed)
+
+    # -------------------------------------------------------------------------
+    # Detiene el hilo de envío esperando como mucho `timeout` segundos a que se
+    # vacíe la cola.
+    # -------------------------------------------------------------------------
+    def stop(self, timeout=10.0):
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        delivered = stats["sent"] + stats["failed"]
+        return {
+            "pid": os.getpid(),
+            "queue_depth": self._queue.qsize(),
+            "enqueued": stats["enqueued"],
+            "sent": stats["sent"],
+            "failed": stats["failed"],
+            "retries": stats["retries"],
+            "dropped": stats["dropped"],
+            "smtp_sessions": stats["smtp_sessions"],
+            "send_latency_avg_ms": round(stats["send_time_total"] * 1000 / stats["sent"], 3) if stats["sent"] else 0.0,
+            "send_latency_max_ms": round(stats["send_time_max"] * 1000, 3),
+            "queue_wait_avg_ms": round(stats["queue_wait_total"] * 1000 / delivered, 3) if delivered else 0.0,
+        }
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # Proceso hijo tras un fork: la sesión y la cola del padre no sirven
+                self._smtp = None
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name="email-dispatcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._close_session()
+                continue
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is _STOP:
+                    self._close_session()
+                    return
+                self._deliver(*item)
+
+    def _deliver(self, msg, enqueued_at):
+        with self._lock:
+            self._stats["queue_wait_total"] += time.monotonic() - enqueued_at
+        for attempt in range(self.max_retries + 1):
+            reused = self._smtp is not None
+            try:
+                smtp = self._session()
+                start = time.monotonic()
+                smtp.send_message(msg)
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    self._stats["sent"] += 1
+                    self._stats["send_time_total"] += elapsed
+                    self._stats["send_time_max"] = max(self._stats["send_time_max"], elapsed)
+                return True
+            except _PERMANENT_ERRORS:
+                logger.exception("Email rechazado por el servidor SMTP", extra={"fields": {"to": msg['To']}})
+                break
+            except (smtplib.SMTPException, OSError) as e:
+                self._close_session()
+                if attempt == self.max_retries:
+                    logger.exception("No se pudo enviar el email", extra={"fields": {"to": msg['To'], "attempts": attempt + 1}})
+                    break
+                with self._lock:
+                    self._stats["retries"] += 1
+                # Una sesión reutilizada que el servidor cerró por inactividad se
+                # reabre al momento; el resto de fallos esperan con backoff.
+                if not (reused and attempt == 0 and isinstance(e, smtplib.SMTPServerDisconnected)):
+                    time.sleep(self.retry_backoff * (2 ** attempt))
+        with self._lock:
+            self._stats["failed"] += 1
+        return False
+
+    def _session(self):
+        if self._smtp is None:
+            self._smtp = self._connect()
+            with self._lock:
+                self._stats["smtp_sessions"] += 1
+        return self._smtp
+
+    def _close_session(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+dispatcher = EmailDispatcher(
+    batch_size=int(os.getenv("EMAIL_BATCH_SIZE", "20")),
+    max_retries=int(os.getenv("EMAIL_MAX_RETRIES", "3")),
+    retry_backoff=float(os.getenv("EMAIL_RETRY_BACKOFF", "1")),
+    idle_timeout=float(os.getenv("EMAIL_SMTP_IDLE_TIMEOUT", "30")),
+    queue_max=int(os.getenv("EMAIL_QUEUE_MAX", "10000"))
+)
+atexit.register(dispatcher.stop, float(os.getenv("EMAIL_SHUTDOWN_TIMEOUT", "10")))
+
+
+# -----------------------------------------------------------------------------
+# Entrega un mensaje: lo encola, o lo envía en el momento si EMAIL_ASYNC=0.
+# -----------------------------------------------------------------------------
+def dispatch_email(msg):
+    if os.getenv("EMAIL_ASYNC", "1") == "1":
+        dispatcher.enqueue(msg)
+    else:
+        dispatcher.send_now(msg)
@@ -2,9 +2,11 @@ import os
 from flask import Blueprint, jsonify, request
 from utils import get_connection
 from email.message import EmailMessage
-import smtplib
+from emailSend.dispatcher import EmailQueueFull, dispatch_email, dispatcher
+import logging
 
 email_bp = Blueprint('email', __name__)
+logger = logging.getLogger(__name__)
 
 # -----------------------------------------------------------------------------
 # POST /send-verification-email
@@ -12,6 +14,7 @@ email_bp = Blueprint('email', __name__)
 # Espera un JSON con 'email', 'username' y 'code'.
 # Respuestas:
 #     200: { 'message': 'Email de verificación enviado correctamente' }
+#     503: { 'error': 'email queue is full' }
 #     500: { 'error': <mensaje de error> }
 # -----------------------------------------------------------------------------
 @email_bp.route('/send-verification-email', methods=['POST'])
@@ -26,9 +29,10 @@ def send_verification_email():
         send_email_simple(email, username, code)
 
         return jsonify({"message": "Email de verificación enviado correctamente"}), 200
+    except EmailQueueFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
     
 # -----------------------------------------------------------------------------
@@ -37,6 +41,7 @@ def send_verification_email():
 # Espera un JSON con 'email', 'username' y 'code'.
 # Respuestas:
 #     200: { 'message': 'Email de verificación enviado correctamente' }
+#     503: { 'error': 'email queue is full' }
 #     500: { 'error': <mensaje de error> }
 # -----------------------------------------------------------------------------
 @email_bp.route('/send-forgot-password', methods=['POST'])
@@ -51,9 +56,10 @@ def send_forgot_verofication_email():
         send_forgot_email_code(email, username, code)
 
         return jsonify({"message": "Email de verificación enviado correctamente"}), 200
+    except EmailQueueFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -62,6 +68,7 @@ def send_forgot_verofication_email():
 # Espera un JSON con 'email'.
 # Respuestas:
 #     200: { 'message': 'Email de verificación enviado correctamente' }
+#     503: { 'error': 'email queue is full' }
 #     500: { 'error': <mensaje de error> }
 # -----------------------------------------------------------------------------
 @email_bp.route('/send-email-buy-product', methods=['POST'])
@@ -72,11 +79,23 @@ def send_buy_product_email():
         send_email_purchase(email)
 
         return jsonify({"message": "Email de verificación enviado correctamente"}), 200
+    except EmailQueueFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
-    
+
+# -----------------------------------------------------------------------------
+# GET /email-queue-stats
+# Devuelve el estado de la cola de emails del worker que atiende la petición.
+# Respuestas:
+#     200: { 'pid', 'queue_depth', 'enqueued', 'sent', 'failed', 'retries',
+#            'dropped', 'smtp_sessions', 'send_latency_avg_ms', ... }
+# -----------------------------------------------------------------------------
+@email_bp.route('/email-queue-stats', methods=['GET'])
+def email_queue_stats():
+    return jsonify(dispatcher.stats()), 200
+
 # -----------------------------------------------------------------------------
 # MÉTODO AUXILIAR
 # Envía un correo de confirmación de compra al usuario.
@@ -108,9 +127,7 @@ def send_email_purchase(email, order_id=None, ammount=None):
     """
     msg.set_content(content)
 
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-        smtp.login(os.getenv("EMAIL_FROM"), os.getenv("EMAIL_PASSWORD"))
-        smtp.send_message(msg)      
+    dispatch_email(msg)      
 
 
 
@@ -139,9 +156,7 @@ def send_email_simple(email, username, code):
     — The AstroLeap Team
     """)
 
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-        smtp.login(os.getenv("EMAIL_FROM"), os.getenv("EMAIL_PASSWORD"))
-        smtp.send_message(msg)      
+    dispatch_email(msg)      
 
 
 # -----------------------------------------------------------------------------
@@ -169,8 +184,6 @@ def send_forgot_email_code(email, username, code):
     — The AstroLeap Team
     """)
 
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-        smtp.login(os.getenv("EMAIL_FROM"), os.getenv("EMAIL_PASSWORD"))
-        smtp.send_message(msg)
+    dispatch_email(msg)
 
 
@@ -0,0 +1,43 @@
+import psycopg2
+from psycopg2 import extensions
+
+# -----------------------------------------------------------------------------
+# MODO COOPERATIVO (gevent)
+# Con GUNICORN_WORKER_CLASS=gevent (ver gunicorn.conf.py) cada worker atiende
+# cientos de peticiones a la vez en green threads. gunicorn parchea la
+# biblioteca estándar (socket, ssl, threading, time, select...) antes de cargar
+# la app, así que requests (PayPal), smtplib (emails) y los locks del pool ya
+# ceden el control mientras esperan. psycopg2 es una extensión en C y no se
+# entera del parche: patch_psycopg() registra un wait callback para que las
+# consultas también esperen a PostgreSQL sin bloquear el worker entero.
+# -----------------------------------------------------------------------------
+
+
+def gevent_active():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+def gevent_wait_callback(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+
+# Registra el wait callback de gevent en psycopg2 si el proceso está parcheado.
+# Se puede llamar tantas veces como se quiera.
+def patch_psycopg():
+    if gevent_active() and extensions.get_wait_callback() is None:
+        extensions.set_wait_callback(gevent_wait_callback)
@@ -0,0 +1,32 @@
+# -----------------------------------------------------------------------------
+# Configuración de gunicorn.
+# gunicorn la carga automáticamente desde el directorio de trabajo al ejecutar
+# `gunicorn app:app` (Procfile), así que no hace falta pasarla con -c.
+# -----------------------------------------------------------------------------
+import os
+
+# Tipo de worker: 'sync' (una petición a la vez por worker) o 'gevent' (green
+# threads: cada worker atiende hasta GUNICORN_WORKER_CONNECTIONS peticiones a
+# la vez, útil cuando las rutas esperan a PayPal o al SMTP; ver green.py).
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+
+# -----------------------------------------------------------------------------
+# Al arrancar cada worker se carga la clasificación en memoria en segundo plano,
+# para que la primera petición de rankings no pague la carga de user_competitive,
+# y se arranca el hilo de limpieza de órdenes (ver paypal/housekeeping.py).
+# -----------------------------------------------------------------------------
+def post_worker_init(worker):
+    import threading
+    from paypal.housekeeping import start_orders_sweeper
+    from user_competitive.leaderboard import get_leaderboard
+
+    def warm_up():
+        try:
+            get_leaderboard()
+        except Exception:
+            worker.log.exception("No se pudo precargar la clasificación")
+
+    threading.Thread(target=warm_up, name="leaderboard-warmup", daemon=True).start()
+    start_orders_sweeper()
@@ -0,0 +1,253 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request
+
+# -----------------------------------------------------------------------------
+# MÉTRICAS POR ENDPOINT
+# Cada worker cuenta en memoria, por ruta (la regla de Flask, no la URL) y
+# método:
+#   - http_requests_total: peticiones por código de estado,
+#   - http_request_duration_seconds: histograma de latencia,
+#   - http_response_size_bytes: histograma del tamaño de la respuesta (las
+#     respuestas por trozos no tienen Content-Length y no se cuentan),
+#   - http_requests_in_flight: peticiones en curso.
+# Agregación entre workers de gunicorn: cada worker vuelca sus valores cada
+# METRICS_FLUSH_INTERVAL segundos a un fichero propio (<pid>.json) dentro de
+# METRICS_DIR, y GET /metrics suma los ficheros de todos los workers y los
+# devuelve en el formato de texto de Prometheus. Los contadores de los workers
+# que ya han terminado se siguen sumando (un contador nunca debe bajar); las
+# peticiones en curso solo cuentan para los workers vivos.
+# Por defecto METRICS_DIR es un directorio temporal propio del proceso maestro.
+# -----------------------------------------------------------------------------
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+HELP = {
+    "http_requests_total": ("counter", "Peticiones HTTP atendidas"),
+    "http_request_duration_seconds": ("histogram", "Latencia de las peticiones HTTP en segundos"),
+    "http_response_size_bytes": ("histogram", "Tamaño de las respuestas HTTP en bytes"),
+    "http_requests_in_flight": ("gauge", "Peticiones HTTP en curso"),
+}
+BUCKETS = {
+    "http_request_duration_seconds": LATENCY_BUCKETS,
+    "http_response_size_bytes": SIZE_BUCKETS,
+}
+
+
+def metrics_dir():
+    path = os.getenv("METRICS_DIR") or os.path.join(tempfile.gettempdir(), f"astroleap_metrics_{os.getppid()}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# -----------------------------------------------------------------------------
+# Valores del worker actual. Las claves son (métrica, etiquetas) con las
+# etiquetas como tupla ordenada de pares (nombre, valor).
+# -----------------------------------------------------------------------------
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._dirty = False
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+
+    def add_gauge(self, name, labels, value):
+        with self._lock:
+            key = (name, labels)
+            self._gauges[key] = self._gauges.get(key, 0) + value
+            self._dirty = True
+
+    def observe(self, name, labels, value):
+        buckets = BUCKETS[name]
+        with self._lock:
+            key = (name, labels)
+            hist = self._histograms.get(key)
+            if hist is None:
+                # Un hueco por bucket, otro para +Inf, y después suma y total
+                hist = self._histograms[key] = [0] * (len(buckets) + 3)
+            hist[bisect_left(buckets, value)] += 1
+            hist[-2] += value
+            hist[-1] += 1
+            self._dirty = True
+
+    def snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return {
+                "pid": os.getpid(),
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                "gauges": [[name, list(labels), value] for (name, labels), value in self._gauges.items()],
+                "histograms": [[name, list(labels), list(hist)] for (name, labels), hist in self._histograms.items()],
+            }
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+
+_registry = None
+_registry_pid = None
+_registry_lock = threading.Lock()
+
+
+# -----------------------------------------------------------------------------
+# Registro del proceso actual, junto con el hilo que lo vuelca a disco. Tras un
+# fork se empieza de cero, para no contar dos veces lo del proceso padre.
+# -----------------------------------------------------------------------------
+def get_registry():
+    global _registry, _registry_pid
+    pid = os.getpid()
+    if _registry is None or _registry_pid != pid:
+        with _registry_lock:
+            if _registry is None or _registry_pid != pid:
+                registry = Registry()
+                threading.Thread(target=_flush_loop, args=(registry,), name="metrics-flush", daemon=True).start()
+                _registry, _registry_pid = registry, pid
+    return _registry
+
+
+def flush(registry=None):
+    registry = registry or _registry
+    if registry is None or _registry_pid != os.getpid():
+        return
+    path = os.path.join(metrics_dir(), f"{os.getpid()}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(registry.snapshot(), f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def _flush_loop(registry):
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        if registry.dirty:
+            try:
+                flush(registry)
+            except OSError:
+                pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# -----------------------------------------------------------------------------
+# Suma los volcados de todos los workers y los devuelve en el formato de texto
+# de Prometheus (versión 0.0.4).
+# -----------------------------------------------------------------------------
+def render():
+    flush()
+    counters, gauges, histograms = {}, {}, {}
+    for path in glob.glob(os.path.join(metrics_dir(), "*.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        if _pid_alive(data["pid"]):
+            for name, labels, value in data["gauges"]:
+                key = (name, tuple(map(tuple, labels)))
+                gauges[key] = gauges.get(key, 0) + value
+        for name, labels, hist in data["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.get(key)
+            histograms[key] = hist if total is None else [a + b for a, b in zip(total, hist)]
+
+    lines = []
+    for metric, (kind, text) in HELP.items():
+        lines.append(f"# HELP {metric} {text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        if kind == "histogram":
+            for (name, labels), hist in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS[name] + ("+Inf",), hist):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(hist[-2])}")
+                lines.append(f"{name}_count{_labels(labels)} {hist[-1]}")
+        else:
+            values = counters if kind == "counter" else gauges
+            for (name, labels), value in sorted(values.items()):
+                if name == metric:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else "<unmatched>"
+
+
+# -----------------------------------------------------------------------------
+# Registra en la app los hooks que miden cada petición.
+# -----------------------------------------------------------------------------
+def init_app(app):
+    @app.before_request
+    def start_request_metrics():
+        labels = (("method", request.method), ("route", _route()))
+        g._metrics_start = time.perf_counter()
+        g._metrics_labels = labels
+        get_registry().add_gauge("http_requests_in_flight", labels, 1)
+
+    @app.after_request
+    def record_request_metrics(response):
+        labels = g.get("_metrics_labels")
+        if labels is not None:
+            registry = get_registry()
+            registry.inc("http_requests_total", labels + (("status", str(response.status_code)),))
+            registry.observe("http_request_duration_seconds", labels, time.perf_counter() - g._metrics_start)
+            size = response.content_length
+            if size is not None:
+                registry.observe("http_response_size_bytes", labels, size)
+        return response
+
+    @app.teardown_request
+    def end_request_metrics(exc=None):
+        labels = g.pop("_metrics_labels", None)
+        if labels is not None:
+            get_registry().add_gauge("http_requests_in_flight", labels, -1)
+
+    atexit.register(flush)
+    return app
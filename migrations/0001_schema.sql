@@ -0,0 +1,64 @@
+-- -----------------------------------------------------------------------------
+-- 0001: tablas que esperan los blueprints.
+-- Usa IF NOT EXISTS para que en una base de datos que ya las tenía (creadas a
+-- mano antes de existir las migraciones) solo quede registrada como aplicada.
+-- -----------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS "user" (
+    id text PRIMARY KEY,
+    name text,
+    num_voren_money integer DEFAULT 0,
+    num_aurum_money integer DEFAULT 0,
+    icon_selected text,
+    banner_selected text,
+    email text UNIQUE,
+    skin_selected text,
+    password text,
+    anim_victory text,
+    anim_lose text
+);
+
+CREATE TABLE IF NOT EXISTS user_unlocks (
+    user_id text PRIMARY KEY,
+    icon_profile text[],
+    banner_profile text[],
+    skins_unlock text[],
+    anim_victory text[],
+    anim_lose text[]
+);
+
+CREATE TABLE IF NOT EXISTS user_competitive (
+    id_user text PRIMARY KEY,
+    trophies integer DEFAULT 0,
+    max_meters_traveled integer DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS shop (
+    id serial PRIMARY KEY,
+    type_offer text,
+    elements_offer text[]
+);
+
+CREATE TABLE IF NOT EXISTS current_shop (
+    id_shop integer PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS user_shop (
+    id_user text,
+    id_shop integer,
+    time_to_spin timestamp,
+    PRIMARY KEY (id_user, id_shop)
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+    order_id text PRIMARY KEY,
+    email_client text,
+    time_click_to_buy timestamp,
+    ammount numeric,
+    state text DEFAULT 'pending'
+);
+
+CREATE TABLE IF NOT EXISTS multiplayer_rooms (
+    room_code text PRIMARY KEY,
+    player1_id text,
+    player2_id text
+);
@@ -0,0 +1,39 @@
+-- -----------------------------------------------------------------------------
+-- 0002: índices de las consultas calientes (ver migrations/hot_queries.py).
+-- -----------------------------------------------------------------------------
+
+-- WHERE email = %s (login, verify-password, update-password, check-user-email,
+-- get-user-by-email). Las bases de datos creadas con 0001 ya lo tienen por el
+-- UNIQUE de la columna; solo se crea si "user"(email) no tiene ningún índice.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = '"user"'::regclass AND a.attname = 'email'
+    ) THEN
+        CREATE INDEX user_email_idx ON "user" (email);
+    END IF;
+END
+$$;
+
+-- Salas esperando rival: /rooms/first-available y /rooms/join buscan
+-- player2_id IS NULL ... LIMIT 1. El índice parcial solo contiene esas salas.
+CREATE INDEX IF NOT EXISTS multiplayer_rooms_waiting_idx
+    ON multiplayer_rooms (room_code) WHERE player2_id IS NULL;
+
+-- Al crear una sala se borran las salas completas previas del jugador
+-- (WHERE player1_id = %s AND player2_id IS NOT NULL)
+CREATE INDEX IF NOT EXISTS multiplayer_rooms_player1_idx
+    ON multiplayer_rooms (player1_id);
+
+-- /get-orders-by-email (WHERE email_client = %s ORDER BY time_click_to_buy DESC)
+-- y el límite de órdenes activas por usuario del checkout
+CREATE INDEX IF NOT EXISTS orders_email_time_idx
+    ON orders (email_client, time_click_to_buy DESC);
+
+-- Limpieza periódica de órdenes (paypal/housekeeping.py)
+CREATE INDEX IF NOT EXISTS orders_pending_time_idx
+    ON orders (time_click_to_buy) WHERE state != 'done';
+CREATE INDEX IF NOT EXISTS orders_done_time_idx
+    ON orders (time_click_to_buy) WHERE state = 'done';
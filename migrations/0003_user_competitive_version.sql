@@ -0,0 +1,25 @@
+-- -----------------------------------------------------------------------------
+-- 0003: versión de las filas de user_competitive.
+-- Cada INSERT/UPDATE da a la fila un número nuevo de la secuencia
+-- user_competitive_version_seq. El trigger corre con la fila ya bloqueada, así
+-- que de dos escrituras del mismo usuario la que confirma después tiene la
+-- versión mayor. Las clasificaciones en memoria (user_competitive/leaderboard.py)
+-- la usan para descartar cambios que les llegan desordenados (el NOTIFY de otro
+-- worker antes que la escritura propia, o al revés).
+-- -----------------------------------------------------------------------------
+CREATE SEQUENCE IF NOT EXISTS user_competitive_version_seq;
+
+-- Las filas existentes quedan con versión 0 (sin reescribir la tabla)
+ALTER TABLE user_competitive ADD COLUMN IF NOT EXISTS version bigint NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION user_competitive_bump_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := nextval('user_competitive_version_seq');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_competitive_version ON user_competitive;
+CREATE TRIGGER user_competitive_version
+    BEFORE INSERT OR UPDATE ON user_competitive
+    FOR EACH ROW EXECUTE FUNCTION user_competitive_bump_version();
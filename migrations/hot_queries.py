@@ -0,0 +1,85 @@
+import json
+
+# -----------------------------------------------------------------------------
+# CONSULTAS CALIENTES
+# Las consultas por clave que atienden las rutas más usadas, con valores de
+# ejemplo para sus parámetros. `python -m migrations.migrate check` obtiene el
+# plan de cada una (EXPLAIN, sin ejecutarla) y avisa de las que recorren una
+# tabla entera (Seq Scan).
+# Los planes se piden con enable_seqscan=off: en tablas pequeñas PostgreSQL
+# prefiere un Seq Scan aunque exista el índice, y lo que se comprueba es que
+# el índice exista y sea utilizable. Un Seq Scan que sigue ahí con
+# enable_seqscan=off significa que a la consulta le falta su índice.
+#
+# Las consultas que leen tablas enteras a propósito (GET /get-shop, la carga de
+# la clasificación en memoria de user_competitive/leaderboard.py...) no están.
+# -----------------------------------------------------------------------------
+HOT_QUERIES = (
+    # users / app.py
+    ("user.by_email", 'SELECT * FROM "user" WHERE email = %s', ("u1@example.com",)),
+    ("user.password_by_email", 'SELECT password FROM "user" WHERE email = %s', ("u1@example.com",)),
+    ("user.by_id", 'SELECT * FROM "user" WHERE id = %s', ("u1",)),
+    ("user_unlocks.by_user", "SELECT * FROM user_unlocks WHERE user_id = %s", ("u1",)),
+    ("user_shop.by_user", "SELECT id_shop FROM user_shop WHERE id_user = %s", ("u1",)),
+    # user_competitive
+    ("user_competitive.by_user", "SELECT * FROM user_competitive WHERE id_user = %s", ("u1",)),
+    ("user_competitive.set_trophies", "UPDATE user_competitive SET trophies = %s WHERE id_user = %s", (10, "u1")),
+    # multiplayer
+    ("rooms.first_available", "SELECT room_code FROM multiplayer_rooms WHERE player2_id IS NULL LIMIT 1", ()),
+    ("rooms.join_candidate", """
+        SELECT room_code FROM multiplayer_rooms
+        WHERE player2_id IS NULL AND player1_id <> %s
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED""", ("u1",)),
+    ("rooms.by_code", "SELECT room_code, player1_id, player2_id FROM multiplayer_rooms WHERE room_code = %s", ("ROOM1",)),
+    ("rooms.cleanup_player1", "DELETE FROM multiplayer_rooms WHERE player1_id = %s AND player2_id IS NOT NULL", ("u1",)),
+    # paypal
+    ("orders.by_id", "SELECT state FROM orders WHERE order_id = %s", ("ORDER1",)),
+    ("orders.by_email", "SELECT * FROM orders WHERE email_client = %s ORDER BY time_click_to_buy DESC", ("u1@example.com",)),
+    ("orders.active_by_email", """
+        SELECT order_id FROM orders
+        WHERE email_client = %s AND state != 'done'
+        ORDER BY time_click_to_buy DESC
+        OFFSET 3""", ("u1@example.com",)),
+    ("orders.sweep_pending", """
+        SELECT order_id FROM orders
+        WHERE state != 'done' AND time_click_to_buy < NOW() - make_interval(hours => 48)
+        LIMIT 1000
+        FOR UPDATE SKIP LOCKED""", ()),
+    ("orders.sweep_done", """
+        SELECT order_id FROM orders
+        WHERE state = 'done' AND time_click_to_buy < NOW() - make_interval(days => 14)
+        LIMIT 1000
+        FOR UPDATE SKIP LOCKED""", ()),
+)
+
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from _walk(child)
+
+
+# -----------------------------------------------------------------------------
+# Devuelve, para cada consulta caliente, (nombre, tablas recorridas con Seq
+# Scan, índices usados). No modifica nada: todo ocurre en una transacción que
+# se deshace al terminar.
+# -----------------------------------------------------------------------------
+def explain_hot_queries(conn, queries=HOT_QUERIES):
+    results = []
+    cur = conn.cursor()
+    try:
+        cur.execute("SET LOCAL enable_seqscan = off")
+        for name, sql, params in queries:
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            nodes = list(_walk(plan[0]["Plan"]))
+            seq_scans = sorted({n["Relation Name"] for n in nodes if n["Node Type"] == "Seq Scan"})
+            indexes = sorted({n["Index Name"] for n in nodes if "Index Name" in n})
+            results.append((name, seq_scans, indexes))
+    finally:
+        conn.rollback()
+        cur.close()
+    return results
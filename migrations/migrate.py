@@ -0,0 +1,144 @@
+import argparse
+import glob
+import hashlib
+import os
+import re
+import sys
+
+from db_pool import connect
+from migrations.hot_queries import explain_hot_queries
+
+# -----------------------------------------------------------------------------
+# MIGRACIONES DEL ESQUEMA
+# Cada migración es un fichero NNNN_descripcion.sql de este directorio. Se
+# aplican en orden de número, cada una en su propia transacción, y quedan
+# registradas en la tabla schema_migrations (versión, nombre, checksum del
+# fichero y fecha). Una migración ya aplicada no se vuelve a ejecutar: para
+# cambiar el esquema se añade una nueva, nunca se edita una existente (status
+# avisa si el fichero de una migración aplicada ha cambiado).
+# Mientras migra, el proceso mantiene un advisory lock de PostgreSQL, así que
+# si varias instancias lanzan upgrade a la vez solo una aplica las migraciones.
+#
+# Uso (desde la raíz del repositorio, con las variables DB_* de la API):
+#     python -m migrations.migrate upgrade    # aplica las pendientes
+#     python -m migrations.migrate status     # aplicadas y pendientes
+#     python -m migrations.migrate check      # EXPLAIN de las consultas calientes
+# En el Procfile, upgrade corre en la fase release de cada despliegue.
+# -----------------------------------------------------------------------------
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Clave del advisory lock de las migraciones
+MIGRATIONS_LOCK_KEY = 0x4D494752
+
+_FILENAME = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+
+def available_migrations():
+    migrations = []
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql"))):
+        match = _FILENAME.match(os.path.basename(path))
+        if not match:
+            raise ValueError(f"Nombre de migración no válido: {os.path.basename(path)} (se espera NNNN_descripcion.sql)")
+        with open(path, encoding="utf-8") as f:
+            sql = f.read()
+        migrations.append({
+            "version": match[1],
+            "name": match[2],
+            "sql": sql,
+            "checksum": hashlib.sha256(sql.encode()).hexdigest(),
+        })
+    versions = [m["version"] for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError("Hay dos migraciones con el mismo número")
+    return migrations
+
+
+def applied_migrations(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version text PRIMARY KEY,
+            name text NOT NULL,
+            checksum text NOT NULL,
+            applied_at timestamptz NOT NULL DEFAULT NOW()
+        )""")
+    cur.execute("SELECT version, checksum, applied_at FROM schema_migrations ORDER BY version")
+    applied = {version: (checksum, applied_at) for version, checksum, applied_at in cur.fetchall()}
+    conn.commit()
+    cur.close()
+    return applied
+
+
+# -----------------------------------------------------------------------------
+# Aplica las migraciones pendientes. Devuelve las versiones aplicadas.
+# -----------------------------------------------------------------------------
+def upgrade(conn, log=print):
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+    conn.commit()
+    try:
+        applied = applied_migrations(conn)
+        done = []
+        for migration in available_migrations():
+            if migration["version"] in applied:
+                continue
+            log(f"Aplicando {migration['version']}_{migration['name']}...")
+            cur.execute(migration["sql"])
+            cur.execute("INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                        (migration["version"], migration["name"], migration["checksum"]))
+            conn.commit()
+            done.append(migration["version"])
+        return done
+    finally:
+        conn.rollback()
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_KEY,))
+        conn.commit()
+        cur.close()
+
+
+def status(conn):
+    applied = applied_migrations(conn)
+    rows = []
+    for migration in available_migrations():
+        entry = applied.get(migration["version"])
+        if entry is None:
+            state = "pendiente"
+        elif entry[0] != migration["checksum"]:
+            state = f"aplicada {entry[1]:%Y-%m-%d %H:%M} (¡el fichero ha cambiado!)"
+        else:
+            state = f"aplicada {entry[1]:%Y-%m-%d %H:%M}"
+        rows.append((f"{migration['version']}_{migration['name']}", state))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m migrations.migrate",
+                                     description="Migraciones del esquema de la base de datos.")
+    parser.add_argument("command", choices=("upgrade", "status", "check"))
+    args = parser.parse_args(argv)
+
+    conn = connect()
+    try:
+        if args.command == "upgrade":
+            done = upgrade(conn)
+            print(f"Migraciones aplicadas: {', '.join(done)}" if done else "El esquema ya está al día")
+        elif args.command == "status":
+            for name, state in status(conn):
+                print(f"{name:40} {state}")
+        else:
+            flagged = 0
+            for name, seq_scans, indexes in explain_hot_queries(conn):
+                if seq_scans:
+                    flagged += 1
+                    print(f"SEQ SCAN  {name:32} {', '.join(seq_scans)}")
+                else:
+                    print(f"ok        {name:32} {', '.join(indexes)}")
+            if flagged:
+                print(f"\n{flagged} consultas recorren tablas enteras: les falta un índice")
+                sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 from flask import Blueprint, jsonify, request
 from utils import get_connection
+from prepared import execute_prepared
+import logging
 
 # Blueprint para agrupar las rutas relacionadas con el modo multijugador
 multiplayer_bp = Blueprint('multiplayer', __name__)
+logger = logging.getLogger(__name__)
 
 # -----------------------------------------------------------------------------
 # GET /rooms/first-available
@@ -12,16 +15,104 @@ multiplayer_bp = Blueprint('multiplayer', __name__)
 # -----------------------------------------------------------------------------
 @multiplayer_bp.route('/rooms/first-available', methods=['GET'])
 def get_first_available_room():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT room_code FROM multiplayer_rooms WHERE player2_id IS NULL LIMIT 1')
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        execute_prepared(cur, 'rooms_first_available')
+        row = cur.fetchone()
     if row:
         return jsonify({'room_code': row[0]})
     else:
         return jsonify({'room_code': None})
 
+# -----------------------------------------------------------------------------
+# POST /rooms/join
+# Emparejamiento en una sola petición: ocupa como player2 una sala en espera de
+# otro jugador o, si no hay ninguna, crea una nueva con el jugador como player1.
+# Todo ocurre en una única sentencia; las salas que otro emparejamiento tiene
+# bloqueadas se saltan (FOR UPDATE SKIP LOCKED), así dos jugadores nunca
+# reciben la misma sala. Las salas en espera se buscan en el índice parcial
+# multiplayer_rooms_waiting_idx (migrations/0002_hot_query_indexes.sql).
+# Espera un JSON con 'player_id' y, opcionalmente, 'room_code' (código de la
+# sala a crear si no hay ninguna libre; si no se indica, lo genera el servidor).
+# Si el jugador ya espera rival en una sala y no indica room_code, se le
+# devuelve esa sala en lugar de crear otra, así repetir la petición mientras
+# espera no acumula salas. Como en POST /rooms, al crear se eliminan las salas
+# completas previas del jugador.
+# Respuestas:
+#     200: { 'role': 'player2', 'room_code', 'player1_id', 'player2_id' }
+#     200: { 'role': 'player1', 'room_code', 'player1_id', 'player2_id': None } (sala en la que ya esperaba)
+#     201: { 'role': 'player1', 'room_code', 'player1_id', 'player2_id': None } (sala nueva)
+#     400: { 'error': 'player_id required' }
+#     409: { 'error': 'Room code already exists' } (el room_code indicado ya existe)
+#     500: { 'error': <mensaje de error> }
+# -----------------------------------------------------------------------------
+# Intentos al crear una sala con código generado, por si coincide con uno existente
+JOIN_CODE_ATTEMPTS = 3
+
+
+@multiplayer_bp.route('/rooms/join', methods=['POST'])
+def join_room():
+    data = request.get_json(silent=True) or {}
+    player_id = data.get('player_id')
+    room_code = data.get('room_code')
+    if not player_id:
+        return jsonify({'error': 'player_id required'}), 400
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            for _ in range(1 if room_code else JOIN_CODE_ATTEMPTS):
+                cur.execute("""
+                    WITH candidate AS (
+                        SELECT room_code FROM multiplayer_rooms
+                        WHERE player2_id IS NULL AND player1_id <> %(player_id)s
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    ), claimed AS (
+                        UPDATE multiplayer_rooms r SET player2_id = %(player_id)s
+                        FROM candidate c
+                        WHERE r.room_code = c.room_code
+                        RETURNING r.room_code, r.player1_id, r.player2_id
+                    ), waiting AS (
+                        SELECT room_code, player1_id, player2_id FROM multiplayer_rooms
+                        WHERE player1_id = %(player_id)s AND player2_id IS NULL
+                          AND %(room_code)s::text IS NULL
+                          AND NOT EXISTS (SELECT 1 FROM claimed)
+                        LIMIT 1
+                    ), cleanup AS (
+                        DELETE FROM multiplayer_rooms
+                        WHERE player1_id = %(player_id)s AND player2_id IS NOT NULL
+                          AND NOT EXISTS (SELECT 1 FROM claimed)
+                          AND NOT EXISTS (SELECT 1 FROM waiting)
+                    ), created AS (
+                        INSERT INTO multiplayer_rooms (room_code, player1_id, player2_id)
+                        SELECT COALESCE(%(room_code)s, upper(substr(md5(random()::text), 1, 8))), %(player_id)s, NULL
+                        WHERE NOT EXISTS (SELECT 1 FROM claimed)
+                          AND NOT EXISTS (SELECT 1 FROM waiting)
+                        ON CONFLICT DO NOTHING
+                        RETURNING room_code, player1_id, player2_id
+                    )
+                    SELECT 'player2', 200, room_code, player1_id, player2_id FROM claimed
+                    UNION ALL
+                    SELECT 'player1', 200, room_code, player1_id, player2_id FROM waiting
+                    UNION ALL
+                    SELECT 'player1', 201, room_code, player1_id, player2_id FROM created""", {'player_id': player_id, 'room_code': room_code})
+                row = cur.fetchone()
+                if row is not None:
+                    break
+                # El código ya existía: ninguna fila cambió, se deshace y se reintenta
+                conn.rollback()
+            if row is None:
+                if room_code:
+                    return jsonify({'error': 'Room code already exists'}), 409
+                raise RuntimeError("No se pudo generar un room_code libre")
+            conn.commit()
+            cur.close()
+        room = {'role': row[0], 'room_code': row[2], 'player1_id': row[3], 'player2_id': row[4]}
+        return jsonify(room), row[1]
+    except Exception as e:
+        logger.exception("Error no controlado")
+        return jsonify({'error': str(e)}), 500
+
 # -----------------------------------------------------------------------------
 # POST /rooms
 # Crea una nueva sala multijugador con un player1 y un room_code.
@@ -34,30 +125,24 @@ def get_first_available_room():
 @multiplayer_bp.route('/rooms', methods=['POST'])
 def create_room_player1():
     data = request.get_json()
-    print('POST /rooms - JSON recibido:', data)
     room_code = data.get('room_code') if data else None
     player1_id = data.get('player1_id') if data else None
-    print('room_code:', room_code)
-    print('player1_id:', player1_id)
     if not room_code or not player1_id:
-        print('Faltan campos obligatorios')
         return jsonify({'error': 'room_code and player1_id required'}), 400
-    conn = get_connection()
-    cur = conn.cursor()
-    # Elimina salas completas previas de este jugador
-    cur.execute('DELETE FROM multiplayer_rooms WHERE player1_id = %s AND player2_id IS NOT NULL', (player1_id,))
-    print(f"Salas completas eliminadas para player1_id: {player1_id}")
-    try:
-        # Inserta la nueva sala
-        cur.execute('INSERT INTO multiplayer_rooms (room_code, player1_id, player2_id) VALUES (%s, %s, %s)', (room_code, player1_id, None))
-        conn.commit()
-        print('Room creada correctamente')
-        return jsonify({'message': 'Room created'}), 201
-    except Exception as e:
-        print('Error al crear room:', str(e))
-        return jsonify({'error': str(e)}), 400
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Elimina salas completas previas de este jugador
+        cur.execute('DELETE FROM multiplayer_rooms WHERE player1_id = %s AND player2_id IS NOT NULL', (player1_id,))
+        logger.debug("Salas completas eliminadas", extra={"fields": {"player1_id": player1_id, "rows": cur.rowcount}})
+        try:
+            # Inserta la nueva sala
+            cur.execute('INSERT INTO multiplayer_rooms (room_code, player1_id, player2_id) VALUES (%s, %s, %s)', (room_code, player1_id, None))
+            conn.commit()
+            logger.debug("Sala creada", extra={"fields": {"room_code": room_code, "player1_id": player1_id}})
+            return jsonify({'message': 'Room created'}), 201
+        except Exception as e:
+            logger.warning("Error al crear sala", extra={"fields": {"room_code": room_code, "error": str(e)}})
+            return jsonify({'error': str(e)}), 400
 
 # -----------------------------------------------------------------------------
 # PUT /rooms/<room_code>/add-player2
@@ -74,14 +159,12 @@ def add_player2_to_room(room_code):
     player2_id = data.get('player2_id')
     if not player2_id:
         return jsonify({'error': 'player2_id required'}), 400
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('UPDATE multiplayer_rooms SET player2_id = %s WHERE room_code = %s', (player2_id, room_code))
-    conn.commit()
-    if cur.rowcount == 0:
-        conn.close()
-        return jsonify({'error': 'Room not found'}), 404
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('UPDATE multiplayer_rooms SET player2_id = %s WHERE room_code = %s', (player2_id, room_code))
+        conn.commit()
+        if cur.rowcount == 0:
+            return jsonify({'error': 'Room not found'}), 404
     return jsonify({'message': 'player2_id updated'})
 
 # -----------------------------------------------------------------------------
@@ -93,18 +176,13 @@ def add_player2_to_room(room_code):
 # -----------------------------------------------------------------------------
 @multiplayer_bp.route('/rooms/<room_code>', methods=['DELETE'])
 def delete_room(room_code):
-    print(f"Intentando eliminar room con room_code: {room_code}")
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('DELETE FROM multiplayer_rooms WHERE room_code = %s', (room_code,))
-    conn.commit()
-    print(f"Filas eliminadas: {cur.rowcount}")
-    if cur.rowcount == 0:
-        conn.close()
-        print('Room no encontrada para eliminar')
-        return jsonify({'error': 'Room not found'}), 404
-    conn.close()
-    print('Room eliminada correctamente')
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM multiplayer_rooms WHERE room_code = %s', (room_code,))
+        conn.commit()
+        if cur.rowcount == 0:
+            return jsonify({'error': 'Room not found'}), 404
+    logger.debug("Sala eliminada", extra={"fields": {"room_code": room_code}})
     return jsonify({'message': 'Room deleted'})
 
 # -----------------------------------------------------------------------------
@@ -116,11 +194,10 @@ def delete_room(room_code):
 # -----------------------------------------------------------------------------
 @multiplayer_bp.route('/rooms/<room_code>', methods=['GET'])
 def get_room_info(room_code):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT room_code, player1_id, player2_id FROM multiplayer_rooms WHERE room_code = %s', (room_code,))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        execute_prepared(cur, 'room_by_code', (room_code,))
+        row = cur.fetchone()
     if row:
         return jsonify({'room_code': row[0], 'player1_id': row[1], 'player2_id': row[2]})
     else:
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from green import gevent_active
+
+# -----------------------------------------------------------------------------
+# CLIENTE HTTP DE PAYPAL
+# Todas las llamadas a la API de PayPal pasan por aquí:
+#   - una requests.Session por worker, con keep-alive, para no repetir el
+#     handshake TCP + TLS en cada llamada,
+#   - timeouts de conexión y lectura (PAYPAL_CONNECT_TIMEOUT / PAYPAL_READ_TIMEOUT),
+#   - el access token OAuth se guarda en memoria y se renueva
+#     PAYPAL_TOKEN_REFRESH_MARGIN segundos antes de que caduque (expires_in).
+#     Si varias peticiones lo necesitan a la vez, solo una lo pide a PayPal y
+#     el resto espera y reutiliza el resultado.
+# -----------------------------------------------------------------------------
+PAYPAL_TIMEOUT = (
+    float(os.getenv("PAYPAL_CONNECT_TIMEOUT", "5")),
+    float(os.getenv("PAYPAL_READ_TIMEOUT", "20"))
+)
+PAYPAL_TOKEN_REFRESH_MARGIN = float(os.getenv("PAYPAL_TOKEN_REFRESH_MARGIN", "60"))
+# Con workers gevent hay muchas más llamadas a PayPal simultáneas por worker
+PAYPAL_POOL_SIZE = int(os.getenv("PAYPAL_POOL_SIZE", "100" if gevent_active() else "10"))
+
+
+def api_url(path):
+    return f"{os.getenv('PAYPAL_API_BASE')}{path}"
+
+
+# -----------------------------------------------------------------------------
+# Sesión HTTP del proceso actual (se vuelve a crear tras un fork, igual que el
+# pool de conexiones de la base de datos).
+# -----------------------------------------------------------------------------
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PAYPAL_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session, _session_pid = session, pid
+    return _session
+
+
+class TokenManager:
+    def __init__(self, refresh_margin=PAYPAL_TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+
+    # -------------------------------------------------------------------------
+    # Devuelve un access token válido, pidiéndolo a PayPal solo si no hay uno en
+    # memoria o está a punto de caducar.
+    # -------------------------------------------------------------------------
+    def get(self):
+        token = self._token
+        if token is not None and time.monotonic() < self._expires_at:
+            return token
+        with self._lock:
+            # Otro hilo puede haberlo renovado mientras esperábamos el lock
+            if self._token is not None and time.monotonic() < self._expires_at:
+                return self._token
+            token, expires_in = self._fetch()
+            self._token = token
+            self._expires_at = time.monotonic() + max(expires_in - self.refresh_margin, 0)
+            return token
+
+    # Descarta el token si sigue siendo el indicado (p. ej. PayPal respondió 401).
+    def invalidate(self, token):
+        with self._lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0.0
+
+    @staticmethod
+    def _fetch():
+        resp = get_session().post(
+            api_url("/v1/oauth2/token"),
+            auth=(os.getenv("PAYPAL_CLIENT_ID"), os.getenv("PAYPAL_CLIENT_SECRET")),
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            data={"grant_type": "client_credentials"},
+            timeout=PAYPAL_TIMEOUT
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        return data["access_token"], float(data.get("expires_in", 0))
+
+
+tokens = TokenManager()
+
+
+# -----------------------------------------------------------------------------
+# Hace una llamada autenticada a la API de PayPal y devuelve la respuesta (sin
+# comprobar el código de estado). Si PayPal rechaza el token (401), se descarta
+# y se repite la llamada una vez con uno nuevo.
+# Parámetros:
+#   method (str): Método HTTP.
+#   path (str): Ruta de la API, p. ej. '/v2/checkout/orders'.
+#   **kwargs: Se pasan a requests (json, headers...).
+# -----------------------------------------------------------------------------
+def paypal_request(method, path, **kwargs):
+    headers = kwargs.pop("headers", {})
+    kwargs.setdefault("timeout", PAYPAL_TIMEOUT)
+    for attempt in range(2):
+        token = tokens.get()
+        resp = get_session().request(
+            method,
+            api_url(path),
+            headers={**headers, "Authorization": f"Bearer {token}"},
+            **kwargs
+        )
+        if resp.status_code != 401 or attempt == 1:
+            return resp
+        tokens.invalidate(token)
+
+
+# -----------------------------------------------------------------------------
+# Comprueba con PayPal que un webhook es auténtico (API verify-webhook-signature).
+# Parámetros:
+#   headers: Cabeceras de la petición recibida (PAYPAL-TRANSMISSION-*...).
+#   event (dict): Cuerpo del webhook ya decodificado.
+# Devuelve True solo si PayPal responde verification_status = SUCCESS.
+# Sin PAYPAL_WEBHOOK_ID no se puede verificar y se devuelve False.
+# -----------------------------------------------------------------------------
+WEBHOOK_HEADERS = {
+    "transmission_id": "PAYPAL-TRANSMISSION-ID",
+    "transmission_time": "PAYPAL-TRANSMISSION-TIME",
+    "transmission_sig": "PAYPAL-TRANSMISSION-SIG",
+    "cert_url": "PAYPAL-CERT-URL",
+    "auth_algo": "PAYPAL-AUTH-ALGO",
+}
+
+
+def verify_webhook_signature(headers, event):
+    webhook_id = os.getenv("PAYPAL_WEBHOOK_ID")
+    if not webhook_id:
+        return False
+    body = {field: headers.get(header) for field, header in WEBHOOK_HEADERS.items()}
+    if None in body.values():
+        return False
+    body["webhook_id"] = webhook_id
+    body["webhook_event"] = event
+    resp = paypal_request("POST", "/v1/notifications/verify-webhook-signature", json=body)
+    resp.raise_for_status()
+    return resp.json().get("verification_status") == "SUCCESS"
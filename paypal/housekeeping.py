@@ -0,0 +1,126 @@
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+
+from utils import get_connection
+
+# -----------------------------------------------------------------------------
+# LIMPIEZA PERIÓDICA DE ÓRDENES
+# En lugar de borrar órdenes viejas en cada checkout, un hilo de cada worker
+# ejecuta cada ORDERS_SWEEP_INTERVAL segundos:
+#   - DELETE de las órdenes no 'done' con más de ORDERS_PENDING_TTL_HOURS horas,
+#   - DELETE de las órdenes 'done' con más de ORDERS_DONE_TTL_DAYS días,
+# en lotes de ORDERS_SWEEP_BATCH filas (una transacción corta por lote) que se
+# apoyan en índices parciales por time_click_to_buy (orders_pending_time_idx y
+# orders_done_time_idx, ver migrations/0002_hot_query_indexes.sql).
+# Aunque el hilo corre en todos los workers, cada lote toma un advisory lock de
+# PostgreSQL, así que en cada momento solo barre uno.
+# También se puede lanzar una pasada a mano (p. ej. desde un cron):
+#     python -m paypal.housekeeping
+# -----------------------------------------------------------------------------
+ORDERS_SWEEP_INTERVAL = float(os.getenv("ORDERS_SWEEP_INTERVAL", "300"))
+ORDERS_SWEEP_BATCH = int(os.getenv("ORDERS_SWEEP_BATCH", "1000"))
+ORDERS_PENDING_TTL_HOURS = int(os.getenv("ORDERS_PENDING_TTL_HOURS", "48"))
+ORDERS_DONE_TTL_DAYS = int(os.getenv("ORDERS_DONE_TTL_DAYS", "14"))
+
+# Clave del advisory lock que reparten los workers
+ORDERS_SWEEP_LOCK_KEY = 0x4F524453
+
+logger = logging.getLogger(__name__)
+
+_SWEEPS = {
+    "pending": ("state != 'done'", "time_click_to_buy < NOW() - make_interval(hours => %(ttl)s)"),
+    "done": ("state = 'done'", "time_click_to_buy < NOW() - make_interval(days => %(ttl)s)"),
+}
+
+def _delete_batch(cur, kind, ttl, batch_size):
+    state_filter, age_filter = _SWEEPS[kind]
+    cur.execute(f"""
+        DELETE FROM orders
+        WHERE order_id IN (
+            SELECT order_id FROM orders
+            WHERE {state_filter} AND {age_filter}
+            LIMIT %(batch)s
+            FOR UPDATE SKIP LOCKED
+        )""", {"ttl": ttl, "batch": batch_size})
+    return cur.rowcount
+
+
+# -----------------------------------------------------------------------------
+# Una pasada completa de limpieza. Devuelve las filas borradas por tipo, o None
+# si otro proceso estaba barriendo en ese momento.
+# -----------------------------------------------------------------------------
+def sweep_orders(batch_size=ORDERS_SWEEP_BATCH):
+    deleted = {"pending": 0, "done": 0}
+    ttls = {"pending": ORDERS_PENDING_TTL_HOURS, "done": ORDERS_DONE_TTL_DAYS}
+    with get_connection() as conn:
+        cur = conn.cursor()
+        for kind in _SWEEPS:
+            while True:
+                cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (ORDERS_SWEEP_LOCK_KEY,))
+                if not cur.fetchone()[0]:
+                    conn.rollback()
+                    cur.close()
+                    return None
+                count = _delete_batch(cur, kind, ttls[kind], batch_size)
+                conn.commit()
+                deleted[kind] += count
+                if count < batch_size:
+                    break
+        cur.close()
+    return deleted
+
+
+# -----------------------------------------------------------------------------
+# Hilo de limpieza del proceso actual (uno por worker, se arranca una vez).
+# -----------------------------------------------------------------------------
+_sweeper = None
+_sweeper_pid = None
+_sweeper_lock = threading.Lock()
+
+
+def _run(interval):
+    # Desfase inicial aleatorio para que los workers no arranquen a la vez
+    time.sleep(random.uniform(0, min(interval, 5.0)))
+    while True:
+        try:
+            deleted = sweep_orders()
+            if deleted and any(deleted.values()):
+                logger.info("Órdenes caducadas eliminadas", extra={"fields": deleted})
+        except Exception:
+            logger.exception("Error en la limpieza de órdenes")
+        time.sleep(interval)
+
+
+def start_orders_sweeper(interval=ORDERS_SWEEP_INTERVAL):
+    global _sweeper, _sweeper_pid
+    if interval <= 0:
+        return
+    pid = os.getpid()
+    if _sweeper is not None and _sweeper_pid == pid:
+        return
+    with _sweeper_lock:
+        if _sweeper is not None and _sweeper_pid == pid:
+            return
+        _sweeper = threading.Thread(target=_run, args=(interval,), name="orders-sweeper", daemon=True)
+        _sweeper.start()
+        _sweeper_pid = pid
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m paypal.housekeeping",
+                                     description="Elimina las órdenes caducadas en una pasada.")
+    parser.add_argument("--batch", type=int, default=ORDERS_SWEEP_BATCH)
+    args = parser.parse_args()
+    deleted = sweep_orders(args.batch)
+    if deleted is None:
+        print("Otro proceso está limpiando las órdenes; no se ha hecho nada")
+    else:
+        print(f"Órdenes eliminadas: {deleted['pending']} pendientes, {deleted['done']} completadas")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 from flask import Blueprint, jsonify, render_template, request
-from utils import get_connection
+from utils import get_connection, stream_json_array
+from paypal.client import paypal_request, tokens, verify_webhook_signature
+from paypal.housekeeping import start_orders_sweeper
+from paypal.status_cache import order_statuses
+import logging
 import requests
-import base64
 import os
 
 # -----------------------------------------------------------------------------
@@ -9,32 +12,23 @@ import os
 # El template_folder indica dónde buscar las plantillas HTML para las respuestas visuales.
 # -----------------------------------------------------------------------------
 paypal_bp = Blueprint('paypal', __name__, template_folder="templates")
+logger = logging.getLogger(__name__)
+
+# Órdenes activas (no 'done') máximas por usuario; al crear una más se elimina la más antigua
+ORDERS_MAX_ACTIVE = int(os.getenv("ORDERS_MAX_ACTIVE", "4"))
 
 # -----------------------------------------------------------------------------
 # Función auxiliar para obtener un access token de PayPal usando client_id y client_secret.
-# Se utiliza para autenticar las peticiones a la API de PayPal.
+# Se utiliza para autenticar las peticiones a la API de PayPal. El token se
+# reutiliza hasta poco antes de que caduque (ver paypal/client.py).
 # -----------------------------------------------------------------------------
 def get_paypal_access_token():
-    auth = base64.b64encode(
-        f"{os.getenv('PAYPAL_CLIENT_ID')}:{os.getenv('PAYPAL_CLIENT_SECRET')}"
-        .encode()
-    ).decode()
-    headers = {
-        "Authorization": f"Basic {auth}",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {"grant_type": "client_credentials"}
-    resp = requests.post(
-        f"{os.getenv('PAYPAL_API_BASE')}/v1/oauth2/token",
-        headers=headers,
-        data=data
-    )
-    resp.raise_for_status()
-    return resp.json()["access_token"]
+    return tokens.get()
 
 # -----------------------------------------------------------------------------
 # POST /create-paypal-order
-# Crea una nueva orden de pago en PayPal y la registra en la base de datos.
+# Crea una nueva orden de pago en PayPal y la registra en la base de datos con
+# un único INSERT (que también aplica el límite de ORDERS_MAX_ACTIVE órdenes activas).
 # Espera un JSON con 'amount', 'amountAurum' y 'email'.
 # Respuestas:
 #     200: Objeto con los datos de la orden creada
@@ -51,15 +45,10 @@ def create_paypal_order():
         return jsonify({"error": "Amount and email_client are required"}), 400
 
     try:
-        token = get_paypal_access_token()
+        get_paypal_access_token()
     except Exception as e:
         return jsonify({"error": "Failed to fetch PayPal token", "details": str(e)}), 500
 
-    url = f"{os.getenv('PAYPAL_API_BASE')}/v2/checkout/orders"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}"
-    }
     body = {
         "intent": "CAPTURE",
         "application_context": {
@@ -79,7 +68,7 @@ def create_paypal_order():
             }
         ]
     }
-    resp = requests.post(url, headers=headers, json=body)
+    resp = paypal_request("POST", "/v2/checkout/orders", json=body)
     try:
         resp.raise_for_status()
     except requests.HTTPError:
@@ -91,41 +80,38 @@ def create_paypal_order():
     order_data = resp.json()
     order_id = order_data.get("id")
     if order_id:
-        conn = get_connection()
-        cur = conn.cursor()
-        # Eliminar órdenes de más de 48h para este usuario, excepto las que tienen state = 'done'
-        cur.execute("""
-            DELETE FROM orders 
-            WHERE email_client = %s 
-              AND state != 'done' 
-              AND time_click_to_buy < NOW() - INTERVAL '48 hours'""", (email_client,))
-        # Eliminar órdenes 'done' solo si tienen más de 2 semanas
-        cur.execute("""
-            DELETE FROM orders 
-            WHERE email_client = %s 
-              AND state = 'done' 
-              AND time_click_to_buy < NOW() - INTERVAL '2 weeks'""", (email_client,))
-        # Limitar a 4 órdenes activas (no 'done'): si hay 4, eliminar la más antigua
-        cur.execute("SELECT order_id FROM orders WHERE email_client = %s AND state != 'done' ORDER BY time_click_to_buy ASC", (email_client,))
-        active_orders = cur.fetchall()
-        if len(active_orders) >= 4:
-            oldest_order_id = active_orders[0][0]
-            cur.execute('DELETE FROM orders WHERE order_id = %s', (oldest_order_id,))
-        # Insertar la nueva orden con ammount
-        cur.execute('INSERT INTO orders (order_id, email_client, time_click_to_buy, ammount) VALUES (%s, %s, NOW(), %s)', (order_id, email_client, amountAurum))
-        conn.commit()
-        # Obtener todos los order_id activos del usuario
-        cur.execute('SELECT order_id FROM orders WHERE email_client = %s', (email_client,))
-        all_active_orders = [row[0] for row in cur.fetchall()]
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            # Insertar la nueva orden y, en la misma sentencia, dejar al usuario
+            # con como mucho ORDERS_MAX_ACTIVE órdenes activas (no 'done')
+            # eliminando las más antiguas. Las órdenes caducadas las borra
+            # paypal/housekeeping.py.
+            cur.execute("""
+                WITH evicted AS (
+                    DELETE FROM orders
+                    WHERE order_id IN (
+                        SELECT order_id FROM orders
+                        WHERE email_client = %(email)s AND state != 'done'
+                        ORDER BY time_click_to_buy DESC
+                        OFFSET %(keep)s
+                    )
+                )
+                INSERT INTO orders (order_id, email_client, time_click_to_buy, ammount)
+                VALUES (%(order_id)s, %(email)s, NOW(), %(ammount)s)""",
+                {'email': email_client, 'keep': ORDERS_MAX_ACTIVE - 1, 'order_id': order_id, 'ammount': amountAurum})
+            conn.commit()
+            cur.close()
+        start_orders_sweeper()
 
     return jsonify(order_data), 200
 
 # -----------------------------------------------------------------------------
 # GET /check-paypal-order-status/<order_id>
 # Consulta el estado de una orden de PayPal y la captura si está aprobada.
-# Si la orden se completa, la elimina de la base de datos.
+# Si la orden se completa, la marca como 'done' (igual que /paypal-webhook).
+# El estado pasa por una caché por worker (ver paypal/status_cache.py): los
+# estados finales no se vuelven a consultar y las consultas simultáneas de la
+# misma orden se resuelven con una sola llamada a PayPal.
 # Respuestas:
 #     200: { 'completed': True/False, 'status': <estado> }
 #     500: { 'error': <mensaje de error> }
@@ -133,55 +119,170 @@ def create_paypal_order():
 @paypal_bp.route("/check-paypal-order-status/<order_id>", methods=["GET"])
 def check_paypal_order_status(order_id):
     try:
-        access_token = get_paypal_access_token()
-        headers = {
-            "Authorization": f"Bearer {access_token}"
-        }
-        response = requests.get(f"{os.getenv('PAYPAL_API_BASE')}/v2/checkout/orders/{order_id}", headers=headers)
-        response.raise_for_status()
-
-        order = response.json()
-        status = order.get("status")
-
-        # Solo capturar si está aprobado
-        if status == "APPROVED":
-            capture_result = capture_paypal_order(order_id, access_token)
-            # Puedes revisar el resultado de la captura si quieres
-            status = capture_result.get("status", status)
-
+        status = order_statuses.get(order_id, lambda: fetch_paypal_order_status(order_id))
         if status == "COMPLETED":
-            # Eliminar la orden de la base de datos si está completada
-            try:
-                conn = get_connection()
-                cur = conn.cursor()
-                cur.execute('DELETE FROM orders WHERE order_id = %s', (order_id,))
-                conn.commit()
-                cur.close()
-                conn.close()
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
             return jsonify({"completed": True})
         else:
             return jsonify({"completed": False, "status": status})
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
+# -----------------------------------------------------------------------------
+# Función auxiliar que obtiene de PayPal el estado de una orden, la captura si
+# está aprobada y, si queda completada, la marca como 'done'.
+# Devuelve el estado final de la orden.
+# -----------------------------------------------------------------------------
+def fetch_paypal_order_status(order_id):
+    response = paypal_request("GET", f"/v2/checkout/orders/{order_id}")
+    response.raise_for_status()
+
+    order = response.json()
+    status = order.get("status")
+
+    # Solo capturar si está aprobado y ninguna otra petición (el webhook u otro
+    # worker) la está capturando ya; si no, se responde APPROVED y el cliente
+    # vuelve a consultar
+    if status == "APPROVED":
+        captured = claim_and_capture_order(order_id)
+        if captured:
+            # claim_and_capture_order ya ha marcado la orden si quedó completada
+            return captured
+
+    if status == "COMPLETED":
+        # La orden se conserva como 'done', igual que cuando la completa el
+        # webhook: /orders/<order_id>/status y /get-orders-by-email la siguen viendo
+        try:
+            mark_order_done(order_id)
+        except Exception as e:
+            logger.exception("No se pudo marcar la orden completada como 'done'", extra={"fields": {"order_id": order_id}})
+    return status
+
 # -----------------------------------------------------------------------------
 # Función auxiliar para capturar una orden de PayPal (finalizar el pago).
+# Si PayPal responde que la orden ya estaba capturada (422
+# ORDER_ALREADY_CAPTURED), se trata como completada.
 # -----------------------------------------------------------------------------
-def capture_paypal_order(order_id, access_token):
-    url = f"{os.getenv('PAYPAL_API_BASE')}/v2/checkout/orders/{order_id}/capture"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    resp = requests.post(url, headers=headers)
+def capture_paypal_order(order_id):
+    resp = paypal_request("POST", f"/v2/checkout/orders/{order_id}/capture", headers={"Content-Type": "application/json"})
+    if resp.status_code == 422 and any(
+        detail.get("issue") == "ORDER_ALREADY_CAPTURED" for detail in (resp.json().get("details") or [])
+    ):
+        return {"id": order_id, "status": "COMPLETED"}
     resp.raise_for_status()
     return resp.json()
 
+# -----------------------------------------------------------------------------
+# Función auxiliar que captura una orden aprobada una sola vez, aunque el
+# webhook CHECKOUT.ORDER.APPROVED y las consultas de los clientes lleguen a la
+# vez: primero reclama la orden pasándola a 'approved' y solo quien la reclama
+# llama a /capture. Si la captura falla, la orden vuelve a 'pending' para que
+# el siguiente intento (reintento del webhook o nueva consulta) la reclame.
+# Devuelve el estado de la captura, o None si la orden no existe, ya está
+# 'done' o la está capturando otra petición.
+# -----------------------------------------------------------------------------
+def claim_and_capture_order(order_id):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE orders SET state = 'approved'
+            WHERE order_id = %s AND state NOT IN ('approved', 'done')
+            RETURNING order_id""", (order_id,))
+        claimed = cur.fetchone() is not None
+        conn.commit()
+        cur.close()
+    if not claimed:
+        return None
+    try:
+        status = capture_paypal_order(order_id).get("status")
+    except Exception:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE orders SET state = 'pending' WHERE order_id = %s AND state = 'approved'", (order_id,))
+            conn.commit()
+            cur.close()
+        raise
+    if status == "COMPLETED":
+        mark_order_done(order_id)
+    return status
+
+# -----------------------------------------------------------------------------
+# POST /paypal-webhook
+# Recibe los webhooks de PayPal (la firma se verifica con PayPal, ver
+# verify_webhook_signature en paypal/client.py) y actualiza el estado de la
+# orden en la tabla orders:
+#   CHECKOUT.ORDER.APPROVED: la orden se captura (claim_and_capture_order:
+#       pasa a 'approved' y, si la captura termina COMPLETED, a 'done').
+#   PAYMENT.CAPTURE.COMPLETED: la orden pasa a 'done'.
+# El resto de eventos se aceptan y se ignoran. Los reintentos de PayPal son
+# inocuos: una orden 'done' no se vuelve a capturar.
+# Respuestas:
+#     200: { 'received': True }
+#     400: { 'error': 'Firma del webhook no válida' }
+#     500: { 'error': <mensaje de error> } (PayPal reintentará el envío)
+# -----------------------------------------------------------------------------
+@paypal_bp.route("/paypal-webhook", methods=["POST"])
+def paypal_webhook():
+    event = request.get_json(silent=True) or {}
+    try:
+        if not verify_webhook_signature(request.headers, event):
+            logger.warning("Webhook de PayPal con firma no válida", extra={"fields": {"event_id": event.get("id")}})
+            return jsonify({"error": "Firma del webhook no válida"}), 400
+
+        event_type = event.get("event_type")
+        resource = event.get("resource") or {}
+        if event_type == "CHECKOUT.ORDER.APPROVED":
+            claim_and_capture_order(resource.get("id"))
+        elif event_type == "PAYMENT.CAPTURE.COMPLETED":
+            order_id = ((resource.get("supplementary_data") or {}).get("related_ids") or {}).get("order_id")
+            if order_id:
+                mark_order_done(order_id)
+        else:
+            logger.debug("Webhook de PayPal ignorado", extra={"fields": {"event_type": event_type}})
+        return jsonify({"received": True}), 200
+    except Exception as e:
+        logger.exception("Error procesando el webhook de PayPal", extra={"fields": {"event_id": event.get("id")}})
+        return jsonify({"error": str(e)}), 500
+
+# -----------------------------------------------------------------------------
+# Función auxiliar que marca una orden como pagada ('done').
+# -----------------------------------------------------------------------------
+def mark_order_done(order_id):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE orders SET state = 'done' WHERE order_id = %s", (order_id,))
+        updated = cur.rowcount
+        conn.commit()
+        cur.close()
+    if not updated:
+        logger.warning("Orden pagada que no está en la tabla orders", extra={"fields": {"order_id": order_id}})
+    order_statuses.put(order_id, "COMPLETED")
+
+# -----------------------------------------------------------------------------
+# GET /orders/<order_id>/status
+# Devuelve el estado de una orden según la tabla orders, sin llamar a PayPal.
+# Pensado para que los clientes consulten periódicamente el pago cuando los
+# webhooks (/paypal-webhook) mantienen el estado al día.
+# Respuestas:
+#     200: { 'order_id': ..., 'state': 'pending' | 'approved' | 'done', 'completed': True/False }
+#     404: { 'error': 'Orden no encontrada' }
+#     500: { 'error': <mensaje de error> }
+# -----------------------------------------------------------------------------
+@paypal_bp.route("/orders/<order_id>/status", methods=["GET"])
+def get_order_status(order_id):
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT state FROM orders WHERE order_id = %s', (order_id,))
+            row = cur.fetchone()
+            cur.close()
+        if row is None:
+            return jsonify({'error': 'Orden no encontrada'}), 404
+        return jsonify({'order_id': order_id, 'state': row[0], 'completed': row[0] == 'done'}), 200
+    except Exception as e:
+        logger.exception("Error no controlado")
+        return jsonify({'error': str(e)}), 500
+
 # -----------------------------------------------------------------------------
 # GET /paypal-success
 # Endpoint que muestra la página de éxito de compra de PayPal.
@@ -200,28 +301,25 @@ def paypal_success():
     email = None
     ammount = None
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT email_client, ammount FROM orders WHERE order_id = %s', (token,))
-        row = cur.fetchone()
-        if row:
-            email = row[0]
-            ammount = row[1]
-            # Llamar a la función de email para enviar el correo de compra con el order_id y ammount
-            try:
-                from emailSend.email import send_email_purchase
-                send_email_purchase(email, token, ammount)
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-        # Cambiar el campo state a 'done'
-        cur.execute('UPDATE orders SET state = %s WHERE order_id = %s', ('done', token))
-        conn.commit()
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT email_client, ammount FROM orders WHERE order_id = %s', (token,))
+            row = cur.fetchone()
+            if row:
+                email = row[0]
+                ammount = row[1]
+                # Llamar a la función de email para enviar el correo de compra con el order_id y ammount
+                try:
+                    from emailSend.email import send_email_purchase
+                    send_email_purchase(email, token, ammount)
+                except Exception as e:
+                    logger.exception("No se pudo enviar el email de compra", extra={"fields": {"order_id": token}})
+            # Cambiar el campo state a 'done'
+            cur.execute('UPDATE orders SET state = %s WHERE order_id = %s', ('done', token))
+            conn.commit()
+            cur.close()
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("No se pudo marcar la orden como 'done'", extra={"fields": {"order_id": token}})
 
     return render_template('paypal_success.html')
 
@@ -236,20 +334,19 @@ def paypal_cancel():
     token = request.args.get('token')
     if token:
         try:
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute('DELETE FROM orders WHERE order_id = %s', (token,))
-            conn.commit()
-            cur.close()
-            conn.close()
+            with get_connection() as conn:
+                cur = conn.cursor()
+                cur.execute('DELETE FROM orders WHERE order_id = %s', (token,))
+                conn.commit()
+                cur.close()
         except Exception as e:
-            import traceback
-            traceback.print_exc()
+            logger.exception("No se pudo eliminar la orden cancelada", extra={"fields": {"order_id": token}})
     return render_template('paypal_cancel.html')
 
 # -----------------------------------------------------------------------------
 # GET /get-orders-by-email/<email_client>
 # Devuelve todas las órdenes de compra asociadas a un email de cliente.
+# La respuesta se envía por trozos (ver stream_json_array en utils.py).
 # Respuesta:
 #     200: Array de objetos con los datos de cada orden
 #     500: { 'error': <mensaje de error> }
@@ -257,16 +354,18 @@ def paypal_cancel():
 @paypal_bp.route('/get-orders-by-email/<email_client>', methods=['GET'])
 def get_orders_by_email(email_client):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM orders WHERE email_client = %s ORDER BY time_click_to_buy DESC', (email_client,))
-        rows = cur.fetchall()
-        column_names = [desc[0] for desc in cur.description]
-        orders = [dict(zip(column_names, row)) for row in rows]
-        cur.close()
-        conn.close()
-        return jsonify(orders)
+        return stream_json_array('SELECT * FROM orders WHERE email_client = %s ORDER BY time_click_to_buy DESC', (email_client,))
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        logger.exception("Error no controlado")
+        return jsonify({'error': str(e)}), 500
+
+# -----------------------------------------------------------------------------
+# GET /paypal-status-cache-stats
+# Devuelve el estado de la caché de estados de órdenes del worker que atiende
+# la petición.
+# Respuesta:
+#     200: { 'pid', 'size', 'in_flight', 'hits', 'misses', 'collapsed', 'errors' }
+# -----------------------------------------------------------------------------
+@paypal_bp.route('/paypal-status-cache-stats', methods=['GET'])
+def paypal_status_cache_stats():
+    return jsonify(order_statuses.stats()), 200
@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# -----------------------------------------------------------------------------
+# CACHÉ DEL ESTADO DE LAS ÓRDENES DE PAYPAL
+# /check-paypal-order-status consulta PayPal a través de esta caché (una por
+# worker):
+#   - los estados finales (PAYPAL_TERMINAL_STATUSES) no cambian, así que se
+#     guardan sin caducidad,
+#   - el resto se guarda PAYPAL_STATUS_TTL segundos,
+#   - si varias peticiones piden a la vez una orden que no está en caché, solo
+#     una llama a PayPal y las demás esperan y reutilizan su resultado (o su
+#     error).
+# Como mucho se guardan PAYPAL_STATUS_CACHE_MAX órdenes; al superarlo se
+# descartan las usadas hace más tiempo.
+# -----------------------------------------------------------------------------
+PAYPAL_TERMINAL_STATUSES = frozenset(("COMPLETED", "VOIDED"))
+PAYPAL_STATUS_TTL = float(os.getenv("PAYPAL_STATUS_TTL", "3"))
+PAYPAL_STATUS_CACHE_MAX = int(os.getenv("PAYPAL_STATUS_CACHE_MAX", "10000"))
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.status = None
+        self.error = None
+
+
+class OrderStatusCache:
+    def __init__(self, ttl=PAYPAL_STATUS_TTL, max_size=PAYPAL_STATUS_CACHE_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # order_id -> (estado, instante de caducidad o None si no caduca)
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._stats = {"hits": 0, "misses": 0, "collapsed": 0, "errors": 0}
+
+    # -------------------------------------------------------------------------
+    # Devuelve el estado de la orden desde la caché o, si no está o ha
+    # caducado, llamando a fetch() (una sola vez aunque haya peticiones
+    # concurrentes para la misma orden).
+    # -------------------------------------------------------------------------
+    def get(self, order_id, fetch):
+        with self._lock:
+            entry = self._entries.get(order_id)
+            if entry is not None:
+                status, expires_at = entry
+                if expires_at is None or time.monotonic() < expires_at:
+                    self._entries.move_to_end(order_id)
+                    self._stats["hits"] += 1
+                    return status
+                del self._entries[order_id]
+            flight = self._flights.get(order_id)
+            leader = flight is None
+            if leader:
+                flight = self._flights[order_id] = _Flight()
+                self._stats["misses"] += 1
+            else:
+                self._stats["collapsed"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.status
+
+        try:
+            flight.status = fetch()
+            self.put(order_id, flight.status)
+            return flight.status
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(order_id, None)
+            flight.done.set()
+
+    def put(self, order_id, status):
+        expires_at = None if status in PAYPAL_TERMINAL_STATUSES else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[order_id] = (status, expires_at)
+            self._entries.move_to_end(order_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "size": len(self._entries),
+                "in_flight": len(self._flights),
+                **self._stats,
+            }
+
+
+order_statuses = OrderStatusCache()
@@ -0,0 +1,126 @@
+import os
+import re
+import threading
+
+from psycopg2 import errors, extensions
+
+# -----------------------------------------------------------------------------
+# SENTENCIAS PREPARADAS
+# Las consultas más frecuentes (HOT_STATEMENTS) se preparan en el servidor una
+# sola vez por conexión física del pool (PREPARE) y después se ejecutan por
+# nombre (EXECUTE), así PostgreSQL no vuelve a analizar ni a planificar el texto
+# de la consulta en cada petición:
+#   - cada conexión (PgConnection.prepared, ver db_pool.py) recuerda qué
+#     sentencias tiene preparadas; una conexión nueva (también tras reciclar o
+#     reconectar) empieza vacía y las vuelve a preparar al usarlas,
+#   - la primera vez se envían PREPARE y EXECUTE juntos, en un solo viaje,
+#   - si el servidor ya no tiene la sentencia (DISCARD ALL, un pooler en modo
+#     transacción...) o ya la tenía, la consulta se repite como texto normal y
+#     la sentencia se vuelve a preparar en la siguiente ejecución,
+#   - si una migración cambia una tabla de forma que el plan guardado ya no
+#     sirve ("cached plan must not change result type"), la sentencia se
+#     descarta (DEALLOCATE) y la consulta se repite como texto.
+#   En los dos casos, la consulta solo se puede repetir si el error llega en la
+#   primera sentencia de la transacción; si no, la transacción ya está abortada
+#   y el error se propaga (la sentencia se repara en la siguiente ejecución que
+#   sí sea la primera).
+# Ninguna sentencia usa SELECT *, para que añadir una columna a una tabla no
+# cambie el resultado de las ya preparadas: las que devuelven la fila entera lo
+# hacen como un único jsonb (to_jsonb(fila), que incluye todas las columnas que
+# tenga la tabla en cada momento) y el resto nombran sus columnas.
+# DB_PREPARED_STATEMENTS=0 ejecuta siempre el texto de la consulta.
+# -----------------------------------------------------------------------------
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "1") == "1"
+
+# Nombre -> consulta con parámetros %s (en el mismo orden que los valores)
+HOT_STATEMENTS = {
+    "user_by_email": 'SELECT to_jsonb(u) FROM "user" u WHERE email = %s',
+    "user_by_id": 'SELECT to_jsonb(u) FROM "user" u WHERE id = %s',
+    "user_password_by_email": 'SELECT password FROM "user" WHERE email = %s',
+    "user_email_exists": 'SELECT EXISTS (SELECT 1 FROM "user" WHERE email = %s)',
+    "user_unlocks_by_user": "SELECT to_jsonb(ul) FROM user_unlocks ul WHERE user_id = %s",
+    "user_shop_by_user": "SELECT id_shop FROM user_shop WHERE id_user = %s",
+    "user_competitive_by_user": "SELECT id_user, trophies, max_meters_traveled FROM user_competitive WHERE id_user = %s",
+    "rooms_first_available": "SELECT room_code FROM multiplayer_rooms WHERE player2_id IS NULL LIMIT 1",
+    "room_by_code": "SELECT room_code, player1_id, player2_id FROM multiplayer_rooms WHERE room_code = %s",
+}
+
+STATEMENT_PREFIX = "astroleap_"
+
+
+def _numbered(sql):
+    counter = iter(range(1, sql.count("%s") + 1))
+    return re.sub(r"%s", lambda _: f"${next(counter)}", sql)
+
+
+class PreparedStatements:
+    def __init__(self, statements, enabled=DB_PREPARED_STATEMENTS):
+        self.enabled = enabled
+        # nombre -> (texto con %s, nombre en el servidor, cuerpo del PREPARE con $n)
+        self._statements = {
+            name: (sql, STATEMENT_PREFIX + name, _numbered(sql)) for name, sql in statements.items()
+        }
+        self._lock = threading.Lock()
+        self._stats = {"prepares": 0, "executions": 0, "text_executions": 0, "fallbacks": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    # -------------------------------------------------------------------------
+    # Ejecuta la sentencia `name` en el cursor. El resultado se lee del cursor
+    # como con cur.execute (fetchone, fetchall, description...).
+    # -------------------------------------------------------------------------
+    def execute(self, cur, name, params=()):
+        sql, statement, body = self._statements[name]
+        conn = cur.connection
+        prepared = getattr(conn, "prepared", None)
+        if not self.enabled or prepared is None:
+            self._count("text_executions")
+            cur.execute(sql, params)
+            return
+
+        execute_sql = f"EXECUTE {statement}" + (f" ({', '.join(['%s'] * len(params))})" if params else "")
+        first_in_transaction = conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+        was_prepared = statement in prepared
+        try:
+            if was_prepared:
+                cur.execute(execute_sql, params)
+            else:
+                cur.execute(f"PREPARE {statement} AS {body}; {execute_sql}", params)
+                prepared.add(statement)
+                self._count("prepares")
+            self._count("executions")
+        except (errors.InvalidSqlStatementName, errors.DuplicatePreparedStatement) as e:
+            # La conexión no sabía qué sentencias tiene el servidor: se ajusta
+            # el registro y esta vez se ejecuta el texto
+            if isinstance(e, errors.InvalidSqlStatementName):
+                prepared.discard(statement)
+            else:
+                prepared.add(statement)
+            if not first_in_transaction:
+                raise
+            conn.rollback()
+            self._count("fallbacks")
+            cur.execute(sql, params)
+        except errors.FeatureNotSupported:
+            # El plan guardado ya no vale para la tabla (una migración la ha
+            # cambiado): se descarta la sentencia y esta vez se ejecuta el texto
+            if not was_prepared or not first_in_transaction:
+                raise
+            conn.rollback()
+            cur.execute(f"DEALLOCATE {statement}")
+            prepared.discard(statement)
+            self._count("fallbacks")
+            cur.execute(sql, params)
+
+    def stats(self):
+        with self._lock:
+            return {"pid": os.getpid(), "enabled": self.enabled, "statements": len(self._statements), **self._stats}
+
+
+statements = PreparedStatements(HOT_STATEMENTS)
+
+
+def execute_prepared(cur, name, params=()):
+    statements.execute(cur, name, params)
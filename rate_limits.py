@@ -0,0 +1,193 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+
+from flask import request
+from limits.storage import Storage
+
+# -----------------------------------------------------------------------------
+# LÍMITES DE PETICIONES COMPARTIDOS ENTRE WORKERS
+# flask-limiter guarda por defecto los contadores en la memoria de cada
+# proceso, así que con N workers de gunicorn cada cliente tenía N veces el
+# límite. SharedMemoryStorage guarda los contadores en un fichero proyectado en
+# memoria (mmap) que comparten todos los workers de la máquina:
+#   - la tabla tiene RATELIMIT_SHM_BUCKETS bloques de BUCKET_WAYS huecos; cada
+#     clave (su hash de 64 bits) va siempre al mismo bloque,
+#   - cada operación bloquea solo su bloque (lockf sobre ese rango del fichero
+#     entre procesos, y un lock normal entre hilos del mismo proceso),
+#   - los huecos caducados se reutilizan; si un bloque está lleno se descarta
+#     el contador que antes caduque.
+# Solo soporta la estrategia fixed-window (la que usa flask-limiter por defecto).
+#
+# Se selecciona con RATELIMIT_STORAGE_URI=shm://<ruta> (por defecto, un
+# fichero temporal propio del proceso maestro de gunicorn). Cualquier otra URI
+# de flask-limiter (memory://, redis://...) también vale.
+#
+# Además, cada cliente tiene un presupuesto global (RATELIMIT_APP_LIMIT) del que
+# cada ruta descuenta su coste (ROUTE_COSTS, por defecto 1), así las rutas
+# caras agotan antes el presupuesto que las baratas.
+# -----------------------------------------------------------------------------
+RATELIMIT_SHM_BUCKETS = int(os.getenv("RATELIMIT_SHM_BUCKETS", "4096"))
+RATELIMIT_APP_LIMIT = os.getenv("RATELIMIT_APP_LIMIT", "600 per minute")
+
+BUCKET_WAYS = 16
+# Hueco: hash de la clave, instante de caducidad (time.time()) y contador
+_SLOT = struct.Struct("<QdQ")
+BUCKET_SIZE = BUCKET_WAYS * _SLOT.size
+_THREAD_LOCKS = 64
+
+
+def default_storage_uri():
+    return "shm://" + os.path.join(tempfile.gettempdir(), f"astroleap_ratelimit_{os.getppid()}")
+
+
+class SharedMemoryStorage(Storage):
+    STORAGE_SCHEME = ["shm"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        path = urllib.parse.urlparse(uri or "").path or urllib.parse.urlparse(default_storage_uri()).path
+        buckets = int(options.pop("buckets", RATELIMIT_SHM_BUCKETS))
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # El primer worker que abre el fichero fija su tamaño; el resto lo respeta
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < BUCKET_SIZE:
+                os.ftruncate(self._fd, buckets * BUCKET_SIZE)
+            size = os.fstat(self._fd).st_size
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self.buckets = size // BUCKET_SIZE
+        self._mm = mmap.mmap(self._fd, self.buckets * BUCKET_SIZE)
+        self._locks = [threading.Lock() for _ in range(_THREAD_LOCKS)]
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    def _locate(self, key):
+        h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+        return h, (h % self.buckets) * BUCKET_SIZE
+
+    @contextmanager
+    def _bucket_lock(self, offset):
+        with self._locks[(offset // BUCKET_SIZE) % _THREAD_LOCKS]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, BUCKET_SIZE, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, BUCKET_SIZE, offset)
+
+    # -------------------------------------------------------------------------
+    # Busca la clave en su bloque (con el bloque ya bloqueado). Devuelve
+    # (posición, caducidad, contador) del hueco vivo de la clave o, si no está
+    # y create=True, de un hueco libre para ella con contador 0.
+    # -------------------------------------------------------------------------
+    def _find(self, h, offset, now, create):
+        free = None
+        oldest = None
+        for way in range(BUCKET_WAYS):
+            pos = offset + way * _SLOT.size
+            key_hash, expires_at, count = _SLOT.unpack_from(self._mm, pos)
+            if key_hash == h and expires_at > now:
+                return pos, expires_at, count
+            if free is None and (key_hash == 0 or expires_at <= now):
+                free = pos
+            if oldest is None or expires_at < oldest[1]:
+                oldest = (pos, expires_at)
+        if not create:
+            return None, now, 0
+        return (free if free is not None else oldest[0]), now, 0
+
+    def incr(self, key, expiry, amount=1):
+        h, offset = self._locate(key)
+        now = time.time()
+        with self._bucket_lock(offset):
+            pos, expires_at, count = self._find(h, offset, now, create=True)
+            if count == 0:
+                expires_at = now + expiry
+            count += amount
+            _SLOT.pack_into(self._mm, pos, h, expires_at, count)
+        return count
+
+    def get(self, key):
+        h, offset = self._locate(key)
+        with self._bucket_lock(offset):
+            return self._find(h, offset, time.time(), create=False)[2]
+
+    def get_expiry(self, key):
+        h, offset = self._locate(key)
+        with self._bucket_lock(offset):
+            return self._find(h, offset, time.time(), create=False)[1]
+
+    def clear(self, key):
+        h, offset = self._locate(key)
+        with self._bucket_lock(offset):
+            pos = self._find(h, offset, time.time(), create=False)[0]
+            if pos is not None:
+                _SLOT.pack_into(self._mm, pos, 0, 0.0, 0)
+
+    def reset(self):
+        now = time.time()
+        cleared = 0
+        for offset in range(0, self.buckets * BUCKET_SIZE, BUCKET_SIZE):
+            with self._bucket_lock(offset):
+                for way in range(BUCKET_WAYS):
+                    pos = offset + way * _SLOT.size
+                    key_hash, expires_at, _ = _SLOT.unpack_from(self._mm, pos)
+                    if key_hash and expires_at > now:
+                        cleared += 1
+                    _SLOT.pack_into(self._mm, pos, 0, 0.0, 0)
+        return cleared
+
+    def check(self):
+        return not self._mm.closed
+
+
+# -----------------------------------------------------------------------------
+# Coste de cada ruta en el presupuesto global del cliente. La clave es la regla
+# de Flask, opcionalmente precedida del método ('GET /user_competitive').
+# RATELIMIT_ROUTE_COSTS añade o sustituye costes, p. ej. "/get-users=50,GET /=0".
+# -----------------------------------------------------------------------------
+ROUTE_COSTS = {
+    # Devuelven tablas enteras
+    "/get-users": 20,
+    "/user_shop_time_to_spin": 20,
+    "GET /user_competitive": 20,
+    # Llaman a PayPal o envían emails
+    "/create-paypal-order": 5,
+    "/check-paypal-order-status/<order_id>": 3,
+    "/send-verification-email": 5,
+    "/send-forgot-password": 5,
+    "/send-email-buy-product": 5,
+    # Comprueban contraseñas
+    "/update-password": 3,
+    "/verify-password": 3,
+}
+
+
+def _parse_costs(value):
+    costs = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, _, cost = item.rpartition("=")
+        costs[route.strip()] = int(cost)
+    return costs
+
+
+ROUTE_COSTS.update(_parse_costs(os.getenv("RATELIMIT_ROUTE_COSTS", "")))
+
+
+def route_cost():
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    cost = ROUTE_COSTS.get(f"{request.method} {rule}")
+    if cost is None:
+        cost = ROUTE_COSTS.get(rule, 1)
+    return cost
@@ -1,26 +1,100 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 from utils import get_connection
+import hashlib
+import logging
+import os
+import threading
+import time
 
 
 shop_bp = Blueprint('shop', __name__)
+logger = logging.getLogger(__name__)
 
 # -----------------------------------------------------------------------------
-# GET /get-shop
-# Devuelve todos los ítems de la tienda.
-# Respuesta: Array de objetos con los datos de cada ítem.
+# CACHÉ DEL CATÁLOGO
+# El catálogo solo cambia a través de /add-shop-item, así que cada worker guarda
+# en memoria los ítems ya serializados a JSON junto con su ETag.
+#   - add_shop_item incrementa la versión del catálogo, lo que invalida la caché
+#     del worker que atiende la petición.
+#   - Los demás workers recargan el catálogo al cumplirse SHOP_CACHE_TTL segundos.
+#   - El ETag es el hash del JSON, así que todos los workers dan el mismo ETag
+#     para el mismo catálogo y los clientes reciben 304 sin consultar la base de
+#     datos ni volver a serializar.
 # -----------------------------------------------------------------------------
-@shop_bp.route('/get-shop', methods=['GET'])
-def get_shop():
-    try:
-        conn = get_connection()
+SHOP_CACHE_TTL = float(os.getenv("SHOP_CACHE_TTL", "60"))
+
+_catalog_lock = threading.Lock()
+_catalog_version = 0
+_catalog = None
+
+
+def bump_catalog_version():
+    global _catalog_version
+    with _catalog_lock:
+        _catalog_version += 1
+
+
+def _encode(value):
+    # Mismo cuerpo que generaría jsonify
+    body = current_app.json.response(value).get_data()
+    return body, hashlib.sha256(body).hexdigest()
+
+
+def _load_catalog(version):
+    with get_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM shop")
         rows = cur.fetchall()
         column_names = [desc[0] for desc in cur.description]
         shop_items = [dict(zip(column_names, row)) for row in rows]
         cur.close()
-        conn.close()
-        return jsonify(shop_items)
+    body, etag = _encode(shop_items)
+    return {
+        "version": version,
+        "loaded_at": time.monotonic(),
+        "body": body,
+        "etag": etag,
+        "items": {item['id']: _encode(item) for item in shop_items}
+    }
+
+
+# -----------------------------------------------------------------------------
+# Devuelve el catálogo cacheado, recargándolo si su versión o su TTL han caducado.
+# La recarga se hace bajo el lock para que varias peticiones simultáneas no
+# lancen la misma consulta a la vez.
+# -----------------------------------------------------------------------------
+def get_catalog():
+    global _catalog
+    catalog = _catalog
+    if catalog and catalog["version"] == _catalog_version and time.monotonic() - catalog["loaded_at"] < SHOP_CACHE_TTL:
+        return catalog
+    with _catalog_lock:
+        catalog = _catalog
+        if not (catalog and catalog["version"] == _catalog_version and time.monotonic() - catalog["loaded_at"] < SHOP_CACHE_TTL):
+            catalog = _catalog = _load_catalog(_catalog_version)
+        return catalog
+
+
+def _cached_json_response(body, etag):
+    response = current_app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    # Devuelve 304 sin cuerpo si el cliente ya tiene esta versión (If-None-Match)
+    return response.make_conditional(request)
+
+# -----------------------------------------------------------------------------
+# GET /get-shop
+# Devuelve todos los ítems de la tienda.
+# Admite If-None-Match con el ETag de una respuesta anterior.
+# Respuesta:
+#     200: Array de objetos con los datos de cada ítem (cabecera ETag)
+#     304: Sin cuerpo, el catálogo no ha cambiado
+# -----------------------------------------------------------------------------
+@shop_bp.route('/get-shop', methods=['GET'])
+def get_shop():
+    try:
+        catalog = get_catalog()
+        return _cached_json_response(catalog["body"], catalog["etag"])
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -36,21 +110,21 @@ def get_shop():
 def add_shop_item():
     try:
         data = request.json
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn:
+            cur = conn.cursor()
 
-        cur.execute("""
-            INSERT INTO shop (
-                type_offer, elements_offer
-            ) VALUES (%s, %s)
-        """, (
-            data['type_offer'],
-            data.get('elements_offer', [])
-        ))
+            cur.execute("""
+                INSERT INTO shop (
+                    type_offer, elements_offer
+                ) VALUES (%s, %s)
+            """, (
+                data['type_offer'],
+                data.get('elements_offer', [])
+            ))
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            conn.commit()
+            cur.close()
+        bump_catalog_version()
         return jsonify({"message": "Ítem de tienda añadido correctamente"}), 201
 
     except Exception as e:
@@ -60,28 +134,32 @@ def add_shop_item():
 # -----------------------------------------------------------------------------
 # GET /get-shop-item/<item_id>
 # Devuelve la información de un ítem de la tienda por su id.
+# Se sirve desde la caché del catálogo; si el ítem no está (por ejemplo, lo ha
+# añadido otro worker hace menos de SHOP_CACHE_TTL segundos) se consulta la base de datos.
 # Respuesta:
-#     200: Objeto con los datos del ítem
+#     200: Objeto con los datos del ítem (cabecera ETag)
+#     304: Sin cuerpo, el ítem no ha cambiado
 #     404: { "error": "Ítem no encontrado" }
 #     500: { "error": <mensaje de error> }
 # -----------------------------------------------------------------------------
 @shop_bp.route('/get-shop-item/<int:item_id>', methods=['GET'])
 def get_shop_item(item_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM shop WHERE id = %s', (item_id,))
-        row = cur.fetchone()
-        if row:
-            column_names = [desc[0] for desc in cur.description]
-            item = dict(zip(column_names, row))
-            result = jsonify(item)
-        else:
-            result = jsonify({"error": "Ítem no encontrado"}), 404
-        cur.close()
-        conn.close()
+        cached = get_catalog()["items"].get(item_id)
+        if cached:
+            return _cached_json_response(*cached)
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT * FROM shop WHERE id = %s', (item_id,))
+            row = cur.fetchone()
+            if row:
+                column_names = [desc[0] for desc in cur.description]
+                item = dict(zip(column_names, row))
+                result = jsonify(item)
+            else:
+                result = jsonify({"error": "Ítem no encontrado"}), 404
+            cur.close()
         return result
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        logger.exception("Error no controlado")
+        return jsonify({"error": str(e)}), 500
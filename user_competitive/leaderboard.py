@@ -0,0 +1,365 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from bisect import bisect_left, insort
+
+import psycopg2
+from psycopg2 import extensions
+
+from db_pool import connect
+from utils import get_connection
+
+# -----------------------------------------------------------------------------
+# CLASIFICACIÓN EN MEMORIA
+# Cada worker mantiene la tabla user_competitive ordenada en memoria por copas y
+# por metros, de modo que los rankings (top N con desplazamiento) se sirven en
+# O(log n + N) sin consultar la base de datos.
+#
+# Sincronización entre workers:
+#   - Los endpoints que escriben en user_competitive devuelven la fila modificada
+#     y, en la misma sentencia, lanzan un NOTIFY en el canal LEADERBOARD_CHANNEL.
+#   - Cada worker escucha ese canal con una conexión dedicada (fuera del pool) y
+#     aplica los cambios según llegan. PostgreSQL entrega las notificaciones al
+#     hacer commit y en orden de commit.
+#   - El worker que escribe aplica además su propia fila tras el commit, sin
+#     esperar a la notificación. Como eso puede ocurrir antes o después de que
+#     llegue la notificación de otra escritura del mismo usuario, cada fila lleva
+#     su versión (columna version, migrations/0003_user_competitive_version.sql)
+#     y la clasificación ignora los cambios con una versión más antigua que la
+#     que ya tiene.
+#   - Si la conexión de escucha se cae, se reconecta y se recarga la tabla entera
+#     para no perder cambios.
+# -----------------------------------------------------------------------------
+LEADERBOARD_CHANNEL = "user_competitive_changes"
+LEADERBOARD_BUCKET_SIZE = int(os.getenv("LEADERBOARD_BUCKET_SIZE", "1000"))
+
+logger = logging.getLogger(__name__)
+
+METRICS = {
+    "trophies": 1,
+    "max_meters_traveled": 2,
+}
+
+
+# -----------------------------------------------------------------------------
+# Lista ordenada por bloques con acceso por posición.
+# Las claves se guardan en bloques ordenados de ~LEADERBOARD_BUCKET_SIZE
+# elementos, y un árbol de Fenwick sobre los tamaños de los bloques permite
+# saber en O(log n) qué clave ocupa la posición i o en qué posición está una clave.
+# -----------------------------------------------------------------------------
+class OrderedIndex:
+    def __init__(self, bucket_size=LEADERBOARD_BUCKET_SIZE):
+        self._bucket_size = bucket_size
+        self._buckets = []
+        self._maxes = []
+        self._tree = [0]
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def load(self, keys):
+        keys = sorted(keys)
+        size = self._bucket_size
+        self._buckets = [keys[i:i + size] for i in range(0, len(keys), size)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(keys)
+        self._build_tree()
+
+    def add(self, key):
+        if not self._buckets:
+            self._buckets = [[key]]
+            self._maxes = [key]
+            self._len = 1
+            self._build_tree()
+            return
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._buckets):
+            pos -= 1
+            self._buckets[pos].append(key)
+            self._maxes[pos] = key
+        else:
+            insort(self._buckets[pos], key)
+        self._len += 1
+        bucket = self._buckets[pos]
+        if len(bucket) > 2 * self._bucket_size:
+            half = len(bucket) // 2
+            self._buckets[pos:pos + 1] = [bucket[:half], bucket[half:]]
+            self._maxes[pos:pos + 1] = [bucket[half - 1], bucket[-1]]
+            self._build_tree()
+        else:
+            self._tree_add(pos, 1)
+
+    def remove(self, key):
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._buckets):
+            raise KeyError(key)
+        bucket = self._buckets[pos]
+        i = bisect_left(bucket, key)
+        if i == len(bucket) or bucket[i] != key:
+            raise KeyError(key)
+        del bucket[i]
+        self._len -= 1
+        if bucket:
+            self._maxes[pos] = bucket[-1]
+            self._tree_add(pos, -1)
+        else:
+            del self._buckets[pos]
+            del self._maxes[pos]
+            self._build_tree()
+
+    # Número de claves estrictamente menores que key (su posición, empezando en 0).
+    def rank(self, key):
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._buckets):
+            return self._len
+        return self._prefix(pos) + bisect_left(self._buckets[pos], key)
+
+    # Claves entre las posiciones start (incluida) y stop (excluida).
+    def slice(self, start, stop):
+        start = max(start, 0)
+        stop = min(stop, self._len)
+        if start >= stop:
+            return []
+        pos, offset = self._locate(start)
+        result = []
+        remaining = stop - start
+        while remaining > 0:
+            chunk = self._buckets[pos][offset:offset + remaining]
+            result.extend(chunk)
+            remaining -= len(chunk)
+            pos += 1
+            offset = 0
+        return result
+
+    def _build_tree(self):
+        n = len(self._buckets)
+        tree = [0] * (n + 1)
+        for i, bucket in enumerate(self._buckets, 1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, pos, delta):
+        i = pos + 1
+        tree = self._tree
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, pos):
+        total = 0
+        i = pos
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, index):
+        tree = self._tree
+        n = len(tree) - 1
+        pos = 0
+        step = 1 << (n.bit_length() - 1) if n else 0
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= index:
+                pos = nxt
+                index -= tree[nxt]
+            step >>= 1
+        return pos, index
+
+
+# -----------------------------------------------------------------------------
+# Clasificación de un worker: filas de user_competitive indexadas por métrica.
+# Cada fila es (id_user, trophies, max_meters_traveled, version).
+# El orden es el de los rankings: valor descendente y, a igualdad, id_user.
+# -----------------------------------------------------------------------------
+class Leaderboard:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._indexes = {metric: OrderedIndex() for metric in METRICS}
+        self.loaded_at = None
+
+    @staticmethod
+    def _key(metric, row):
+        return (-(row[METRICS[metric]] or 0), row[0])
+
+    def load(self, rows):
+        rows = {row[0]: tuple(row) for row in rows}
+        indexes = {metric: OrderedIndex() for metric in METRICS}
+        for metric, index in indexes.items():
+            index.load(self._key(metric, row) for row in rows.values())
+        with self._lock:
+            self._rows = rows
+            self._indexes = indexes
+            self.loaded_at = time.time()
+
+    # -------------------------------------------------------------------------
+    # Inserta o actualiza una fila (id_user, trophies, max_meters_traveled,
+    # version). Si la clasificación ya tiene una versión igual o más nueva de la
+    # fila, el cambio se ignora.
+    # -------------------------------------------------------------------------
+    def upsert(self, row):
+        row = tuple(row)
+        with self._lock:
+            old = self._rows.get(row[0])
+            if old is not None and old[3] >= row[3]:
+                return
+            for metric, index in self._indexes.items():
+                if old is not None:
+                    index.remove(self._key(metric, old))
+                index.add(self._key(metric, row))
+            self._rows[row[0]] = row
+
+    def top(self, metric, limit, offset=0):
+        with self._lock:
+            keys = self._indexes[metric].slice(offset, offset + limit)
+            return [self._rows[key[1]] for key in keys]
+
+    # -------------------------------------------------------------------------
+    # Posición (empezando en 1) de un usuario en el ranking de una métrica, junto
+    # con los `neighbours` jugadores de encima y de debajo.
+    # Devuelve None si el usuario no está en la clasificación.
+    # -------------------------------------------------------------------------
+    def rank(self, metric, id_user, neighbours=0):
+        with self._lock:
+            row = self._rows.get(id_user)
+            if row is None:
+                return None
+            index = self._indexes[metric]
+            pos = index.rank(self._key(metric, row))
+            start = max(0, pos - neighbours)
+            keys = index.slice(start, pos + neighbours + 1)
+            return {
+                'rank': pos + 1,
+                'total': len(index),
+                'window': [(start + i + 1, self._rows[key[1]]) for i, key in enumerate(keys)]
+            }
+
+    # -------------------------------------------------------------------------
+    # Paginación por clave (keyset): devuelve hasta `limit` filas situadas
+    # estrictamente después de `after` = (valor, id_user) en el ranking, o desde
+    # el principio si after es None. Cada fila va acompañada de su posición.
+    # -------------------------------------------------------------------------
+    def page_after(self, metric, after, limit):
+        with self._lock:
+            index = self._indexes[metric]
+            start = 0
+            if after is not None:
+                key = (-(after[0] or 0), after[1])
+                start = index.rank(key)
+                if index.slice(start, start + 1) == [key]:
+                    start += 1
+            keys = index.slice(start, start + limit)
+            return [(start + i + 1, self._rows[key[1]]) for i, key in enumerate(keys)]
+
+    def __len__(self):
+        return len(self._rows)
+
+
+def row_to_dict(row):
+    return {'id_user': row[0], 'trophies': row[1], 'max_meters_traveled': row[2]}
+
+
+# -----------------------------------------------------------------------------
+# Envuelve un INSERT/UPDATE sobre user_competitive para que devuelva las filas
+# modificadas y publique cada cambio en LEADERBOARD_CHANNEL, todo en una única
+# sentencia (un solo viaje a la base de datos).
+# Ejemplo:
+#     cur.execute(notify_changes('UPDATE user_competitive SET trophies = %s WHERE id_user = %s'), (10, 'u1'))
+#     rows = cur.fetchall()
+#     conn.commit()
+#     apply_changes(rows)
+# -----------------------------------------------------------------------------
+def notify_changes(sql):
+    return f"""
+        WITH changed AS ({sql} RETURNING id_user, trophies, max_meters_traveled, version)
+        SELECT id_user, trophies, max_meters_traveled, version,
+               pg_notify('{LEADERBOARD_CHANNEL}', json_build_array(id_user, trophies, max_meters_traveled, version)::text)
+        FROM changed"""
+
+
+# Aplica en la clasificación del worker las filas devueltas por notify_changes
+# (sin esperar a la notificación, para que el propio worker vea su escritura).
+def apply_changes(rows):
+    board = _board
+    if board is not None and _board_pid == os.getpid():
+        for row in rows:
+            board.upsert(row[:4])
+
+
+# -----------------------------------------------------------------------------
+# Clasificación del proceso actual.
+# Se carga en la primera llamada (o al arrancar el worker, ver gunicorn.conf.py)
+# junto con el hilo que escucha los cambios del resto de workers.
+# -----------------------------------------------------------------------------
+_board = None
+_board_pid = None
+_board_lock = threading.Lock()
+
+
+def _load_snapshot(board):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT id_user, trophies, max_meters_traveled, version FROM user_competitive')
+        board.load(cur.fetchall())
+        cur.close()
+
+
+def _listen():
+    conn = connect()
+    conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    cur.execute(f"LISTEN {LEADERBOARD_CHANNEL}")
+    cur.close()
+    return conn
+
+
+def _consume(board, conn):
+    backoff = 1
+    while True:
+        try:
+            if conn is None:
+                conn = _listen()
+                _load_snapshot(board)
+                backoff = 1
+            if select.select([conn], [], [], 60) != ([], [], []):
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    board.upsert(json.loads(notify.payload))
+        except Exception:
+            logger.exception("Error en la escucha de la clasificación; se reconecta")
+            try:
+                if conn is not None:
+                    conn.close()
+            except psycopg2.Error:
+                pass
+            conn = None
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+
+def get_leaderboard():
+    global _board, _board_pid
+    pid = os.getpid()
+    if _board is None or _board_pid != pid:
+        with _board_lock:
+            if _board is None or _board_pid != pid:
+                board = Leaderboard()
+                # Primero LISTEN y después la carga, para no perder cambios intermedios
+                conn = _listen()
+                try:
+                    _load_snapshot(board)
+                except Exception:
+                    conn.close()
+                    raise
+                threading.Thread(target=_consume, args=(board, conn), name="leaderboard-listener", daemon=True).start()
+                _board, _board_pid = board, pid
+    return _board
@@ -1,5 +1,10 @@
 from flask import Blueprint, jsonify, request
-from utils import get_connection
+from utils import get_connection, stream_json_array
+from prepared import execute_prepared
+import base64
+import json
+from user_competitive.leaderboard import METRICS, apply_changes, get_leaderboard, notify_changes, row_to_dict
+from user_competitive.write_behind import COMPETITIVE_WRITE_BEHIND, is_pg_integer, write_buffer
 
 
 user_competitive_bp = Blueprint('user_competitive', __name__)
@@ -13,12 +18,11 @@ user_competitive_bp = Blueprint('user_competitive', __name__)
 # -----------------------------------------------------------------------------
 @user_competitive_bp.route('/user_competitive/<id_user>', methods=['GET'])
 def get_user_competitive(id_user):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM user_competitive WHERE id_user = %s', (id_user,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        execute_prepared(cur, 'user_competitive_by_user', (id_user,))
+        row = cur.fetchone()
+        cur.close()
     if row:
         return jsonify({
             'id_user': row[0],
@@ -44,19 +48,19 @@ def create_user_competitive():
     max_meters_traveled = data.get('max_meters_traveled', 0)
     if not id_user:
         return jsonify({'error': 'id_user es requerido'}), 400
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute('INSERT INTO user_competitive (id_user, trophies, max_meters_traveled) VALUES (%s, %s, %s)',
-                    (id_user, trophies, max_meters_traveled))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(notify_changes('INSERT INTO user_competitive (id_user, trophies, max_meters_traveled) VALUES (%s, %s, %s)'),
+                        (id_user, trophies, max_meters_traveled))
+            rows = cur.fetchall()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            cur.close()
+            return jsonify({'error': str(e)}), 500
         cur.close()
-        conn.close()
-        return jsonify({'error': str(e)}), 500
-    cur.close()
-    conn.close()
+    apply_changes(rows)
     return jsonify({'message': 'Registro creado'}), 201
 
 # -----------------------------------------------------------------------------
@@ -74,39 +78,33 @@ def update_user_competitive(id_user):
     max_meters_traveled = data.get('max_meters_traveled')
     if trophies is None and max_meters_traveled is None:
         return jsonify({'error': 'Nada que actualizar'}), 400
-    conn = get_connection()
-    cur = conn.cursor()
-    updates = []
-    params = []
-    if trophies is not None:
-        updates.append('trophies = %s')
-        params.append(trophies)
-    if max_meters_traveled is not None:
-        updates.append('max_meters_traveled = %s')
-        params.append(max_meters_traveled)
-    params.append(id_user)
-    cur.execute(f'UPDATE user_competitive SET {", ".join(updates)} WHERE id_user = %s', tuple(params))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        updates = []
+        params = []
+        if trophies is not None:
+            updates.append('trophies = %s')
+            params.append(trophies)
+        if max_meters_traveled is not None:
+            updates.append('max_meters_traveled = %s')
+            params.append(max_meters_traveled)
+        params.append(id_user)
+        cur.execute(notify_changes(f'UPDATE user_competitive SET {", ".join(updates)} WHERE id_user = %s'), tuple(params))
+        rows = cur.fetchall()
+        conn.commit()
+        cur.close()
+    apply_changes(rows)
     return jsonify({'message': 'Registro actualizado'}), 200
 
 # -----------------------------------------------------------------------------
 # GET /user_competitive
 # Lista todos los registros competitivos.
+# La respuesta se envía por trozos (ver stream_json_array en utils.py).
 # Respuesta: Array de objetos con los datos competitivos de cada usuario.
 # -----------------------------------------------------------------------------
 @user_competitive_bp.route('/user_competitive', methods=['GET'])
 def list_user_competitive():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM user_competitive')
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([
-        {'id_user': row[0], 'trophies': row[1], 'max_meters_traveled': row[2]} for row in rows
-    ])
+    return stream_json_array('SELECT id_user, trophies, max_meters_traveled FROM user_competitive', make_item=row_to_dict)
 
 # -----------------------------------------------------------------------------
 # GET /user_competitive/top-meters
@@ -115,26 +113,20 @@ def list_user_competitive():
 # -----------------------------------------------------------------------------
 @user_competitive_bp.route('/user_competitive/top-meters', methods=['GET'])
 def get_top_meters_users():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        'SELECT id_user, trophies, max_meters_traveled FROM user_competitive ORDER BY max_meters_traveled DESC LIMIT 5'
-    )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([
-        {'id_user': row[0], 'trophies': row[1], 'max_meters_traveled': row[2]} for row in rows
-    ])
+    return jsonify([row_to_dict(row) for row in get_leaderboard().top('max_meters_traveled', 5)])
 
 
 # -----------------------------------------------------------------------------
 # PUT /user_competitive/set-meters/<id_user>
 # Cambia los metros recorridos de un usuario.
 # Espera un JSON con 'max_meters_traveled'.
+# Con COMPETITIVE_WRITE_BEHIND=1 el cambio se escribe en diferido (ver
+# user_competitive/write_behind.py): se guarda el máximo de los metros recibidos
+# para el usuario y se vuelca en segundos.
 # Respuestas:
 #     200: { 'message': 'Metros actualizados' }
 #     400: { 'error': 'max_meters_traveled es requerido' }
+#     400: { 'error': 'max_meters_traveled debe ser un entero' }
 # -----------------------------------------------------------------------------
 @user_competitive_bp.route('/user_competitive/set-meters/<id_user>', methods=['PUT'])
 def set_meters(id_user):
@@ -142,21 +134,31 @@ def set_meters(id_user):
     meters = data.get('max_meters_traveled')
     if meters is None:
         return jsonify({'error': 'max_meters_traveled es requerido'}), 400
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('UPDATE user_competitive SET max_meters_traveled = %s WHERE id_user = %s', (meters, id_user))
-    conn.commit()
-    cur.close()
-    conn.close()
+    if not is_pg_integer(meters):
+        return jsonify({'error': 'max_meters_traveled debe ser un entero'}), 400
+    if COMPETITIVE_WRITE_BEHIND:
+        write_buffer.set_meters(id_user, meters)
+        return jsonify({'message': 'Metros actualizados'}), 200
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(notify_changes('UPDATE user_competitive SET max_meters_traveled = %s WHERE id_user = %s'), (meters, id_user))
+        rows = cur.fetchall()
+        conn.commit()
+        cur.close()
+    apply_changes(rows)
     return jsonify({'message': 'Metros actualizados'}), 200
 
 # -----------------------------------------------------------------------------
 # PUT /user_competitive/set-trophies/<id_user>
 # Cambia las copas de un usuario.
 # Espera un JSON con 'trophies'.
+# Con COMPETITIVE_WRITE_BEHIND=1 el cambio se escribe en diferido (ver
+# user_competitive/write_behind.py): se guarda el último valor recibido para el
+# usuario y se vuelca en segundos.
 # Respuestas:
 #     200: { 'message': 'Copas actualizadas' }
 #     400: { 'error': 'trophies es requerido' }
+#     400: { 'error': 'trophies debe ser un entero' }
 # -----------------------------------------------------------------------------
 @user_competitive_bp.route('/user_competitive/set-trophies/<id_user>', methods=['PUT'])
 def set_trophies(id_user):
@@ -164,12 +166,18 @@ def set_trophies(id_user):
     trophies = data.get('trophies')
     if trophies is None:
         return jsonify({'error': 'trophies es requerido'}), 400
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('UPDATE user_competitive SET trophies = %s WHERE id_user = %s', (trophies, id_user))
-    conn.commit()
-    cur.close()
-    conn.close()
+    if not is_pg_integer(trophies):
+        return jsonify({'error': 'trophies debe ser un entero'}), 400
+    if COMPETITIVE_WRITE_BEHIND:
+        write_buffer.set_trophies(id_user, trophies)
+        return jsonify({'message': 'Copas actualizadas'}), 200
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(notify_changes('UPDATE user_competitive SET trophies = %s WHERE id_user = %s'), (trophies, id_user))
+        rows = cur.fetchall()
+        conn.commit()
+        cur.close()
+    apply_changes(rows)
     return jsonify({'message': 'Copas actualizadas'}), 200
 
 # -----------------------------------------------------------------------------
@@ -179,17 +187,7 @@ def set_trophies(id_user):
 # -----------------------------------------------------------------------------
 @user_competitive_bp.route('/user_competitive/top-trophies', methods=['GET'])
 def get_top_trophies_users():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        'SELECT id_user, trophies, max_meters_traveled FROM user_competitive ORDER BY trophies DESC LIMIT 5'
-    )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([
-        {'id_user': row[0], 'trophies': row[1], 'max_meters_traveled': row[2]} for row in rows
-    ])
+    return jsonify([row_to_dict(row) for row in get_leaderboard().top('trophies', 5)])
 
 # -----------------------------------------------------------------------------
 # GET /user_competitive/top10-trophies
@@ -198,17 +196,7 @@ def get_top_trophies_users():
 # -----------------------------------------------------------------------------
 @user_competitive_bp.route('/user_competitive/top10-trophies', methods=['GET'])
 def get_top10_trophies_users():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        'SELECT id_user, trophies, max_meters_traveled FROM user_competitive ORDER BY trophies DESC LIMIT 10'
-    )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([
-        {'id_user': row[0], 'trophies': row[1], 'max_meters_traveled': row[2]} for row in rows
-    ])
+    return jsonify([row_to_dict(row) for row in get_leaderboard().top('trophies', 10)])
 
 # -----------------------------------------------------------------------------
 # GET /user_competitive/top10-meters
@@ -217,14 +205,124 @@ def get_top10_trophies_users():
 # -----------------------------------------------------------------------------
 @user_competitive_bp.route('/user_competitive/top10-meters', methods=['GET'])
 def get_top10_meters_users():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        'SELECT id_user, trophies, max_meters_traveled FROM user_competitive ORDER BY max_meters_traveled DESC LIMIT 10'
-    )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([
-        {'id_user': row[0], 'trophies': row[1], 'max_meters_traveled': row[2]} for row in rows
-    ])
\ No newline at end of file
+    return jsonify([row_to_dict(row) for row in get_leaderboard().top('max_meters_traveled', 10)])
+
+# -----------------------------------------------------------------------------
+# Parámetros de los rankings.
+# Las métricas se nombran como las columnas ('trophies', 'max_meters_traveled');
+# 'meters' se acepta como alias de 'max_meters_traveled'.
+# -----------------------------------------------------------------------------
+LEADERBOARD_MAX_LIMIT = 100
+RANK_MAX_NEIGHBOURS = 10
+
+
+def parse_metric(metric):
+    if metric == 'meters':
+        metric = 'max_meters_traveled'
+    return metric if metric in METRICS else None
+
+
+def encode_cursor(metric, row):
+    raw = json.dumps([row[METRICS[metric]], row[0]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+# Lanza ValueError si el cursor no es uno de los que genera encode_cursor:
+# [valor de la métrica (entero o null), id_user].
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    data = json.loads(raw)
+    if not isinstance(data, list) or len(data) != 2:
+        raise ValueError('Cursor no válido')
+    value, id_user = data
+    if (value is not None and (not isinstance(value, int) or isinstance(value, bool))) or not isinstance(id_user, str):
+        raise ValueError('Cursor no válido')
+    return value, id_user
+
+# -----------------------------------------------------------------------------
+# GET /user_competitive/top/<metric>?limit=<n>&offset=<m>
+# Devuelve una ventana del ranking por 'trophies' o 'max_meters_traveled',
+# servida desde la clasificación en memoria.
+# Parámetros opcionales: limit (1..LEADERBOARD_MAX_LIMIT, por defecto 10) y offset (por defecto 0).
+# Respuestas:
+#     200: Array de objetos con los datos de los usuarios.
+#     400: { 'error': 'Métrica no válida' }
+# -----------------------------------------------------------------------------
+@user_competitive_bp.route('/user_competitive/top/<metric>', methods=['GET'])
+def get_top_window(metric):
+    metric = parse_metric(metric)
+    if not metric:
+        return jsonify({'error': 'Métrica no válida'}), 400
+    limit = request.args.get('limit', 10, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    limit = max(1, min(limit, LEADERBOARD_MAX_LIMIT))
+    offset = max(0, offset)
+    return jsonify([row_to_dict(row) for row in get_leaderboard().top(metric, limit, offset)])
+
+# -----------------------------------------------------------------------------
+# GET /user_competitive/leaderboard/<metric>?limit=<n>&after=<cursor>
+# Ranking paginado por clave: cada página continúa justo después de la última
+# fila de la anterior, aunque entre medias cambien posiciones, y su coste no
+# depende de lo profunda que sea la página.
+# Parámetros opcionales: limit (1..LEADERBOARD_MAX_LIMIT, por defecto 50) y
+# after (el 'next_cursor' de la página anterior).
+# Respuestas:
+#     200: { 'items': [{ 'rank', 'id_user', 'trophies', 'max_meters_traveled' }, ...],
+#            'next_cursor': <str> o None si no hay más páginas }
+#     400: { 'error': 'Métrica no válida' } o { 'error': 'Cursor no válido' }
+# -----------------------------------------------------------------------------
+@user_competitive_bp.route('/user_competitive/leaderboard/<metric>', methods=['GET'])
+def get_leaderboard_page(metric):
+    metric = parse_metric(metric)
+    if not metric:
+        return jsonify({'error': 'Métrica no válida'}), 400
+    limit = max(1, min(request.args.get('limit', 50, type=int), LEADERBOARD_MAX_LIMIT))
+    after = request.args.get('after')
+    if after:
+        try:
+            after = decode_cursor(after)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Cursor no válido'}), 400
+    page = get_leaderboard().page_after(metric, after or None, limit)
+    return jsonify({
+        'items': [{'rank': rank, **row_to_dict(row)} for rank, row in page],
+        'next_cursor': encode_cursor(metric, page[-1][1]) if len(page) == limit else None
+    })
+
+# -----------------------------------------------------------------------------
+# GET /user_competitive/<id_user>/rank?neighbours=<n>
+# Devuelve la posición de un usuario en el ranking de copas y en el de metros,
+# con los n jugadores de encima y de debajo (0..RANK_MAX_NEIGHBOURS, por defecto 2).
+# Respuestas:
+#     200: { 'id_user': ...,
+#            'trophies': { 'rank', 'total', 'neighbours': [{ 'rank', 'id_user', 'trophies', 'max_meters_traveled' }, ...] },
+#            'max_meters_traveled': { ... } }
+#     404: { 'error': 'Usuario no encontrado' }
+# -----------------------------------------------------------------------------
+@user_competitive_bp.route('/user_competitive/<id_user>/rank', methods=['GET'])
+def get_user_rank(id_user):
+    neighbours = max(0, min(request.args.get('neighbours', 2, type=int), RANK_MAX_NEIGHBOURS))
+    board = get_leaderboard()
+    result = {'id_user': id_user}
+    for metric in METRICS:
+        ranking = board.rank(metric, id_user, neighbours)
+        if ranking is None:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+        result[metric] = {
+            'rank': ranking['rank'],
+            'total': ranking['total'],
+            'neighbours': [{'rank': rank, **row_to_dict(row)} for rank, row in ranking['window']]
+        }
+    return jsonify(result)
+
+# -----------------------------------------------------------------------------
+# GET /user_competitive/write-buffer-stats
+# Devuelve el estado del búfer de escritura diferida (COMPETITIVE_WRITE_BEHIND)
+# del worker que atiende la petición.
+# Respuesta:
+#     200: { 'pid', 'enabled', 'pending', 'updates', 'coalesced', 'flushes',
+#            'rows_flushed', 'flush_errors', 'rows_dropped', 'inline_flushes', ... }
+# -----------------------------------------------------------------------------
+@user_competitive_bp.route('/user_competitive/write-buffer-stats', methods=['GET'])
+def get_write_buffer_stats():
+    return jsonify(write_buffer.stats()), 200
@@ -0,0 +1,247 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import closing
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from db_pool import connect
+from user_competitive.leaderboard import apply_changes, notify_changes
+from utils import get_connection
+
+# -----------------------------------------------------------------------------
+# ESCRITURA DIFERIDA DE user_competitive (opcional, COMPETITIVE_WRITE_BEHIND=1)
+# set-meters y set-trophies dejan el valor en un búfer en memoria del worker y
+# responden al momento. Por cada usuario se guarda un único cambio pendiente:
+#   - metros: el máximo de los valores recibidos,
+#   - copas: el último valor recibido.
+# Un hilo en segundo plano vuelca el búfer con un único UPDATE multi-fila
+# (que además publica los cambios para la clasificación, ver notify_changes):
+#   - cada COMPETITIVE_FLUSH_INTERVAL segundos,
+#   - o antes, en cuanto haya COMPETITIVE_FLUSH_SIZE usuarios pendientes.
+# Límite de durabilidad: si el worker muere sin poder volcar se pierden como
+# mucho los cambios de los últimos COMPETITIVE_FLUSH_INTERVAL segundos, y nunca
+# más de COMPETITIVE_MAX_PENDING usuarios: al llegar a ese tamaño la propia
+# petición vuelca el búfer antes de responder. Al apagar el worker se vuelca lo
+# que quede con una conexión propia, fuera del pool: los handlers de atexit
+# corren en orden inverso al de registro y el pool puede estar ya cerrado.
+# Si un volcado falla (la base de datos no responde...), los cambios vuelven al
+# búfer y se reintentan en el siguiente. Las filas que la base de datos rechaza
+# por sus datos (valores que no son un integer, un id_user con un carácter
+# NUL...) se descartan y se anotan en el log, para no bloquear el resto.
+# -----------------------------------------------------------------------------
+COMPETITIVE_WRITE_BEHIND = os.getenv("COMPETITIVE_WRITE_BEHIND", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
+_FLUSH_SQL = notify_changes("""
+    UPDATE user_competitive uc
+    SET trophies = COALESCE(v.new_trophies, uc.trophies),
+        max_meters_traveled = COALESCE(v.new_meters, uc.max_meters_traveled)
+    FROM (VALUES %s) AS v(pending_id, new_trophies, new_meters)
+    WHERE uc.id_user = v.pending_id""")
+_FLUSH_TEMPLATE = "(%s, %s::integer, %s::integer)"
+
+# Rango de la columna integer de PostgreSQL
+PG_INTEGER_MIN, PG_INTEGER_MAX = -2**31, 2**31 - 1
+
+
+def is_pg_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool) and PG_INTEGER_MIN <= value <= PG_INTEGER_MAX
+
+
+class CompetitiveWriteBuffer:
+    def __init__(self, flush_interval=0.5, flush_size=500, max_pending=10000):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        # id_user -> [trophies, max_meters_traveled] (None = sin cambio)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            "updates": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "rows_flushed": 0,
+            "flush_errors": 0,
+            "rows_dropped": 0,
+            "inline_flushes": 0,
+            "flush_time_total": 0.0,
+            "flush_time_max": 0.0,
+        }
+
+    def set_meters(self, id_user, meters):
+        self._put(id_user, 1, meters)
+
+    def set_trophies(self, id_user, trophies):
+        self._put(id_user, 0, trophies)
+
+    def _put(self, id_user, field, value):
+        if not is_pg_integer(value):
+            raise ValueError(f"Valor no válido para user_competitive: {value!r}")
+        self._ensure_worker()
+        with self._lock:
+            self._stats["updates"] += 1
+            entry = self._pending.get(id_user)
+            if entry is None:
+                entry = self._pending[id_user] = [None, None]
+            else:
+                self._stats["coalesced"] += 1
+            if field == 1 and entry[1] is not None:
+                entry[1] = max(entry[1], value)
+            else:
+                entry[field] = value
+            size = len(self._pending)
+        if size >= self.max_pending:
+            with self._lock:
+                self._stats["inline_flushes"] += 1
+            self.flush()
+        elif size >= self.flush_size:
+            self._wakeup.set()
+
+    # -------------------------------------------------------------------------
+    # Vuelca todos los cambios pendientes. Devuelve el número de filas escritas.
+    # `connection` abre la conexión a usar, como context manager (por defecto,
+    # una del pool).
+    # -------------------------------------------------------------------------
+    def flush(self, connection=get_connection):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            start = time.monotonic()
+            try:
+                with connection() as conn:
+                    rows, dropped = self._write(conn, [
+                        (id_user, trophies, meters) for id_user, (trophies, meters) in batch.items()
+                    ])
+            except Exception:
+                self._restore(batch)
+                with self._lock:
+                    self._stats["flush_errors"] += 1
+                logger.exception("No se pudo volcar el búfer de user_competitive", extra={"fields": {"pending": len(batch)}})
+                return 0
+            if dropped:
+                logger.error("Cambios de user_competitive descartados: la base de datos rechaza sus datos",
+                             extra={"fields": {"id_users": dropped}})
+            apply_changes(rows)
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["rows_flushed"] += len(rows)
+                self._stats["rows_dropped"] += len(dropped)
+                self._stats["flush_time_total"] += elapsed
+                self._stats["flush_time_max"] = max(self._stats["flush_time_max"], elapsed)
+            return len(rows)
+
+    # -------------------------------------------------------------------------
+    # Escribe el lote con un único UPDATE. Si la base de datos rechaza los datos
+    # de alguna fila, lo repite fila a fila y descarta las que fallan.
+    # Devuelve (filas escritas, id_user descartados).
+    # -------------------------------------------------------------------------
+    def _write(self, conn, values):
+        cur = conn.cursor()
+        try:
+            rows = execute_values(cur, _FLUSH_SQL, values, template=_FLUSH_TEMPLATE, page_size=len(values), fetch=True)
+            conn.commit()
+            cur.close()
+            return rows, []
+        except (ValueError, psycopg2.DataError):
+            conn.rollback()
+        rows, dropped = [], []
+        for value in values:
+            try:
+                rows.extend(execute_values(cur, _FLUSH_SQL, [value], template=_FLUSH_TEMPLATE, fetch=True))
+                conn.commit()
+            except (ValueError, psycopg2.DataError):
+                conn.rollback()
+                dropped.append(value[0])
+        cur.close()
+        return rows, dropped
+
+    # Devuelve al búfer un lote que no se pudo escribir, sin pisar cambios más nuevos.
+    def _restore(self, batch):
+        with self._lock:
+            for id_user, (trophies, meters) in batch.items():
+                entry = self._pending.get(id_user)
+                if entry is None:
+                    self._pending[id_user] = [trophies, meters]
+                    continue
+                if entry[0] is None:
+                    entry[0] = trophies
+                if meters is not None:
+                    entry[1] = meters if entry[1] is None else max(entry[1], meters)
+
+    # -------------------------------------------------------------------------
+    # Detiene el hilo de volcado y escribe lo que quede pendiente.
+    # -------------------------------------------------------------------------
+    def stop(self, timeout=10.0):
+        if self._pid != os.getpid():
+            return
+        self._stopping = True
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        self.flush(connection=lambda: closing(connect()))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            pending = len(self._pending)
+        return {
+            "pid": os.getpid(),
+            "enabled": COMPETITIVE_WRITE_BEHIND,
+            "pending": pending,
+            "updates": stats["updates"],
+            "coalesced": stats["coalesced"],
+            "flushes": stats["flushes"],
+            "rows_flushed": stats["rows_flushed"],
+            "flush_errors": stats["flush_errors"],
+            "rows_dropped": stats["rows_dropped"],
+            "inline_flushes": stats["inline_flushes"],
+            "flush_time_avg_ms": round(stats["flush_time_total"] * 1000 / stats["flushes"], 3) if stats["flushes"] else 0.0,
+            "flush_time_max_ms": round(stats["flush_time_max"] * 1000, 3),
+        }
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # Proceso hijo tras un fork: lo pendiente es del padre, que lo vuelca él
+                self._pending = {}
+                self._flush_lock = threading.Lock()
+                self._wakeup = threading.Event()
+                self._stopping = False
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name="competitive-write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            self.flush()
+
+
+write_buffer = CompetitiveWriteBuffer(
+    flush_interval=float(os.getenv("COMPETITIVE_FLUSH_INTERVAL", "0.5")),
+    flush_size=int(os.getenv("COMPETITIVE_FLUSH_SIZE", "500")),
+    max_pending=int(os.getenv("COMPETITIVE_MAX_PENDING", "10000"))
+)
+atexit.register(write_buffer.stop, float(os.getenv("COMPETITIVE_SHUTDOWN_TIMEOUT", "10")))
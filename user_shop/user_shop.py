@@ -1,5 +1,7 @@
 from flask import Blueprint, jsonify, request
-from utils import get_connection
+from utils import get_connection, stream_json_array
+from prepared import execute_prepared
+from current_shop.current_shop import forget_user_sync
 
 userShop_bp = Blueprint('user_shop', __name__)
 
@@ -11,11 +13,10 @@ userShop_bp = Blueprint('user_shop', __name__)
 # -----------------------------------------------------------------------------
 @userShop_bp.route('/user_shop/<id_user>', methods=['GET'])
 def get_user_shops(id_user):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id_shop FROM user_shop WHERE id_user = %s", (id_user,))
-    rows = cursor.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        execute_prepared(cursor, 'user_shop_by_user', (id_user,))
+        rows = cursor.fetchall()
     # Devuelve solo el array de id_shop
     return jsonify([row[0] for row in rows])
 
@@ -35,14 +36,13 @@ def update_time_to_spin():
     time_to_spin = data.get('time_to_spin')
     if not (id_user and id_shop and time_to_spin):
         return jsonify({"error": "Missing fields"}), 400
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE user_shop SET time_to_spin = %s WHERE id_user = %s AND id_shop = %s",
-        (time_to_spin, id_user, id_shop)
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE user_shop SET time_to_spin = %s WHERE id_user = %s AND id_shop = %s",
+            (time_to_spin, id_user, id_shop)
+        )
+        conn.commit()
     return jsonify({"message": "Updated"}), 200
 
 # -----------------------------------------------------------------------------
@@ -61,14 +61,14 @@ def create_user_shop():
     time_to_spin = data.get('time_to_spin')
     if not (id_user and id_shop and time_to_spin):
         return jsonify({"error": "Missing fields"}), 400
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO user_shop (id_user, id_shop, time_to_spin) VALUES (%s, %s, %s)",
-        (id_user, id_shop, time_to_spin)
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO user_shop (id_user, id_shop, time_to_spin) VALUES (%s, %s, %s)",
+            (id_user, id_shop, time_to_spin)
+        )
+        conn.commit()
+    forget_user_sync(id_user)
     return jsonify({"message": "Created"}), 201
 
 # -----------------------------------------------------------------------------
@@ -86,28 +86,22 @@ def delete_user_shop():
     id_shop = data.get('id_shop')
     if not (id_user and id_shop):
         return jsonify({"error": "Missing fields"}), 400
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "DELETE FROM user_shop WHERE id_user = %s AND id_shop = %s",
-        (id_user, id_shop)
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM user_shop WHERE id_user = %s AND id_shop = %s",
+            (id_user, id_shop)
+        )
+        conn.commit()
+    forget_user_sync(id_user)
     return jsonify({"message": "Deleted"}), 200
 
 # -----------------------------------------------------------------------------
 # GET /user_shop_time_to_spin
 # Lista todos los elementos de user_shop.
+# La respuesta se envía por trozos (ver stream_json_array en utils.py).
 # Respuesta: Array de objetos con 'id_user', 'id_shop' y 'time_to_spin'.
 # -----------------------------------------------------------------------------
 @userShop_bp.route('/user_shop_time_to_spin', methods=['GET'])
 def list_user_shops():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id_user, id_shop, time_to_spin FROM user_shop")
-    rows = cursor.fetchall()
-    conn.close()
-    return jsonify([
-        {"id_user": row[0], "id_shop": row[1], "time_to_spin": row[2]} for row in rows
-    ])
+    return stream_json_array("SELECT id_user, id_shop, time_to_spin FROM user_shop")
@@ -1,26 +1,56 @@
 from flask import Blueprint, jsonify, request
-from utils import get_connection
+from datetime import datetime
+from utils import get_connection, stream_json_array
+from prepared import execute_prepared
+from current_shop.current_shop import get_current_shop_version, is_user_synced, mark_user_synced
+from user_competitive.leaderboard import apply_changes, notify_changes
+import logging
 
 
 users_bp = Blueprint('users', __name__)
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# MÉTODO AUXILIAR
+# Sincroniza las ofertas (user_shop) de un usuario con la tienda actual usando
+# siempre dos sentencias, sin importar cuántas ofertas hayan rotado:
+#   1. Añade las ofertas de current_shop que el usuario no tenga.
+#   2. Elimina las ofertas que el usuario tenga y no estén en current_shop.
+# Si el usuario ya se sincronizó con la versión actual de current_shop no se
+# ejecuta nada. No hace commit: quien llama confirma la transacción y después
+# marca al usuario con mark_user_synced(id_user, <versión devuelta>).
+# Parámetros:
+#   cur: Cursor de la conexión en curso.
+#   id_user (str): Id del usuario.
+# Devuelve la versión sincronizada, o None si ya estaba sincronizado.
+# -----------------------------------------------------------------------------
+def sync_user_offers(cur, id_user):
+    version = get_current_shop_version(cur)
+    if is_user_synced(id_user, version):
+        return None
+    cur.execute("""
+        INSERT INTO user_shop (id_user, id_shop, time_to_spin)
+        SELECT %s, cs.id_shop, NOW() - INTERVAL '24 hours'
+        FROM current_shop cs
+        WHERE NOT EXISTS (
+            SELECT 1 FROM user_shop us WHERE us.id_user = %s AND us.id_shop = cs.id_shop
+        )""", (id_user, id_user))
+    cur.execute("""
+        DELETE FROM user_shop us
+        WHERE us.id_user = %s
+          AND NOT EXISTS (SELECT 1 FROM current_shop cs WHERE cs.id_shop = us.id_shop)""", (id_user,))
+    return version
 
 # -----------------------------------------------------------------------------
 # GET /get-users
 # Devuelve todos los usuarios registrados.
+# La respuesta se envía por trozos (ver stream_json_array en utils.py).
 # Respuesta: Array de objetos usuario.
 # -----------------------------------------------------------------------------
 @users_bp.route('/get-users', methods=['GET'])
 def get_users():
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM user")
-        rows = cur.fetchall()
-        column_names = [desc[0] for desc in cur.description]
-        users = [dict(zip(column_names, row)) for row in rows]
-        cur.close()
-        conn.close()
-        return jsonify(users)
+        return stream_json_array('SELECT * FROM "user"')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -34,48 +64,95 @@ def get_users():
 @users_bp.route('/get-user-by-email/<email>', methods=['GET'])
 def get_user_by_email(email):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        # 1. Obtener el usuario por email
-        cur.execute('SELECT * FROM "user" WHERE email = %s', (email,))
-        row = cur.fetchone()
-        print(f"Consulta por email: {email}, resultado: {row}")
-        if row:
-            column_names = [desc[0] for desc in cur.description]
-            user = dict(zip(column_names, row))
-            print(f"Usuario encontrado: {user}")
-            id_user = user['id']
-            # 2. Obtener todos los id_shop de current_shop
-            cur.execute('SELECT id_shop FROM current_shop')
-            current_shops = set(r[0] for r in cur.fetchall())
-            # 3. Obtener todas las ofertas (id_shop) que tiene el usuario
-            cur.execute('SELECT id_shop FROM user_shop WHERE id_user = %s', (id_user,))
-            user_shops = set(r[0] for r in cur.fetchall())
-            # 4. Añadir las ofertas de current_shop que el usuario no tenga
-            to_add = current_shops - user_shops
-            for id_shop in to_add:
-                cur.execute(
-                    "INSERT INTO user_shop (id_user, id_shop, time_to_spin) VALUES (%s, %s, NOW() - INTERVAL '24 hours')",
-                    (id_user, id_shop)
-                )
-            # 5. Eliminar las ofertas que el usuario tenga y no estén en current_shop
-            to_remove = user_shops - current_shops
-            for id_shop in to_remove:
-                cur.execute(
-                    "DELETE FROM user_shop WHERE id_user = %s AND id_shop = %s",
-                    (id_user, id_shop)
-                )
-            conn.commit()
-        else:
-            user = {"message": "Usuario no encontrado"}
-            print(f"Usuario no encontrado para email: {email}")
-        cur.close()
-        conn.close()
-        print(f"JSON devuelto: {user}")
+        with get_connection() as conn:
+            cur = conn.cursor()
+            # 1. Obtener el usuario por email
+            execute_prepared(cur, 'user_by_email', (email,))
+            row = cur.fetchone()
+            if row:
+                # La fila entera como un único jsonb (ver HOT_STATEMENTS en prepared.py)
+                user = row[0]
+                id_user = user['id']
+                # 2. Sincronizar sus ofertas con current_shop (si no lo está ya)
+                synced_version = sync_user_offers(cur, id_user)
+                conn.commit()
+                if synced_version:
+                    mark_user_synced(id_user, synced_version)
+            else:
+                user = {"message": "Usuario no encontrado"}
+                logger.debug("Usuario no encontrado", extra={"fields": {"email": email}})
+            cur.close()
         return jsonify(user)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
+        return jsonify({"error": str(e)}), 500
+
+# -----------------------------------------------------------------------------
+# GET /users/<id_user>/bootstrap
+# Todo lo que el cliente necesita al arrancar el juego en una sola respuesta:
+# usuario, desbloqueos, datos competitivos, ofertas del usuario con su
+# time_to_spin y la rotación actual de la tienda.
+# Se construye con una conexión y una única consulta; solo si las ofertas del
+# usuario no estaban sincronizadas con current_shop se sincronizan (ver
+# sync_user_offers) y se vuelven a leer.
+# El usuario se devuelve sin el campo password.
+# Respuestas:
+#     200: { 'user': {...}, 'unlocks': {...} | None, 'competitive': {...} | None,
+#            'offers': [{ 'id_shop', 'time_to_spin' }], 'current_shop': [id_shop] }
+#     404: { "error": "Usuario no encontrado" }
+#     500: { "error": <mensaje de error> }
+# -----------------------------------------------------------------------------
+BOOTSTRAP_OFFERS_SQL = """
+    SELECT COALESCE(json_agg(json_build_object(
+               'id_shop', us.id_shop,
+               'time_to_spin', to_char(us.time_to_spin, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+           ) ORDER BY us.id_shop), '[]')
+    FROM user_shop us WHERE us.id_user = %(id_user)s"""
+
+
+def bootstrap_offers(offers):
+    for offer in offers:
+        if offer['time_to_spin'] is not None:
+            offer['time_to_spin'] = datetime.fromisoformat(offer['time_to_spin'])
+    return offers
+
+
+@users_bp.route('/users/<id_user>/bootstrap', methods=['GET'])
+def get_user_bootstrap(id_user):
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT to_jsonb(u) - 'password',
+                       (SELECT to_jsonb(ul) FROM user_unlocks ul WHERE ul.user_id = u.id),
+                       (SELECT to_jsonb(uc) - 'version' FROM user_competitive uc WHERE uc.id_user = u.id),
+                       ({BOOTSTRAP_OFFERS_SQL}),
+                       (SELECT COALESCE(json_agg(cs.id_shop ORDER BY cs.id_shop), '[]') FROM current_shop cs)
+                FROM "user" u
+                WHERE u.id = %(id_user)s""", {'id_user': id_user})
+            row = cur.fetchone()
+            if row is None:
+                cur.close()
+                return jsonify({"error": "Usuario no encontrado"}), 404
+            user, unlocks, competitive, offers, current_shop = row
+            # Sincronizar sus ofertas con current_shop (si no lo está ya)
+            synced_version = sync_user_offers(cur, id_user)
+            if synced_version:
+                cur.execute(BOOTSTRAP_OFFERS_SQL, {'id_user': id_user})
+                offers = cur.fetchone()[0]
+            conn.commit()
+            if synced_version:
+                mark_user_synced(id_user, synced_version)
+            cur.close()
+        return jsonify({
+            'user': user,
+            'unlocks': unlocks,
+            'competitive': competitive,
+            'offers': bootstrap_offers(offers),
+            'current_shop': current_shop
+        })
+    except Exception as e:
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -93,58 +170,58 @@ def add_user():
         name = data['name']
         if len(name) > 12:
             name = name[:12]
-        conn = get_connection()
-        cur = conn.cursor()
-        # Guardar la contraseña tal cual, sin hashear
-        password = data.get('password', None)
-        cur.execute("""
-            INSERT INTO "user" (
-                id, name, num_voren_money, num_aurum_money,
-                icon_selected, banner_selected, email, skin_selected, password, anim_victory, anim_lose
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            data['id'],
-            name,
-            data.get('num_voren_money', 0),
-            data.get('num_aurum_money', 0),
-            data.get('icon_selected', 'NONE'),
-            data.get('banner_selected', 'NONE'),
-            data['email'],
-            data.get('skin_selected', 'NONE'),
-            password,
-            data.get('anim_victory', 'NONE'),
-            data.get('anim_lose', 'NONE')
-        ))
-
-        # Insertar los valores por defecto en la tabla "user_unlocks" para el nuevo usuario
-        cur.execute("""
-            INSERT INTO user_unlocks (
-            user_id, icon_profile, banner_profile, skins_unlock, anim_victory, anim_lose
-            ) VALUES (%s, %s, %s, %s, %s, %s)
-        """, (
-            data['id'],
-            ["NONE"],
-            ["NONE"], 
-            ["NONE"],
-            ["NONE"],
-            ["NONE"]
-        ))
-
-        # Insertar el usuario en user_competitive con valores 0
-        cur.execute(
-            'INSERT INTO user_competitive (id_user, trophies, max_meters_traveled) VALUES (%s, %s, %s)',
-            (data['id'], 0, 0)
-        )
-
-        conn.commit()
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            # Guardar la contraseña tal cual, sin hashear
+            password = data.get('password', None)
+            cur.execute("""
+                INSERT INTO "user" (
+                    id, name, num_voren_money, num_aurum_money,
+                    icon_selected, banner_selected, email, skin_selected, password, anim_victory, anim_lose
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                data['id'],
+                name,
+                data.get('num_voren_money', 0),
+                data.get('num_aurum_money', 0),
+                data.get('icon_selected', 'NONE'),
+                data.get('banner_selected', 'NONE'),
+                data['email'],
+                data.get('skin_selected', 'NONE'),
+                password,
+                data.get('anim_victory', 'NONE'),
+                data.get('anim_lose', 'NONE')
+            ))
+
+            # Insertar los valores por defecto en la tabla "user_unlocks" para el nuevo usuario
+            cur.execute("""
+                INSERT INTO user_unlocks (
+                user_id, icon_profile, banner_profile, skins_unlock, anim_victory, anim_lose
+                ) VALUES (%s, %s, %s, %s, %s, %s)
+            """, (
+                data['id'],
+                ["NONE"],
+                ["NONE"], 
+                ["NONE"],
+                ["NONE"],
+                ["NONE"]
+            ))
+
+            # Insertar el usuario en user_competitive con valores 0 (y publicarlo en la clasificación)
+            cur.execute(
+                notify_changes('INSERT INTO user_competitive (id_user, trophies, max_meters_traveled) VALUES (%s, %s, %s)'),
+                (data['id'], 0, 0)
+            )
+            competitive_rows = cur.fetchall()
+
+            conn.commit()
+            cur.close()
+        apply_changes(competitive_rows)
         return jsonify({"message": "Usuario y desbloqueos añadidos correctamente"}), 201
 
     except Exception as e:
         # Registrar el error en los logs
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         # Devolver un mensaje de error más detallado
         return jsonify({"error": str(e)}), 500
     
@@ -159,21 +236,18 @@ def add_user():
 @users_bp.route('/get-user/<user_id>', methods=['GET'])
 def get_user_by_id(user_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM "user" WHERE id = %s', (user_id,))
-        row = cur.fetchone()
-        if row:
-            column_names = [desc[0] for desc in cur.description]
-            user = dict(zip(column_names, row))
-        else:
-            user = {"message": "Usuario no encontrado"}
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            execute_prepared(cur, 'user_by_id', (user_id,))
+            row = cur.fetchone()
+            if row:
+                user = row[0]
+            else:
+                user = {"message": "Usuario no encontrado"}
+            cur.close()
         return jsonify(user)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -195,21 +269,66 @@ def update_icon_selected_by_id():
         if not user_id or not icon_selected:
             return jsonify({"error": "ID e icon_selected son requeridos"}), 400
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('UPDATE "user" SET icon_selected = %s WHERE id = %s', (icon_selected, user_id))
-        conn.commit()
-        updated = cur.rowcount
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('UPDATE "user" SET icon_selected = %s WHERE id = %s', (icon_selected, user_id))
+            conn.commit()
+            updated = cur.rowcount
+            cur.close()
 
         if updated:
             return jsonify({"message": "icon_selected actualizado correctamente"}), 200
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
+        return jsonify({"error": str(e)}), 500
+
+# -----------------------------------------------------------------------------
+# PATCH /users/<id_user>/selection
+# Actualiza de una vez cualquier subconjunto de los cosméticos seleccionados
+# del usuario (icono, banner, skin y animaciones) con un único UPDATE.
+# Espera un JSON con uno o más de los campos de SELECTION_FIELDS; el resto de
+# claves se ignoran.
+# Respuestas:
+#     200: { <campo>: <valor>, ... } con la selección completa tras actualizar
+#     400: { "error": "Se requiere al menos un campo de selección" }
+#     400: { "error": "<campo> no puede estar vacío" }
+#     404: { "error": "Usuario no encontrado" }
+#     500: { "error": <mensaje de error> }
+# -----------------------------------------------------------------------------
+SELECTION_FIELDS = ('icon_selected', 'banner_selected', 'skin_selected', 'anim_victory', 'anim_lose')
+
+
+@users_bp.route('/users/<id_user>/selection', methods=['PATCH'])
+def update_user_selection(id_user):
+    try:
+        data = request.get_json(silent=True) or {}
+        changes = {field: data[field] for field in SELECTION_FIELDS if field in data}
+        if not changes:
+            return jsonify({"error": "Se requiere al menos un campo de selección"}), 400
+        for field, value in changes.items():
+            if not value or not isinstance(value, str):
+                return jsonify({"error": f"{field} no puede estar vacío"}), 400
+
+        # Los nombres de columna salen de SELECTION_FIELDS, nunca del cliente
+        assignments = ", ".join(f"{field} = %s" for field in changes)
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f'UPDATE "user" SET {assignments} WHERE id = %s RETURNING {", ".join(SELECTION_FIELDS)}',
+                (*changes.values(), id_user)
+            )
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+
+        if row:
+            return jsonify(dict(zip(SELECTION_FIELDS, row))), 200
+        else:
+            return jsonify({"error": "Usuario no encontrado"}), 404
+    except Exception as e:
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -231,21 +350,19 @@ def update_banner_selected_by_id():
         if not user_id or not banner_selected:
             return jsonify({"error": "ID y banner_selected son requeridos"}), 400
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('UPDATE "user" SET banner_selected = %s WHERE id = %s', (banner_selected, user_id))
-        conn.commit()
-        updated = cur.rowcount
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('UPDATE "user" SET banner_selected = %s WHERE id = %s', (banner_selected, user_id))
+            conn.commit()
+            updated = cur.rowcount
+            cur.close()
 
         if updated:
             return jsonify({"message": "banner_selected actualizado correctamente"}), 200
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -267,21 +384,19 @@ def update_skin_selected_by_id():
         if not user_id or not skin_selected:
             return jsonify({"error": "ID y skin_selected son requeridos"}), 400
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('UPDATE "user" SET skin_selected = %s WHERE id = %s', (skin_selected, user_id))
-        conn.commit()
-        updated = cur.rowcount
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('UPDATE "user" SET skin_selected = %s WHERE id = %s', (skin_selected, user_id))
+            conn.commit()
+            updated = cur.rowcount
+            cur.close()
 
         if updated:
             return jsonify({"message": "skin_selected actualizado correctamente"}), 200
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -303,21 +418,19 @@ def update_aurum_money():
         if not user_id or num_aurum_money is None:
             return jsonify({"error": "ID y num_aurum_money son requeridos"}), 400
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('UPDATE "user" SET num_aurum_money = %s WHERE id = %s', (num_aurum_money, user_id))
-        conn.commit()
-        updated = cur.rowcount
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('UPDATE "user" SET num_aurum_money = %s WHERE id = %s', (num_aurum_money, user_id))
+            conn.commit()
+            updated = cur.rowcount
+            cur.close()
 
         if updated:
             return jsonify({"message": "num_aurum_money actualizado correctamente"}), 200
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -339,21 +452,80 @@ def update_voren_money():
         if not user_id or num_voren_money is None:
             return jsonify({"error": "ID y num_voren_money son requeridos"}), 400
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('UPDATE "user" SET num_voren_money = %s WHERE id = %s', (num_voren_money, user_id))
-        conn.commit()
-        updated = cur.rowcount
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('UPDATE "user" SET num_voren_money = %s WHERE id = %s', (num_voren_money, user_id))
+            conn.commit()
+            updated = cur.rowcount
+            cur.close()
 
         if updated:
             return jsonify({"message": "num_voren_money actualizado correctamente"}), 200
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
+        return jsonify({"error": str(e)}), 500
+
+# -----------------------------------------------------------------------------
+# POST /users/<id_user>/balance
+# Suma (o resta, con valores negativos) aurum y/o voren al usuario de forma
+# atómica en la base de datos, sin leer antes el saldo desde el cliente.
+# Ningún saldo puede quedar por debajo de 0: si alguno lo haría no se aplica
+# ninguno de los dos cambios.
+# Espera un JSON con 'aurum_delta' y/o 'voren_delta' (enteros).
+# Respuestas:
+#     200: { "num_aurum_money": ..., "num_voren_money": ... } (saldos nuevos)
+#     400: { "error": "Se requiere aurum_delta o voren_delta" }
+#     400: { "error": "<campo> debe ser un entero" }
+#     404: { "error": "Usuario no encontrado" }
+#     409: { "error": "Saldo insuficiente", "num_aurum_money": ..., "num_voren_money": ... }
+#     500: { "error": <mensaje de error> }
+# -----------------------------------------------------------------------------
+@users_bp.route('/users/<id_user>/balance', methods=['POST'])
+def adjust_user_balance(id_user):
+    try:
+        data = request.get_json(silent=True) or {}
+        if 'aurum_delta' not in data and 'voren_delta' not in data:
+            return jsonify({"error": "Se requiere aurum_delta o voren_delta"}), 400
+        deltas = {}
+        for field in ('aurum_delta', 'voren_delta'):
+            value = data.get(field, 0)
+            if not isinstance(value, int) or isinstance(value, bool):
+                return jsonify({"error": f"{field} debe ser un entero"}), 400
+            deltas[field] = value
+
+        with get_connection() as conn:
+            cur = conn.cursor()
+            # La condición del WHERE y la suma se evalúan sobre la misma versión
+            # de la fila, así que las recompensas concurrentes no se pisan
+            cur.execute("""
+                UPDATE "user"
+                SET num_aurum_money = COALESCE(num_aurum_money, 0) + %(aurum_delta)s,
+                    num_voren_money = COALESCE(num_voren_money, 0) + %(voren_delta)s
+                WHERE id = %(id_user)s
+                  AND COALESCE(num_aurum_money, 0) + %(aurum_delta)s >= 0
+                  AND COALESCE(num_voren_money, 0) + %(voren_delta)s >= 0
+                RETURNING num_aurum_money, num_voren_money""", {**deltas, 'id_user': id_user})
+            row = cur.fetchone()
+            conn.commit()
+            if row is None:
+                # Solo en el caso de fallo: distinguir usuario inexistente de saldo insuficiente
+                cur.execute('SELECT num_aurum_money, num_voren_money FROM "user" WHERE id = %s', (id_user,))
+                current = cur.fetchone()
+            cur.close()
+
+        if row:
+            return jsonify({"num_aurum_money": row[0], "num_voren_money": row[1]}), 200
+        if current:
+            return jsonify({
+                "error": "Saldo insuficiente",
+                "num_aurum_money": current[0],
+                "num_voren_money": current[1]
+            }), 409
+        return jsonify({"error": "Usuario no encontrado"}), 404
+    except Exception as e:
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -367,19 +539,17 @@ def update_voren_money():
 @users_bp.route('/get-aurum-by-id/<user_id>', methods=['GET'])
 def get_aurum_by_id(user_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT num_aurum_money FROM "user" WHERE id = %s', (user_id,))
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT num_aurum_money FROM "user" WHERE id = %s', (user_id,))
+            row = cur.fetchone()
+            cur.close()
         if row:
             return jsonify({"num_aurum_money": row[0]})
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -393,19 +563,17 @@ def get_aurum_by_id(user_id):
 @users_bp.route('/get-voren-by-id/<user_id>', methods=['GET'])
 def get_voren_by_id(user_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT num_voren_money FROM "user" WHERE id = %s', (user_id,))
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT num_voren_money FROM "user" WHERE id = %s', (user_id,))
+            row = cur.fetchone()
+            cur.close()
         if row:
             return jsonify({"num_voren_money": row[0]})
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -430,19 +598,17 @@ def update_name_by_id():
         if len(new_name) > 12:
             new_name = new_name[:12]
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('UPDATE "user" SET name = %s WHERE id = %s', (new_name, user_id))
-        conn.commit()
-        updated = cur.rowcount
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('UPDATE "user" SET name = %s WHERE id = %s', (new_name, user_id))
+            conn.commit()
+            updated = cur.rowcount
+            cur.close()
 
         if updated:
             return jsonify({"message": "Nombre actualizado correctamente"}), 200
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
@@ -1,9 +1,11 @@
 from flask import Blueprint, jsonify, request
 from utils import get_connection
-import json
+from prepared import execute_prepared
+import logging
 
 
 users_unlocks_bp = Blueprint('users_unlocks', __name__)
+logger = logging.getLogger(__name__)
 
 # -----------------------------------------------------------------------------
 # GET /get-user-unlocks/<user_id>
@@ -15,17 +17,16 @@ users_unlocks_bp = Blueprint('users_unlocks', __name__)
 @users_unlocks_bp.route('/get-user-unlocks/<user_id>', methods=['GET'])
 def get_user_unlocks(user_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM user_unlocks WHERE user_id = %s", (user_id,))
-        row = cur.fetchone()
-        if row:
-            column_names = [desc[0] for desc in cur.description]
-            result = dict(zip(column_names, row))
-        else:
-            result = {"message": "No se encontraron desbloqueos para el usuario"}
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            execute_prepared(cur, 'user_unlocks_by_user', (user_id,))
+            row = cur.fetchone()
+            if row:
+                # La fila entera como un único jsonb (ver HOT_STATEMENTS en prepared.py)
+                result = row[0]
+            else:
+                result = {"message": "No se encontraron desbloqueos para el usuario"}
+            cur.close()
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -42,25 +43,24 @@ def get_user_unlocks(user_id):
 def add_user_unlocks():
     try:
         data = request.json
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn:
+            cur = conn.cursor()
 
-        cur.execute("""
-            INSERT INTO user_unlocks (
-                user_id, icon_profile, banner_profile, skins_unlock, anim_victory, anim_lose
-            ) VALUES (%s, %s, %s, %s, %s, %s)
-        """, (
-            data['user_id'],
-            data.get('icon_profile', []),
-            data.get('banner_profile', []),
-            data.get('skins_unlock', []),
-            data.get('anim_victory', []),
-            data.get('anim_lose', [])
-        ))
+            cur.execute("""
+                INSERT INTO user_unlocks (
+                    user_id, icon_profile, banner_profile, skins_unlock, anim_victory, anim_lose
+                ) VALUES (%s, %s, %s, %s, %s, %s)
+            """, (
+                data['user_id'],
+                data.get('icon_profile', []),
+                data.get('banner_profile', []),
+                data.get('skins_unlock', []),
+                data.get('anim_victory', []),
+                data.get('anim_lose', [])
+            ))
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            conn.commit()
+            cur.close()
         return jsonify({"message": "Desbloqueos añadidos correctamente"}), 201
 
     except Exception as e:
@@ -85,21 +85,19 @@ def update_anim_victory_by_id():
         if not user_id or not anim_victory:
             return jsonify({"error": "ID y anim_victory son requeridos"}), 400
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('UPDATE "user" SET anim_victory = %s WHERE id = %s', (anim_victory, user_id))
-        conn.commit()
-        updated = cur.rowcount
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('UPDATE "user" SET anim_victory = %s WHERE id = %s', (anim_victory, user_id))
+            conn.commit()
+            updated = cur.rowcount
+            cur.close()
 
         if updated:
             return jsonify({"message": "anim_victory actualizado correctamente"}), 200
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -121,26 +119,71 @@ def update_anim_lose_by_id():
         if not user_id or not anim_lose:
             return jsonify({"error": "ID y anim_lose son requeridos"}), 400
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('UPDATE "user" SET anim_lose = %s WHERE id = %s', (anim_lose, user_id))
-        conn.commit()
-        updated = cur.rowcount
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('UPDATE "user" SET anim_lose = %s WHERE id = %s', (anim_lose, user_id))
+            conn.commit()
+            updated = cur.rowcount
+            cur.close()
 
         if updated:
             return jsonify({"message": "anim_lose actualizado correctamente"}), 200
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
     
-def python_list_to_pg_array(py_list):
-    # Convierte una lista de Python a formato array de PostgreSQL
-    return '{' + ','.join('"{}"'.format(str(x).replace('"', '\"')) for x in py_list) + '}'
+# -----------------------------------------------------------------------------
+# DESBLOQUEOS ATÓMICOS
+# Cada categoría de cosmético se guarda en una columna array de user_unlocks.
+# Los valores se añaden en el servidor con una sola sentencia que solo modifica
+# la fila si el valor no estaba ya, de modo que dos desbloqueos simultáneos no
+# se pisan (el segundo UPDATE espera al bloqueo de fila y reevalúa el WHERE).
+# UNLOCK_COLUMNS relaciona el campo del JSON de entrada con su columna.
+# -----------------------------------------------------------------------------
+UNLOCK_COLUMNS = {
+    'icon_profile': 'icon_profile',
+    'banner_profile': 'banner_profile',
+    'skin_unlock': 'skins_unlock',
+    'skins_unlock': 'skins_unlock',
+    'anim_victory': 'anim_victory',
+    'anim_lose': 'anim_lose',
+}
+
+
+# -----------------------------------------------------------------------------
+# MÉTODO AUXILIAR
+# Añade un valor a una columna de desbloqueos si no estaba ya (una sentencia).
+# No hace commit.
+# Parámetros:
+#   cur: Cursor de la conexión en curso.
+#   column (str): Columna de user_unlocks (valor de UNLOCK_COLUMNS).
+#   user_id (str): Id del usuario.
+#   value: Cosmético a añadir (se guarda como texto).
+# -----------------------------------------------------------------------------
+def append_unlock(cur, column, user_id, value):
+    value = str(value)
+    cur.execute(f"""
+        UPDATE user_unlocks
+        SET {column} = array_append(COALESCE({column}, '{{}}'), %s)
+        WHERE user_id = %s AND NOT (%s = ANY(COALESCE({column}, '{{}}')))""", (value, user_id, value))
+
+
+# Lógica común de los endpoints que añaden un único cosmético.
+def add_single_unlock(field, success_message):
+    data = request.json
+    user_id = data.get('user_id')
+    value = data.get(field)
+    if not user_id or value is None:
+        return jsonify({"error": f"user_id y {field} son requeridos"}), 400
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+        append_unlock(cur, UNLOCK_COLUMNS[field], user_id, value)
+        conn.commit()
+        cur.close()
+    return jsonify({"message": success_message}), 200
 
 # -----------------------------------------------------------------------------
 # POST /add-icon-profile
@@ -154,31 +197,9 @@ def python_list_to_pg_array(py_list):
 @users_unlocks_bp.route('/add-icon-profile', methods=['POST'])
 def add_icon_profile():
     try:
-        data = request.json
-        user_id = data.get('user_id')
-        new_icon = data.get('icon_profile')
-        if not user_id or new_icon is None:
-            return jsonify({"error": "user_id y icon_profile son requeridos"}), 400
-
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT icon_profile FROM user_unlocks WHERE user_id = %s', (user_id,))
-        row = cur.fetchone()
-        icons = row[0] if row and row[0] else []
-        if isinstance(icons, str):
-            # Convierte el string de PostgreSQL array a lista de Python
-            icons = [x.strip('"') for x in icons.strip('{}').split(',')] if icons else []
-        if new_icon not in icons:
-            icons.append(new_icon)
-            pg_array = python_list_to_pg_array(icons)
-            cur.execute('UPDATE user_unlocks SET icon_profile = %s WHERE user_id = %s', (pg_array, user_id))
-            conn.commit()
-        cur.close()
-        conn.close()
-        return jsonify({"message": "Icono añadido correctamente"}), 200
+        return add_single_unlock('icon_profile', "Icono añadido correctamente")
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -193,30 +214,9 @@ def add_icon_profile():
 @users_unlocks_bp.route('/add-banner-profile', methods=['POST'])
 def add_banner_profile():
     try:
-        data = request.json
-        user_id = data.get('user_id')
-        new_banner = data.get('banner_profile')
-        if not user_id or new_banner is None:
-            return jsonify({"error": "user_id y banner_profile son requeridos"}), 400
-
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT banner_profile FROM user_unlocks WHERE user_id = %s', (user_id,))
-        row = cur.fetchone()
-        banners = row[0] if row and row[0] else []
-        if isinstance(banners, str):
-            banners = [x.strip('"') for x in banners.strip('{}').split(',')] if banners else []
-        if new_banner not in banners:
-            banners.append(new_banner)
-            pg_array = python_list_to_pg_array(banners)
-            cur.execute('UPDATE user_unlocks SET banner_profile = %s WHERE user_id = %s', (pg_array, user_id))
-            conn.commit()
-        cur.close()
-        conn.close()
-        return jsonify({"message": "Banner añadido correctamente"}), 200
+        return add_single_unlock('banner_profile', "Banner añadido correctamente")
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -231,30 +231,9 @@ def add_banner_profile():
 @users_unlocks_bp.route('/add-skin-unlock', methods=['POST'])
 def add_skin_unlock():
     try:
-        data = request.json
-        user_id = data.get('user_id')
-        new_skin = data.get('skin_unlock')
-        if not user_id or new_skin is None:
-            return jsonify({"error": "user_id y skin_unlock son requeridos"}), 400
-
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT skins_unlock FROM user_unlocks WHERE user_id = %s', (user_id,))
-        row = cur.fetchone()
-        skins = row[0] if row and row[0] else []
-        if isinstance(skins, str):
-            skins = [x.strip('"') for x in skins.strip('{}').split(',')] if skins else []
-        if new_skin not in skins:
-            skins.append(new_skin)
-            pg_array = python_list_to_pg_array(skins)
-            cur.execute('UPDATE user_unlocks SET skins_unlock = %s WHERE user_id = %s', (pg_array, user_id))
-            conn.commit()
-        cur.close()
-        conn.close()
-        return jsonify({"message": "Skin añadido correctamente"}), 200
+        return add_single_unlock('skin_unlock', "Skin añadido correctamente")
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -269,30 +248,9 @@ def add_skin_unlock():
 @users_unlocks_bp.route('/add-anim-victory', methods=['POST'])
 def add_anim_victory():
     try:
-        data = request.json
-        user_id = data.get('user_id')
-        new_anim = data.get('anim_victory')
-        if not user_id or new_anim is None:
-            return jsonify({"error": "user_id y anim_victory son requeridos"}), 400
-
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT anim_victory FROM user_unlocks WHERE user_id = %s', (user_id,))
-        row = cur.fetchone()
-        anims = row[0] if row and row[0] else []
-        if isinstance(anims, str):
-            anims = [x.strip('"') for x in anims.strip('{}').split(',')] if anims else []
-        if new_anim not in anims:
-            anims.append(new_anim)
-            pg_array = python_list_to_pg_array(anims)
-            cur.execute('UPDATE user_unlocks SET anim_victory = %s WHERE user_id = %s', (pg_array, user_id))
-            conn.commit()
-        cur.close()
-        conn.close()
-        return jsonify({"message": "Animación de victoria añadida correctamente"}), 200
+        return add_single_unlock('anim_victory', "Animación de victoria añadida correctamente")
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error no controlado")
         return jsonify({"error": str(e)}), 500
 
 # -----------------------------------------------------------------------------
@@ -306,29 +264,70 @@ def add_anim_victory():
 # -----------------------------------------------------------------------------
 @users_unlocks_bp.route('/add-anim-lose', methods=['POST'])
 def add_anim_lose():
+    try:
+        return add_single_unlock('anim_lose', "Animación de derrota añadida correctamente")
+    except Exception as e:
+        logger.exception("Error no controlado")
+        return jsonify({"error": str(e)}), 500
+
+# -----------------------------------------------------------------------------
+# POST /add-unlocks
+# Concede varios cosméticos de varias categorías a un usuario en una sola
+# sentencia y transacción. Cada categoría admite un valor o una lista; los
+# valores que el usuario ya tenga se ignoran.
+# Espera un JSON con 'user_id' y cualquier combinación de 'icon_profile',
+# 'banner_profile', 'skins_unlock' (o 'skin_unlock'), 'anim_victory' y 'anim_lose'.
+# Respuestas:
+#     200: { "message": "Desbloqueos añadidos correctamente", "unlocks": <desbloqueos actualizados> }
+#     400: { "error": "user_id y al menos un desbloqueo son requeridos" }
+#     404: { "error": "Usuario no encontrado" }
+#     500: { "error": <mensaje de error> }
+# -----------------------------------------------------------------------------
+@users_unlocks_bp.route('/add-unlocks', methods=['POST'])
+def add_unlocks():
     try:
         data = request.json
         user_id = data.get('user_id')
-        new_anim = data.get('anim_lose')
-        if not user_id or new_anim is None:
-            return jsonify({"error": "user_id y anim_lose son requeridos"}), 400
+        grants = {}
+        for field, column in UNLOCK_COLUMNS.items():
+            values = data.get(field)
+            if values is None:
+                continue
+            for value in (values if isinstance(values, list) else [values]):
+                column_values = grants.setdefault(column, [])
+                if str(value) not in column_values:
+                    column_values.append(str(value))
+        grants = {column: values for column, values in grants.items() if values}
+        if not user_id or not grants:
+            return jsonify({"error": "user_id y al menos un desbloqueo son requeridos"}), 400
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT anim_lose FROM user_unlocks WHERE user_id = %s', (user_id,))
-        row = cur.fetchone()
-        anims = row[0] if row and row[0] else []
-        if isinstance(anims, str):
-            anims = [x.strip('"') for x in anims.strip('{}').split(',')] if anims else []
-        if new_anim not in anims:
-            anims.append(new_anim)
-            pg_array = python_list_to_pg_array(anims)
-            cur.execute('UPDATE user_unlocks SET anim_lose = %s WHERE user_id = %s', (pg_array, user_id))
+        # Cada columna añade, en orden, los valores recibidos que aún no tenga
+        assignments = []
+        params = []
+        for column, values in grants.items():
+            assignments.append(f"""{column} = COALESCE({column}, '{{}}') || ARRAY(
+                SELECT v FROM unnest(%s::text[]) WITH ORDINALITY AS t(v, i)
+                WHERE NOT (v = ANY(COALESCE({column}, '{{}}')))
+                ORDER BY i)""")
+            params.append(values)
+        params.append(user_id)
+
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                UPDATE user_unlocks SET {", ".join(assignments)}
+                WHERE user_id = %s
+                RETURNING *""", tuple(params))
+            row = cur.fetchone()
+            if row:
+                column_names = [desc[0] for desc in cur.description]
+                unlocks = dict(zip(column_names, row))
             conn.commit()
-        cur.close()
-        conn.close()
-        return jsonify({"message": "Animación de derrota añadida correctamente"}), 200
+            cur.close()
+
+        if not row:
+            return jsonify({"error": "Usuario no encontrado"}), 404
+        return jsonify({"message": "Desbloqueos añadidos correctamente", "unlocks": unlocks}), 200
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        logger.exception("Error no controlado")
+        return jsonify({"error": str(e)}), 500
@@ -1,11 +1,78 @@
-import psycopg2
+from flask import current_app, g, has_app_context
+from db_pool import get_pool
 import os
+import uuid
 
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+
+# -----------------------------------------------------------------------------
+# Devuelve una conexión del pool del worker.
+# Uso recomendado:
+#     with get_connection() as conn:
+#         cur = conn.cursor()
+#         ...
+# Al salir del bloque (o al llamar a conn.close()) la conexión vuelve al pool.
+# Dentro de una petición queda además registrada en flask.g, y el teardown de la
+# app la devuelve si un handler termina por una excepción sin liberarla.
+# -----------------------------------------------------------------------------
 def get_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        sslmode=os.getenv("DB_SSLMODE")
-    )
+    conn = get_pool().connection()
+    if has_app_context():
+        g.setdefault('_db_connections', []).append(conn)
+    return conn
+
+
+def release_request_connections(exc=None):
+    for conn in g.pop('_db_connections', []):
+        conn.close()
+
+
+# -----------------------------------------------------------------------------
+# Devuelve una respuesta que envía el resultado de una consulta como un array
+# JSON por trozos, sin cargar la tabla entera en memoria.
+# Usa un cursor con nombre (server-side) y lee las filas en lotes de
+# STREAM_BATCH_SIZE con fetchmany. El primer lote se lee antes de devolver la
+# respuesta, así los errores de la consulta siguen llegando como excepción al
+# handler. La conexión queda prestada hasta que termina el envío y vuelve al pool
+# al cerrar la respuesta (call_on_close), también si el cuerpo no se llega a
+# enviar: peticiones HEAD o clientes que cortan antes de leerlo, casos en los
+# que el generador nunca arranca y su finally no se ejecuta.
+# Parámetros:
+#   sql (str): Consulta a ejecutar.
+#   params (tuple): Parámetros de la consulta.
+#   make_item (callable, opcional): Convierte cada fila en el objeto a serializar.
+#       Por defecto, un dict {columna: valor}.
+# -----------------------------------------------------------------------------
+def stream_json_array(sql, params=(), make_item=None):
+    conn = get_pool().connection()
+    try:
+        cur = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cur.itersize = STREAM_BATCH_SIZE
+        cur.execute(sql, params)
+        rows = cur.fetchmany(STREAM_BATCH_SIZE)
+        column_names = [desc[0] for desc in cur.description]
+    except Exception:
+        conn.close()
+        raise
+    if make_item is None:
+        make_item = lambda row: dict(zip(column_names, row))
+    json_provider = current_app.json
+
+    def generate(rows):
+        try:
+            yield "["
+            separator = ""
+            while rows:
+                yield separator + ",".join(json_provider.dumps(make_item(row), separators=(",", ":")) for row in rows)
+                separator = ","
+                rows = cur.fetchmany(STREAM_BATCH_SIZE)
+            yield "]\n"
+            cur.close()
+        finally:
+            conn.close()
+
+    response = current_app.response_class(generate(rows), mimetype="application/json")
+    # conn.close() es idempotente: la conexión se devuelve una sola vez
+    response.call_on_close(conn.close)
+    return response